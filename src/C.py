@@ -1,3 +1,7 @@
+SUPERBLOCK_LIMIT = 256  # 超級區塊最多的指令數
+SUPERBLOCK_JOINS = 2  # 超級區塊最多經過的分支目標數（限制從不同入口重複翻譯的程式碼量）
+
+
 class CPU:
     def __init__(self):
         # 初始化暫存器和記憶體
@@ -6,9 +10,17 @@ class CPU:
         self.pc = 0  # 程式計數器
         self.instructions = []  # 儲存解析後的指令
         self.result_log = []  # 執行過程記錄
+        self.executed = 0  # 已執行的指令數
+        self.block_cache = {}  # 基本區塊起點 -> (編譯後的函式, 指令數)
+        self.step_cache = {}  # 單一指令 -> (編譯後的函式, 1)
+        self.word_addressed = False  # True 時 memory 以 word 為索引，翻譯的程式碼以 位址 // 4 存取
+        self.branch_targets = None  # BEQ/JUMP 的目標，翻譯超級區塊時計算
 
     def load_instructions(self, instructions):
         self.instructions = instructions
+        self.branch_targets = None
+        self.block_cache.clear()
+        self.step_cache.clear()
 
     def execute(self):
         while self.pc < len(self.instructions):
@@ -16,6 +28,109 @@ class CPU:
             self.pc += 1
             self.run_instruction(instruction)
 
+    def execute_fast(self, max_instructions=None):
+        """
+        功能模式：以超級區塊為單位執行，不輸出除錯訊息也不記錄每一步。
+        每個區塊只翻譯一次並快取，之後直接呼叫編譯好的函式。
+        Returns:
+            int: 本次執行的指令數。
+        """
+        registers = self.registers
+        memory = self.memory
+        blocks = self.block_cache
+        n = len(self.instructions)
+        pc = self.pc
+        count = 0
+        while pc < n:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self.translate_block(pc, superblock=True)
+            if max_instructions is not None and count + block[1] > max_instructions:
+                break
+            pc, executed = block[0](registers, memory)
+            count += executed
+
+        # 剩餘不足一個區塊的指令逐條執行
+        if max_instructions is not None:
+            steps = self.step_cache
+            while pc < n and count < max_instructions:
+                step = steps.get(pc)
+                if step is None:
+                    step = steps[pc] = self.translate_block(pc, limit=1)
+                pc = step[0](registers, memory)
+                count += 1
+
+        self.pc = pc
+        self.executed += count
+        return count
+
+    def translate_block(self, start, limit=None, superblock=False):
+        """
+        將從 start 開始的基本區塊（到 BEQ/JUMP 或程式結尾為止）翻譯成 Python 函式。
+        superblock 為 True 時 BEQ 不結束區塊，跳躍時才提前回傳；經過 SUPERBLOCK_JOINS 個分支目標、
+        SUPERBLOCK_LIMIT 條指令、一定跳躍的 BEQ 或 JUMP 時結束，函式回傳 (下一個 pc, 執行的指令數)。
+        Returns:
+            tuple: (函式(registers, memory) -> 下一個 pc, 區塊指令數（超級區塊為最多的指令數）)
+        """
+        if superblock:
+            if self.branch_targets is None:
+                self.branch_targets = self.find_branch_targets()
+            limit = SUPERBLOCK_LIMIT if limit is None else limit
+        joins = 0
+        lines = ["def block(r, m):"]
+        pc = start
+        while True:
+            instruction = self.instructions[pc]
+            opcode = instruction["opcode"]
+            operands = instruction["operands"]
+            pc += 1
+            if opcode in ("ADD", "SUB"):
+                rd, rs, rt = self.parse_registers(operands)
+                operator = "+" if opcode == "ADD" else "-"
+                lines.append(f"    r[{rd}] = r[{rs}] {operator} r[{rt}]")
+            elif opcode in ("LW", "SW"):
+                rt = self.parse_register(operands[0])
+                offset, base = self.parse_memory_operand(operands[1])
+                address = f"(r[{base}] + {offset}) // 4" if self.word_addressed else f"r[{base}] + {offset}"
+                if opcode == "LW":
+                    lines.append(f"    r[{rt}] = m[{address}]")
+                else:
+                    lines.append(f"    m[{address}] = r[{rt}]")
+            elif opcode == "BEQ":
+                rs, rt, offset = self.parse_registers_with_offset(operands)
+                lines.append(f"    if r[{rs}] == r[{rt}]:")
+                if not superblock:
+                    lines.append(f"        return {pc + offset}")
+                    break
+                lines.append(f"        return {pc + offset}, {pc - start}")
+                if rs == rt:
+                    break
+            elif opcode == "JUMP":
+                lines.append(f"    return {int(operands[0])}" + (f", {pc - start}" if superblock else ""))
+                break
+            # 區塊在程式結尾結束；負的 pc 與 run_instruction 一樣逐條處理
+            if pc >= len(self.instructions) or pc <= 0 or (limit is not None and pc - start >= limit):
+                break
+            if superblock and pc in self.branch_targets:
+                joins += 1
+                if joins > SUPERBLOCK_JOINS:
+                    break
+        lines.append(f"    return {pc}, {pc - start}" if superblock else f"    return {pc}")
+
+        namespace = {}
+        exec(compile("\n".join(lines), f"<block {start}>", "exec"), namespace)
+        return namespace["block"], pc - start
+
+    def find_branch_targets(self):
+        """所有 BEQ 與 JUMP 的目標 pc"""
+        targets = set()
+        for pc, instruction in enumerate(self.instructions):
+            if instruction["opcode"] == "BEQ":
+                targets.add(pc + 1 + self.parse_registers_with_offset(instruction["operands"])[2])
+            elif instruction["opcode"] == "JUMP":
+                targets.add(int(instruction["operands"][0]))
+        return targets
+
     def run_instruction(self, instruction):
         opcode = instruction["opcode"]
         operands = instruction["operands"]
@@ -84,12 +199,15 @@ class CPU:
 
 def parse_instruction(line):
     parts = line.split()
-    opcode = parts[0]
+    opcode = parts[0].upper()  # 指令統一為大寫
     operands = parts[1:] if len(parts) > 1 else []
     return {"opcode": opcode, "operands": operands}
 
 
 if __name__ == "__main__":
+    import sys
+
+    fast = "--fast" in sys.argv[1:]  # 功能模式：只計算最終狀態
     cpu = CPU()
     instructions = []
 
@@ -103,5 +221,8 @@ if __name__ == "__main__":
         instructions.append(parse_instruction(line))
 
     cpu.load_instructions(instructions)
-    cpu.execute()
+    if fast:
+        cpu.execute_fast()
+    else:
+        cpu.execute()
     cpu.print_results()
@@ -0,0 +1,118 @@
+import argparse
+
+from program import OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, DecodedProgram
+
+PIPELINE_DEPTH = 5  # 第一條指令需要 5 個週期才寫回
+
+
+def straight_line_stalls(program):
+    """
+    無分支程式的停頓數。
+    沒有 beq 時只有 Load-Use Hazard：add/sub 緊接在寫入其來源暫存器的 lw 之後才停頓一次，
+    且停頓後插入的 bubble 只影響 MEM/WB，不會造成第二次停頓。
+    """
+    return sum(1 for reads, loads in zip(program.alu_reads[1:], program.load_writes) if reads & loads)
+
+
+def branch_path_cycles(program, max_instructions=None):
+    """
+    含 beq 的程式：以功能模擬決定每個分支的結果，週期數則由停頓規則逐條指令累加，不逐週期模擬。
+    功能模擬重現流水線可見的暫存器值：lw/sw 的 base 若由前一條 lw 寫入，EX 讀到的是舊值。
+    Returns:
+        tuple: (總週期數, 停頓數, 執行的指令數)
+    """
+    opcode = program.opcode
+    dest, src1, src2, base, offset = program.dest, program.src1, program.src2, program.base, program.offset
+    hazard = program.hazard
+    n = len(program)
+    registers = [1] * 32
+    registers[0] = 0
+    memory = [1] * 32
+
+    ex_mem = mem_wb = None  # 指令進入 EX 時 EX/MEM、MEM/WB 中的指令
+    ex_cycle = PIPELINE_DEPTH - 3  # 上一條指令進入 EX 的週期
+    bubble = 0  # 上一條指令是跳躍的 beq 時多一個空泡
+    stalls = 0
+    executed = 0
+    load_old = None  # 前一條 lw 寫入前的暫存器值
+    pc = 0
+    while pc < n:
+        if max_instructions is not None and executed >= max_instructions:
+            raise RuntimeError(f"program did not finish within {max_instructions} instructions")
+        i = pc
+        pc += 1
+        executed += 1
+
+        # 時序：停頓時 EX/MEM 變成空泡，原本的指令移到 MEM/WB
+        stall = 0
+        while hazard(i, ex_mem, mem_wb):
+            stall += 1
+            mem_wb, ex_mem = ex_mem, None
+        stalls += stall
+        ex_cycle += 1 + stall + bubble
+        bubble = 0
+        stale_base = ex_mem is not None and opcode[ex_mem] == OP_LW
+        mem_wb, ex_mem = ex_mem, i
+
+        # 功能模擬
+        op = opcode[i]
+        if op == OP_ADD:
+            registers[dest[i]] = registers[src1[i]] + registers[src2[i]]
+        elif op == OP_SUB:
+            registers[dest[i]] = registers[src1[i]] - registers[src2[i]]
+        elif op == OP_BEQ:
+            if registers[src1[i]] == registers[src2[i]]:
+                # 與 execute_cycle 相同：pc 先減 1 再加 offset，最後一條指令沒有抓下一條
+                pc = (i + 1 if i + 1 < n else i) + offset[i]
+                bubble = 1
+                mem_wb, ex_mem = i, None
+        else:
+            address_base = registers[base[i]]
+            if stale_base and dest[mem_wb] == base[i]:
+                address_base = load_old
+            address = (address_base + offset[i]) // 4
+            if op == OP_LW:
+                load_old = registers[dest[i]]
+                registers[dest[i]] = memory[address]
+            elif op == OP_SW:
+                memory[address] = registers[dest[i]]
+
+    cycles = ex_cycle + 2 if executed else 0
+    return cycles, stalls, executed
+
+
+def estimate(instructions, max_instructions=None):
+    """
+    不逐週期模擬，直接計算 Total Cycles 與停頓數。
+    無分支的程式以 5 + N - 1 + 停頓數 的公式計算；含 beq 的程式因為分支結果取決於暫存器值，
+    改用 branch_path_cycles 沿著實際執行路徑累加。
+    Args:
+        instructions: parse_instruction 的結果或 DecodedProgram。
+    Returns:
+        dict: {"cycles": 總週期數, "stalls": 停頓數, "method": "analytic" 或 "path"}
+    """
+    if not isinstance(instructions, DecodedProgram):
+        instructions = DecodedProgram.from_instructions(instructions)
+    n = len(instructions)
+
+    if OP_BEQ not in instructions.opcode:
+        if n == 0:
+            return {"cycles": 0, "stalls": 0, "method": "analytic"}
+        stalls = straight_line_stalls(instructions)
+        return {"cycles": PIPELINE_DEPTH + n - 1 + stalls, "stalls": stalls, "method": "analytic"}
+
+    cycles, stalls, _ = branch_path_cycles(instructions, max_instructions)
+    return {"cycles": cycles, "stalls": stalls, "method": "path"}
+
+
+if __name__ == "__main__":
+    from main import load_program
+
+    parser = argparse.ArgumentParser(description="不逐週期模擬，直接估算總週期數與停頓數")
+    parser.add_argument("programs", nargs="+", help="指令檔")
+    parser.add_argument("--max-instructions", type=int, default=None, help="執行指令數上限（避免無窮迴圈）")
+    args = parser.parse_args()
+
+    for path in args.programs:
+        result = estimate(load_program(path), args.max_instructions)
+        print(f"{path}: Total Cycles: {result['cycles']} Stalls: {result['stalls']} ({result['method']})")
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import marshal
+import os
+import re
+import time
+from array import array
+from pathlib import Path
+
+from program import CONTROL_BITS, NO_REG, OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, DecodedProgram
+
+CACHE_VERSION = 1  # 組譯規則或快取格式改變時遞增，舊的快取即失效
+REGISTER_COUNT = 32
+MNEMONICS = {"add": OP_ADD, "sub": OP_SUB, "lw": OP_LW, "sw": OP_SW, "beq": OP_BEQ}
+OPERAND_COUNTS = {OP_ADD: 3, OP_SUB: 3, OP_LW: 2, OP_SW: 2, OP_BEQ: 3}
+
+_LABEL = re.compile(r"\s*([A-Za-z_][\w.]*)\s*:")
+_MEMORY_OPERAND = re.compile(r"^(.*?)\s*\(\s*(\$?\w+)\s*\)$")
+# 暫存器名稱（有無 $ 皆可）-> 編號
+_REGISTERS = {f"{prefix}{number}": number for number in range(REGISTER_COUNT) for prefix in ("$", "")}
+
+
+class AssemblyError(ValueError):
+    """組譯錯誤：訊息包含 檔名:行:欄、原始的那一行與指出位置的 ^（沒有 line 時只有 檔名:行）"""
+
+    def __init__(self, message, path, line_number, column=None, line=None):
+        self.path = path
+        self.line_number = line_number
+        self.column = column
+        if line is None:
+            super().__init__(f"{path}:{line_number}: {message}")
+        else:
+            super().__init__(f"{path}:{line_number}:{column + 1}: {message}\n    {line.rstrip()}\n    {' ' * column}^")
+
+
+class Assembly:
+    """
+    組譯結果：program 為 DecodedProgram；.data 的初始值依序保存在 data_words（word 索引）、
+    data_values 與 data_lines（來源行號，錯誤訊息用）；labels 為 名稱 -> 指令索引，data_labels 為 名稱 -> 位元組位址。
+    """
+
+    __slots__ = ("path", "program", "data_words", "data_values", "data_lines", "labels", "data_labels")
+
+    def __init__(self, path="<input>"):
+        self.path = path
+        self.program = DecodedProgram()
+        self.data_words = array("q")
+        self.data_values = array("q")
+        self.data_lines = array("I")
+        self.labels = {}
+        self.data_labels = {}
+
+    def initialize(self, memory):
+        """將 .data 的初始值寫入 memory（list 或 PagedMemory，以 word 為索引）"""
+        size = len(memory)
+        for word, value, line_number in zip(self.data_words, self.data_values, self.data_lines):
+            if not 0 <= word < size:
+                raise AssemblyError(
+                    f".data address {word * 4:#x} is outside the {size}-word memory (use --paged-memory for the full address space)",
+                    self.path, line_number,
+                )
+            memory[word] = value
+
+
+class _Line:
+    """組譯中的一行：錯誤訊息用的位置資訊"""
+
+    __slots__ = ("path", "number", "text")
+
+    def __init__(self, path, number, text):
+        self.path = path
+        self.number = number
+        self.text = text
+
+    def error(self, message, token=None, start=0):
+        column = self.text.find(token, start) if token else -1
+        if column < 0:
+            column = len(self.text) - len(self.text.lstrip())
+        return AssemblyError(message, self.path, self.number, column, self.text)
+
+
+def _register(token, line):
+    number = _REGISTERS.get(token)
+    if number is None:
+        name = token[1:] if token.startswith("$") else token
+        if name.isdigit() and int(name) < REGISTER_COUNT:
+            return int(name)  # 前導 0（"$01"）
+        raise line.error(f"bad register {token!r} (expected $0-${REGISTER_COUNT - 1})", token)
+    return number
+
+
+def _split(text):
+    """以逗號或空白分隔的運算元"""
+    return text.replace(",", " ").split()
+
+
+def _number(token, line):
+    try:
+        return int(token, 0)
+    except ValueError:
+        pass
+    # int(x, 0) 不接受前導 0 的十進位（"08"），與 parse_instruction 相同當作十進位
+    try:
+        return int(token)
+    except ValueError:
+        raise line.error(f"bad number {token!r}", token) from None
+
+
+def assemble(source, path="<input>"):
+    """
+    組譯 source（str）並回傳 Assembly。
+    語法：每行最多一條指令，`#` 之後為註解；`名稱:` 定義 label；`.text`、`.data [位址]` 切換區段，
+    `.data` 中以 `.word 值, ...` 與 `.space 位元組數` 配置記憶體（位元組位址，須對齊 4）。
+    beq 的第三個運算元可以是 label，lw/sw 的 offset 可以是 .data 的 label（`lw $1, value` 等同 `lw $1, value($0)`）。
+    """
+    assembly = Assembly(path)
+    labels = assembly.labels
+    data_labels = assembly.data_labels
+    pending = []  # (指令索引, opcode, 運算元, _Line)：需要 label 的指令在第二趟填入
+    section = ".text"
+    data_address = 0
+
+    for number, text in enumerate(source.splitlines(), 1):
+        code = text.split("#", 1)[0]
+        if not code or code.isspace():
+            continue
+        line = _Line(path, number, text)
+        position = 0
+        while ":" in code:
+            match = _LABEL.match(code, position)
+            if match is None:
+                break
+            name = match.group(1)
+            if name in labels or name in data_labels:
+                raise line.error(f"duplicate label {name!r}", name)
+            if section == ".text":
+                labels[name] = len(assembly.program)
+            else:
+                data_labels[name] = data_address
+            position = match.end()
+        code = code[position:].strip()
+        if not code:
+            continue
+
+        if code[0] == ".":
+            directive, *rest = code.split(None, 1)
+            rest = rest[0] if rest else ""
+            directive = directive.lower()
+            arguments = _split(rest)
+            if directive == ".text":
+                if arguments:
+                    raise line.error(".text takes no arguments", arguments[0])
+                section = ".text"
+            elif directive == ".data":
+                if len(arguments) > 1:
+                    raise line.error(".data takes at most one address", arguments[1])
+                section = ".data"
+                if arguments:
+                    data_address = _number(arguments[0], line)
+                    if data_address % 4:
+                        raise line.error(f".data address {data_address:#x} is not word aligned", arguments[0])
+            elif directive in (".word", ".space"):
+                if section != ".data":
+                    raise line.error(f"{directive} outside .data", directive)
+                if not arguments:
+                    raise line.error(f"{directive} needs an argument", directive)
+                if directive == ".word":
+                    for token in arguments:
+                        assembly.data_words.append(data_address // 4)
+                        assembly.data_values.append(_number(token, line))
+                        assembly.data_lines.append(number)
+                        data_address += 4
+                else:
+                    if len(arguments) > 1:
+                        raise line.error(".space takes one size", arguments[1])
+                    size = _number(arguments[0], line)
+                    if size < 0 or size % 4:
+                        raise line.error(f".space size {size} is not a non-negative multiple of 4", arguments[0])
+                    data_address += size
+            else:
+                raise line.error(f"unknown directive {directive!r} (expected .text, .data, .word or .space)", directive)
+            continue
+
+        if section != ".text":
+            raise line.error("instruction in .data section (add .text first)", code.split()[0])
+        mnemonic, *rest = code.split(None, 1)
+        rest = rest[0] if rest else ""
+        op = MNEMONICS.get(mnemonic.lower())
+        if op is None:
+            raise line.error(f"unknown instruction {mnemonic!r} (expected {', '.join(MNEMONICS)})", mnemonic)
+        if op in (OP_LW, OP_SW):
+            # lw/sw：第二個運算元可能是 "8($0)"、"8 ( $0 )" 或 label，先以第一個逗號切開
+            first, comma, second = rest.partition(",")
+            operands = [first.strip(), second.strip()] if comma else _split(rest)
+        else:
+            operands = _split(rest)
+        if len(operands) != OPERAND_COUNTS[op]:
+            raise line.error(f"{mnemonic} expects {OPERAND_COUNTS[op]} operands, got {len(operands)}", mnemonic)
+
+        program = assembly.program
+        if op <= OP_SUB:
+            program.add(op, CONTROL_BITS[op], _register(operands[0], line), _register(operands[1], line), _register(operands[2], line))
+        elif op == OP_BEQ:
+            source1, source2 = _register(operands[0], line), _register(operands[1], line)
+            target = operands[2]
+            if target.lstrip("+-")[:1].isdigit():
+                program.add(op, CONTROL_BITS[op], NO_REG, source1, source2, NO_REG, _number(target, line))
+            else:
+                pending.append((len(program), op, target, line))
+                program.add(op, CONTROL_BITS[op], NO_REG, source1, source2, NO_REG, 0)
+        else:
+            register = _register(operands[0], line)
+            match = _MEMORY_OPERAND.match(operands[1])
+            offset, base = (match.group(1), _register(match.group(2), line)) if match else (operands[1], 0)
+            if not offset:
+                offset = "0"
+            if offset.lstrip("+-")[:1].isdigit():
+                program.add(op, CONTROL_BITS[op], register, NO_REG, NO_REG, base, _number(offset, line))
+            else:
+                pending.append((len(program), op, offset, line))
+                program.add(op, CONTROL_BITS[op], register, NO_REG, NO_REG, base, 0)
+
+    # 第二趟：填入 label
+    program = assembly.program
+    for index, op, name, line in pending:
+        if op == OP_BEQ:
+            if name not in labels:
+                raise line.error(f"undefined label {name!r}" + (" (beq needs a .text label)" if name in data_labels else ""), name)
+            # 與 CPU.branch_target 相反：目標為 index + 1 + offset，最後一條指令則為 index + offset
+            program.offset[index] = labels[name] - index - (index + 1 < len(program))
+        else:
+            if name not in data_labels:
+                raise line.error(f"undefined label {name!r}" + (" (lw/sw need a .data label)" if name in labels else ""), name)
+            program.offset[index] = data_labels[name]
+    return assembly
+
+
+def cache_directory():
+    """
+    組譯快取的位置。只有設定 MIPS_ASM_CACHE 時才使用：值為 on 時為 $XDG_CACHE_HOME/mips-simulator/asm
+    （預設 ~/.cache/mips-simulator/asm），否則為該資料夾。未設定或設為 off 時回傳 None。
+    """
+    directory = os.environ.get("MIPS_ASM_CACHE")
+    if not directory or directory.lower() in ("off", "0", "none"):
+        return None
+    if directory.lower() in ("on", "1"):
+        return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "mips-simulator" / "asm"
+    return Path(directory)
+
+
+def _layout():
+    """快取檔中各欄位陣列的 typecode：DecodedProgram 的格式改變時快取自動失效"""
+    program = DecodedProgram()
+    return ",".join(f"{name}:{getattr(program, name).typecode}" for name in DecodedProgram.__slots__)
+
+
+_LAYOUT = _layout()
+
+
+def cache_key(source):
+    """source（bytes）的快取鍵"""
+    digest = hashlib.sha256(f"{CACHE_VERSION};{_LAYOUT};".encode())
+    digest.update(source)
+    return digest.hexdigest()
+
+
+def _dump(assembly):
+    program = assembly.program
+    return marshal.dumps((
+        _LAYOUT,
+        tuple(getattr(program, name).tobytes() for name in DecodedProgram.__slots__),
+        assembly.data_words.tobytes(), assembly.data_values.tobytes(), assembly.data_lines.tobytes(),
+        assembly.labels, assembly.data_labels,
+    ))
+
+
+def _load(blob, path):
+    layout, columns, words, values, lines, labels, data_labels = marshal.loads(blob)
+    if layout != _LAYOUT:
+        raise ValueError("stale cache layout")
+    assembly = Assembly(path)
+    for name, data in zip(DecodedProgram.__slots__, columns):
+        getattr(assembly.program, name).frombytes(data)
+    assembly.data_words.frombytes(words)
+    assembly.data_values.frombytes(values)
+    assembly.data_lines.frombytes(lines)
+    assembly.labels = labels
+    assembly.data_labels = data_labels
+    return assembly
+
+
+def assemble_file(path, cache=True):
+    """
+    組譯指令檔。cache 為 True 且設定了快取位置（cache_directory）時先以檔案內容的 sha256 查詢磁碟快取，命中時直接還原陣列、不做任何解析；
+    沒有命中時組譯後寫入快取（寫入失敗不影響結果）。
+    """
+    source = Path(path).read_bytes()
+    directory = cache_directory() if cache else None
+    if directory is None:
+        return assemble(source.decode(), str(path))
+    entry = directory / f"{cache_key(source)}.asm"
+    try:
+        return _load(entry.read_bytes(), str(path))
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    assembly = assemble(source.decode(), str(path))
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        temporary = entry.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_bytes(_dump(assembly))
+        os.replace(temporary, entry)
+    except OSError:
+        pass
+    return assembly
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="組譯指令檔，列出組譯結果與 label")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("--no-cache", action="store_true", help="不使用組譯快取")
+    parser.add_argument("--listing", action="store_true", help="列出每條指令組譯後的形式")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        assembly = assemble_file(args.input_file, cache=not args.no_cache)
+    except AssemblyError as error:
+        parser.exit(1, f"{error}\n")
+    elapsed = time.perf_counter() - start
+    print(f"{args.input_file}: {len(assembly.program)} instructions, {len(assembly.data_words)} data words, "
+          f"{len(assembly.labels) + len(assembly.data_labels)} labels ({elapsed * 1000:.2f} ms)")
+    if args.listing:
+        from cosim import instruction_text
+
+        names = {}
+        for name, index in assembly.labels.items():
+            names.setdefault(index, []).append(name)
+        for index in range(len(assembly.program)):
+            for name in names.get(index, ()):
+                print(f"{name}:")
+            print(f"  {index:6d}  {instruction_text(assembly.program, index)}")
+        for name, address in assembly.data_labels.items():
+            print(f"{name} = {address:#x}")
+        for word, value in zip(assembly.data_words, assembly.data_values):
+            print(f"  [{word * 4:#x}] = {value}")
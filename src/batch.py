@@ -0,0 +1,132 @@
+import argparse
+import csv
+import glob
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from main import simulate
+
+DEFAULT_MAX_CYCLES = 1_000_000  # 每個程式的週期上限：不會結束的程式（如 beq $0, $0, -1）不會卡住整個批次
+
+
+def collect_programs(patterns):
+    """展開目錄與 glob 樣式，回傳排序後不重複的指令檔清單"""
+    programs = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            programs.update(p for p in path.glob("*.txt") if p.is_file())
+        else:
+            programs.update(Path(p) for p in glob.glob(pattern, recursive=True) if Path(p).is_file())
+    return sorted(programs)
+
+
+def run_one(job):
+    """在 worker 行程中模擬一個程式，回傳摘要；達到 max_cycles 仍未結束時 finished 為 False 並記錄錯誤"""
+    input_file, output_file, max_cycles = job
+    start = time.perf_counter()
+    try:
+        cpu = simulate(input_file, output_file, max_cycles=max_cycles)
+    except Exception as e:
+        return {
+            "program": str(input_file),
+            "output": str(output_file),
+            "cycles": "",
+            "stalls": "",
+            "finished": "",
+            "wall_time": time.perf_counter() - start,
+            "error": f"{type(e).__name__}: {e}",
+        }
+    finished = not (cpu.pc < len(cpu.instructions) or cpu.pipeline_busy())
+    return {
+        "program": str(input_file),
+        "output": str(output_file),
+        "cycles": cpu.cycles,
+        "stalls": cpu.stalls,
+        "finished": finished,
+        "wall_time": time.perf_counter() - start,
+        "error": "" if finished else f"did not finish within {max_cycles} cycles",
+    }
+
+
+def output_paths(programs, output_dir):
+    """
+    每個程式的結果檔：檔名不重複時為 output_dir/<檔名>_output.txt，
+    與其他程式同名時改為在 output_dir 下對應它相對於所有程式共同上層資料夾的路徑。
+    仍有兩個程式對應到同一個結果檔時丟出 ValueError。
+    """
+    output_dir = Path(output_dir)
+    stems = Counter(program.stem for program in programs)
+    root = Path(os.path.commonpath([Path(program).resolve().parent for program in programs])) if programs else None
+    outputs = []
+    for program in programs:
+        if stems[program.stem] == 1:
+            outputs.append(output_dir / f"{program.stem}_output.txt")
+        else:
+            relative = Path(program).resolve().parent.relative_to(root)
+            outputs.append(output_dir / relative / f"{program.stem}_output.txt")
+    seen = {}
+    for program, output in zip(programs, outputs):
+        if output in seen:
+            raise ValueError(f"{seen[output]} and {program} would both write {output}")
+        seen[output] = program
+    return outputs
+
+
+def run_batch(programs, output_dir, workers=None, max_cycles=DEFAULT_MAX_CYCLES):
+    """將程式分散到行程池中模擬（每個最多 max_cycles 個週期，None 時不限制），依輸入順序回傳每個程式的摘要"""
+    outputs = output_paths(programs, output_dir)
+    for output in outputs:
+        output.parent.mkdir(parents=True, exist_ok=True)
+    jobs = [(program, output, max_cycles) for program, output in zip(programs, outputs)]
+    workers = workers or os.cpu_count() or 1
+    # 每個 worker 一次領取多個工作，減少行程間通訊
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_one, jobs, chunksize=chunksize))
+
+
+def write_summary(results, summary_file):
+    """將摘要寫成 CSV"""
+    with open(summary_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["program", "output", "cycles", "stalls", "finished", "wall_time", "error"])
+        writer.writeheader()
+        for result in results:
+            writer.writerow(dict(result, wall_time=f"{result['wall_time']:.6f}"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="平行模擬多個 MIPS 指令檔")
+    parser.add_argument("programs", nargs="+", help="指令檔、目錄或 glob 樣式")
+    parser.add_argument("-o", "--output-dir", default="output", help="輸出資料夾（預設 output）")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker 行程數（預設為 CPU 核心數）")
+    parser.add_argument("--max-cycles", type=int, default=DEFAULT_MAX_CYCLES, help=f"每個程式最多執行的週期數（預設 {DEFAULT_MAX_CYCLES}，0 表示不限制）")
+    parser.add_argument("--summary", default=None, help="摘要 CSV 路徑（預設 <output-dir>/summary.csv）")
+    args = parser.parse_args(argv)
+
+    programs = collect_programs(args.programs)
+    if not programs:
+        parser.error("找不到任何指令檔")
+
+    start = time.perf_counter()
+    try:
+        results = run_batch(programs, args.output_dir, args.workers, args.max_cycles or None)
+    except ValueError as error:
+        parser.error(str(error))
+    elapsed = time.perf_counter() - start
+
+    summary_file = args.summary or Path(args.output_dir) / "summary.csv"
+    write_summary(results, summary_file)
+
+    failed = [r for r in results if r["error"]]
+    for result in failed:
+        print(f"{result['program']}: {result['error']}")
+    print(f"{len(results) - len(failed)}/{len(results)} programs simulated in {elapsed:.2f}s, summary: {summary_file}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
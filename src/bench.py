@@ -0,0 +1,371 @@
+import argparse
+import contextlib
+import importlib.machinery
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent
+
+# 預設的工作負載：(名稱, 指令數, load-use 比例, 分支比例, 迴圈次數)
+SUITE = [
+    ("straight", 2000, 0.2, 0.0, 1),
+    ("load-use", 2000, 0.8, 0.0, 1),
+    ("loop", 40, 0.3, 0.1, 2000),
+    ("branchy", 40, 0.3, 0.4, 2000),
+]
+QUICK_SCALE = 10  # --quick 時指令數與迴圈次數縮小的倍數
+ENGINES = ("main", "d_mix", "hazard")
+# predictors 子命令預設比較的分支預測設定（branch.parse_predictor_spec 的格式）
+PREDICTOR_SPECS = ("not-taken", "backward-taken", "1bit", "2bit", "2bit,btb=16")
+
+
+def generate_program(instructions, load_use=0.3, branches=0.1, trips=1, seed=0):
+    """
+    產生 main.CPU 可執行的合成程式（每行一條指令）。
+    instructions 條指令組成迴圈本體，執行 trips 次；load_use 為 lw 之後緊接著使用其結果的比例，
+    branches 為本體中插入向前 beq（跳過下一條指令）的比例。
+    位址都在 32-word 記憶體內，數值每次迭代只做線性變化，不會無限增長。
+    """
+    rng = random.Random(seed)
+    registers = range(2, 20)
+    lines = []
+    if trips > 1:
+        # $29 = trips，$28 為迴圈計數器
+        lines.append("sub $29, $29, $29")
+        for bit in bin(trips)[2:]:
+            lines.append("add $29, $29, $29")
+            if bit == "1":
+                lines.append("add $29, $29, $1")
+        lines.append("sub $28, $28, $28")
+    start = len(lines)
+
+    body = []
+    while len(body) < instructions:
+        if rng.random() < branches and len(body) < instructions - 1:
+            body.append(f"beq ${rng.choice(registers)}, ${rng.choice(registers)}, 1")
+            continue
+        kind = rng.random()
+        dest = rng.choice(registers)
+        if kind < 0.3:
+            body.append(f"lw ${dest}, {4 * rng.randrange(32)}($0)")
+            if rng.random() < load_use and len(body) < instructions:
+                body.append(f"add ${rng.choice(registers)}, ${dest}, $1")
+        elif kind < 0.45:
+            body.append(f"sw ${rng.choice(registers)}, {4 * rng.randrange(32)}($0)")
+        elif kind < 0.75:
+            body.append(f"add ${dest}, ${rng.choice(registers)}, ${rng.choice((0, 1))}")
+        else:
+            body.append(f"sub ${dest}, ${rng.choice(registers)}, $1")
+    lines.extend(body)
+
+    if trips > 1:
+        lines.append("add $28, $28, $1")
+        lines.append("beq $28, $29, 1")
+        end = len(lines)
+        lines.append(f"beq $0, $0, {start - end}")  # 回到本體開頭
+    return lines
+
+
+def _load_d_mix():
+    # 檔名是 D_MIX.PY，無法直接 import
+    loader = importlib.machinery.SourceFileLoader("D_MIX", str(SRC / "D_MIX.PY"))
+    spec = importlib.util.spec_from_loader("D_MIX", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def _to_hazard(line):
+    """轉成 hazard.MIPS_Simulator 的 [opcode, rs, rt, rd, result] 格式"""
+    opcode, *operands = line.replace(",", " ").replace("(", " ").replace(")", " ").split()
+    values = [int(op.strip("$")) for op in operands]
+    if opcode in ("lw", "sw"):
+        dest, offset, base = values
+        return [opcode, base, offset, dest, None]
+    if opcode == "beq":
+        src1, src2, offset = values
+        return [opcode, src1, src2, offset, None]
+    dest, src1, src2 = values
+    return [opcode, src1, src2, dest, None]
+
+
+def _bench_main(lines, output_file):
+    from analysis import branch_path_cycles
+    from main import CPU, parse_instruction
+    from pipetrace import TextTraceWriter
+    from program import DecodedProgram
+
+    phases = {}
+    start = time.perf_counter()
+    program = DecodedProgram.from_instructions(parse_instruction(line) for line in lines)
+    phases["parse"] = time.perf_counter() - start
+
+    # 與 main.py 的預設相同：邊模擬邊寫出週期記錄
+    cpu = CPU(trace=TextTraceWriter(output_file))
+    cpu.load_instructions(program)
+    start = time.perf_counter()
+    cpu.run()
+    phases["simulate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cpu.print_results(output_file)
+    phases["output"] = time.perf_counter() - start
+    return phases, cpu.cycles, branch_path_cycles(program)[2]
+
+
+def _bench_d_mix(lines, output_file):
+    d_mix = _load_d_mix()
+    phases = {}
+    start = time.perf_counter()
+    instructions = [d_mix.parse_instruction(line.upper()) for line in lines]
+    phases["parse"] = time.perf_counter() - start
+
+    cpu = d_mix.CPU()
+    cpu.load_instructions(instructions)
+    start = time.perf_counter()
+    cycle = 1
+    while cpu.pc < len(cpu.instructions) or any([cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB]):
+        cpu.execute_cycle(cycle)
+        cycle += 1
+    phases["simulate"] = time.perf_counter() - start
+
+    # D_MIX.CPU.print_results 寫到固定路徑，這裡以相同格式寫到 output_file
+    start = time.perf_counter()
+    with open(output_file, "w") as f:
+        f.write("\n## Each clocks\n")
+        for log in cpu.pipeline_log:
+            f.write(log + "\n\n")
+        f.write(f"\n## Final Result:\nTotal Cycles: {len(cpu.pipeline_log)}\n")
+    phases["output"] = time.perf_counter() - start
+    # 不模擬分支，每條指令只執行一次
+    return phases, len(cpu.pipeline_log), len(instructions)
+
+
+def _bench_hazard(lines, output_file):
+    import hazard
+
+    phases = {}
+    start = time.perf_counter()
+    instructions = [_to_hazard(line) for line in lines]
+    phases["parse"] = time.perf_counter() - start
+
+    simulator = hazard.MIPS_Simulator(instructions)
+    # 每個週期的狀態直接印出，計入模擬時間
+    with open(output_file, "w") as f, contextlib.redirect_stdout(f):
+        start = time.perf_counter()
+        simulator.run()
+        phases["simulate"] = time.perf_counter() - start
+        start = time.perf_counter()
+        simulator.print_summary()
+        phases["output"] = time.perf_counter() - start
+    return phases, simulator.cycles, len(instructions)
+
+
+BENCHMARKS = {"main": _bench_main, "d_mix": _bench_d_mix, "hazard": _bench_hazard}
+
+
+def run_case(engine, lines):
+    """在獨立的行程中執行一個模擬器，回傳量測結果（peak RSS 為該行程的最大值）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        try:
+            phases, cycles, executed = BENCHMARKS[engine](lines, Path(tmp) / "output.txt")
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        total = time.perf_counter() - start
+    simulate = phases["simulate"] or 1e-9
+    return {
+        "cycles": cycles,
+        "instructions": executed,
+        "phases": phases,
+        "total": total,
+        "cycles_per_sec": cycles / simulate,
+        "instructions_per_sec": executed / simulate,
+        # Linux 上 ru_maxrss 的單位是 KB
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_suite(engines=ENGINES, quick=False, repeat=1, seed=0):
+    """執行整個 SUITE，每個 (工作負載, 模擬器) 取 repeat 次中模擬最快的一次"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name, instructions, load_use, branches, trips in SUITE:
+        if quick:
+            instructions = max(1, instructions // QUICK_SCALE)
+            trips = max(1, trips // QUICK_SCALE)
+        lines = generate_program(instructions, load_use, branches, trips, seed)
+        for engine in engines:
+            best = None
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_case, engine, lines).result()
+                if best is None or "error" in best or ("error" not in result and result["phases"]["simulate"] < best["phases"]["simulate"]):
+                    best = result
+            best.update(
+                workload=name, engine=engine, program_instructions=len(lines),
+                load_use=load_use, branches=branches, trips=trips,
+            )
+            results.append(best)
+    return results
+
+
+def compare_predictors(programs, specs=PREDICTOR_SPECS):
+    """
+    每個程式在沒有分支預測與各種預測設定下的週期數（模擬結果是確定的，不需要重複量測）。
+    programs 為 (名稱, 指令行) 的串列。
+    Returns:
+        list: (名稱, 設定, 週期數, 相對沒有預測減少的週期比例, 預測正確率) 的串列；沒有預測的設定為 "none"。
+    """
+    from branch import parse_predictor_spec
+    from main import CPU, parse_instruction
+    from pipetrace import NullTrace
+    from program import DecodedProgram
+
+    rows = []
+    for name, lines in programs:
+        program = DecodedProgram.from_instructions(parse_instruction(line) for line in lines)
+        baseline = None
+        for spec in (None, *specs):
+            predictor = parse_predictor_spec(spec) if spec is not None else None
+            cpu = CPU(trace=NullTrace(), predictor=predictor)
+            cpu.load_instructions(program)
+            cycles = cpu.run()
+            if baseline is None:
+                baseline = cycles
+            accuracy = predictor.accuracy() if predictor is not None else None
+            rows.append((name, spec or "none", cycles, 1 - cycles / baseline, accuracy))
+    return rows
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=SRC, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    比較兩份結果的模擬速度（cycles/sec）。
+    Returns:
+        list: (workload, engine, 舊速度, 新速度, 比值, 是否退步) 的串列。
+    """
+    old = {(r["workload"], r["engine"]): r for r in baseline["results"] if "error" not in r}
+    rows = []
+    for r in current["results"]:
+        key = (r["workload"], r["engine"])
+        if "error" in r or key not in old:
+            continue
+        before, after = old[key]["cycles_per_sec"], r["cycles_per_sec"]
+        ratio = after / before
+        rows.append((*key, before, after, ratio, ratio < 1 - threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以合成程式量測各模擬器的效能")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="執行基準測試並輸出 JSON")
+    run.add_argument("-o", "--output", default="bench.json", help="結果 JSON（預設 bench.json）")
+    run.add_argument("--engines", default=",".join(ENGINES), help=f"要量測的模擬器（預設 {','.join(ENGINES)}）")
+    run.add_argument("--quick", action="store_true", help=f"工作負載縮小 {QUICK_SCALE} 倍")
+    run.add_argument("--repeat", type=int, default=3, help="每個組合執行次數，取最快的一次（預設 3）")
+    run.add_argument("--seed", type=int, default=0, help="程式產生器的亂數種子")
+
+    cmp = commands.add_parser("compare", help="比較兩份結果，速度下降超過門檻時回傳 1")
+    cmp.add_argument("baseline", help="舊的結果 JSON")
+    cmp.add_argument("current", help="新的結果 JSON")
+    cmp.add_argument("--threshold", type=float, default=0.1, help="視為退步的速度下降比例（預設 0.1）")
+
+    gen = commands.add_parser("generate", help="輸出一個合成程式")
+    gen.add_argument("instructions", type=int, help="迴圈本體的指令數")
+    gen.add_argument("--load-use", type=float, default=0.3, help="lw 後緊接使用結果的比例")
+    gen.add_argument("--branches", type=float, default=0.1, help="向前 beq 的比例")
+    gen.add_argument("--trips", type=int, default=1, help="迴圈次數")
+    gen.add_argument("--seed", type=int, default=0, help="亂數種子")
+    gen.add_argument("-o", "--output", help="輸出檔（預設印到螢幕）")
+    pred = commands.add_parser("predictors", help="比較各種分支預測在迴圈工作負載上減少的週期數")
+    pred.add_argument("files", nargs="*", help="另外比較的指令檔")
+    pred.add_argument("--predictor", action="append", dest="specs", metavar="SPEC", help=f"預測設定，可重複（預設 {' '.join(PREDICTOR_SPECS)}）")
+    pred.add_argument("--quick", action="store_true", help=f"工作負載縮小 {QUICK_SCALE} 倍")
+    pred.add_argument("--seed", type=int, default=0, help="程式產生器的亂數種子")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        text = "\n".join(generate_program(args.instructions, args.load_use, args.branches, args.trips, args.seed)) + "\n"
+        if args.output:
+            Path(args.output).write_text(text)
+        else:
+            print(text, end="")
+        return 0
+
+    if args.command == "predictors":
+        programs = []
+        for name, instructions, load_use, branches, trips in SUITE:
+            if trips > 1:
+                if args.quick:
+                    instructions = max(1, instructions // QUICK_SCALE)
+                    trips = max(1, trips // QUICK_SCALE)
+                programs.append((name, generate_program(instructions, load_use, branches, trips, args.seed)))
+        for path in args.files:
+            programs.append((path, [line.strip() for line in Path(path).read_text().splitlines() if line.strip()]))
+        for name, spec, cycles, saved, accuracy in compare_predictors(programs, args.specs or PREDICTOR_SPECS):
+            accuracy = f"{accuracy:7.2%}" if accuracy is not None else "      -"
+            print(f"{name:10} {spec:22} {cycles:>9} cycles {saved:7.2%} saved  accuracy {accuracy}")
+        return 0
+
+    if args.command == "run":
+        engines = [e for e in args.engines.split(",") if e]
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+        results = run_suite(engines, args.quick, args.repeat, args.seed)
+        report = {
+            "revision": _revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        for r in results:
+            if "error" in r:
+                print(f"{r['workload']:10} {r['engine']:7} error: {r['error']}")
+            else:
+                phases = " ".join(f"{k}={v * 1000:.1f}ms" for k, v in r["phases"].items())
+                print(
+                    f"{r['workload']:10} {r['engine']:7} {r['cycles']:>9} cycles "
+                    f"{r['cycles_per_sec']:>12,.0f} cycles/s {r['instructions_per_sec']:>12,.0f} instr/s "
+                    f"{r['peak_rss_kb'] / 1024:7.1f} MB  {phases}"
+                )
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    for workload, engine, before, after, ratio, regressed in rows:
+        mark = "  REGRESSION" if regressed else ""
+        print(f"{workload:10} {engine:7} {before:>12,.0f} -> {after:>12,.0f} cycles/s ({ratio:6.2f}x){mark}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import argparse
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+from pipetrace import NullTrace
+from program import format_stage
+
+# 檔頭：magic、版本、紀錄大小、索引間隔、總週期數、總紀錄數、索引位置
+HEADER = struct.Struct("<4sHHIQQQ")
+MAGIC = b"MPTR"
+VERSION = 1
+# 每個週期每個階段一筆：cycle、控制信號、指令索引、stage、opcode、flags
+RECORD = struct.Struct("<IIiBBBx")
+FLAG_STALLED = 0x01
+DEFAULT_STRIDE = 1024  # 每隔多少週期記錄一次索引
+
+
+class BinaryTraceWriter(NullTrace):
+    """
+    將每個週期的事件寫成固定大小的二進位紀錄。
+    檔尾附上每 stride 個週期一筆的紀錄位置索引，讀取時可直接跳到任意週期。
+    """
+
+    enabled = True
+
+    def __init__(self, output_file, stride=DEFAULT_STRIDE, notes=None, resume=False):
+        super().__init__(notes)
+        self.path = Path(output_file)
+        self.stride = stride
+        self.records = 0
+        self.index = array("Q")
+        if resume:
+            # 接續既有的記錄檔，由 restore 截斷到 checkpoint 的位置並重建索引
+            self.file = open(self.path, "r+b")
+            self.stride = HEADER.unpack(self.file.read(HEADER.size))[3]
+        else:
+            self.file = open(self.path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, stride, 0, 0, 0))
+
+    def cycle(self, cycle, entries, stalled):
+        self.cycles = cycle
+        if (cycle - 1) % self.stride == 0:
+            self.index.append(self.records)
+        if not entries:
+            return
+        opcode = self.program.opcode
+        flags = FLAG_STALLED if stalled else 0
+        pack = RECORD.pack
+        self.file.write(b"".join(pack(cycle, control, index, stage, opcode[index], flags) for stage, index, control in entries))
+        self.records += len(entries)
+
+    def checkpoint(self, full=False):
+        # 索引可由紀錄重建，不必保存
+        return (self.cycles, self.records, len(self.index))
+
+    def restore(self, state):
+        self.cycles, self.records, blocks = state
+        self.file.seek(HEADER.size + self.records * RECORD.size)
+        self.file.truncate()
+        if len(self.index) >= blocks:
+            del self.index[blocks:]
+            return
+        # 另一個行程寫出的檔案：依紀錄的週期重建索引
+        self.file.seek(HEADER.size)
+        data = self.file.read(self.records * RECORD.size)
+        self.index = array("Q")
+        for n, (cycle, *_) in enumerate(RECORD.iter_unpack(data)):
+            while len(self.index) < blocks and len(self.index) * self.stride < cycle:
+                self.index.append(n)
+        while len(self.index) < blocks:
+            self.index.append(self.records)
+
+    def close(self):
+        """寫入索引並更新檔頭"""
+        if self.file is None:
+            return
+        index_offset = HEADER.size + self.records * RECORD.size
+        self.file.write(self.index.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.stride, self.cycles, self.records, index_offset))
+        self.file.close()
+        self.file = None
+
+    def open_results(self, output_file):
+        # 週期記錄保存在二進位檔中，結果檔只包含最終結果
+        self.close()
+        return super().open_results(output_file)
+
+
+class BinaryTrace:
+    """以 mmap 讀取二進位週期記錄，可隨機存取任意週期"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.stride, self.cycles, self.records, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{self.path}: not a pipeline trace file (or unsupported version)")
+        count = (self.cycles + self.stride - 1) // self.stride
+        self.index = memoryview(self._map)[index_offset:index_offset + 8 * count].cast("Q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.index.release()
+        self._map.close()
+        self._file.close()
+
+    def _record(self, n):
+        return RECORD.unpack_from(self._map, HEADER.size + n * RECORD.size)
+
+    def _first_record(self, cycle):
+        """第一筆 cycle 不小於指定值的紀錄編號"""
+        block = (cycle - 1) // self.stride
+        if block >= len(self.index):
+            return self.records
+        low = self.index[block]
+        high = self.index[block + 1] if block + 1 < len(self.index) else self.records
+        # 同一索引區塊內以二分搜尋找到起點
+        while low < high:
+            mid = (low + high) // 2
+            if self._record(mid)[0] < cycle:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def cycle(self, cycle):
+        """
+        取得單一週期的事件。
+        Returns:
+            tuple: (stalled, [(stage, 指令索引, opcode, 控制信號), ...])
+        """
+        if not 1 <= cycle <= self.cycles:
+            raise IndexError(f"cycle {cycle} out of range 1..{self.cycles}")
+        entries = []
+        stalled = False
+        n = self._first_record(cycle)
+        while n < self.records:
+            record_cycle, control, index, stage, opcode, flags = self._record(n)
+            if record_cycle != cycle:
+                break
+            stalled = bool(flags & FLAG_STALLED)
+            entries.append((stage, index, opcode, control))
+            n += 1
+        return stalled, entries
+
+    def render(self, first=1, last=None):
+        """將 first..last 週期轉回 # Execution Log 的文字格式（逐週期產生）"""
+        last = self.cycles if last is None else min(last, self.cycles)
+        n = self._first_record(first) if first <= last else self.records
+        for cycle in range(first, last + 1):
+            lines = [f"Clock Cycle {cycle}:"]
+            while n < self.records:
+                record_cycle, control, index, stage, opcode, flags = self._record(n)
+                if record_cycle != cycle:
+                    break
+                lines.append(format_stage(opcode, control, stage))
+                n += 1
+            yield "\n".join(lines)
+
+    def write_text(self, output_file, first=1, last=None):
+        """輸出指定週期範圍的文字記錄"""
+        with open(output_file, "w") as f:
+            f.write("# Execution Log\n")
+            for text in self.render(first, last):
+                f.write(text + "\n")
+
+
+def parse_range(text):
+    """解析 "a-b"、"a-" 或 "a" 形式的週期範圍"""
+    first, _, last = text.partition("-")
+    first = int(first)
+    if not _:
+        return first, first
+    return first, int(last) if last else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="將二進位週期記錄轉回文字格式")
+    parser.add_argument("trace", help="BinaryTraceWriter 產生的檔案")
+    parser.add_argument("--cycles", default="1-", help="週期範圍，例如 73000000-73000010（預設全部）")
+    parser.add_argument("-o", "--output", help="輸出檔（預設印到螢幕）")
+    args = parser.parse_args()
+
+    first, last = parse_range(args.cycles)
+    with BinaryTrace(args.trace) as trace:
+        if args.output:
+            trace.write_text(args.output, first, last)
+        else:
+            print(f"# Execution Log ({trace.cycles} cycles)")
+            for text in trace.render(first, last):
+                print(text)
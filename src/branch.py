@@ -0,0 +1,160 @@
+from abc import ABC, abstractmethod
+from array import array
+
+
+class BranchTargetBuffer:
+    """直接對應的 BTB：以指令索引的低位元選 entry，tags 保存完整的指令索引"""
+
+    def __init__(self, entries=16):
+        if entries <= 0 or entries & (entries - 1):
+            raise ValueError(f"BTB entries must be a power of two, got {entries}")
+        self.entries = entries
+        self.tags = array("q", [-1]) * entries
+        self.targets = array("q", [0]) * entries
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, index):
+        """index 的分支目標；不在 BTB 中時回傳 None"""
+        entry = index & (self.entries - 1)
+        if self.tags[entry] == index:
+            self.hits += 1
+            return self.targets[entry]
+        self.misses += 1
+        return None
+
+    def update(self, index, target):
+        entry = index & (self.entries - 1)
+        self.tags[entry] = index
+        self.targets[entry] = target
+
+
+class BranchPredictor(ABC):
+    """
+    分支預測的基底。CPU 取到 beq 時呼叫 predict 決定下一個 pc，EX 解析後呼叫 update。
+    預測跳躍時目標來自 BTB（BTB 沒有時只能繼續循序取指）；沒有 BTB 時直接使用 CPU 傳入的解碼後目標。
+    """
+
+    name = "predictor"
+
+    def __init__(self, btb=None):
+        self.btb = btb
+        self.program = None
+        self.branches = 0  # 解析的 beq 數
+        self.taken = 0  # 其中跳躍的數量
+        self.mispredicts = 0  # 取錯路徑而清空 IF/ID 的次數
+
+    def bind(self, program):
+        """CPU 載入指令時呼叫"""
+        self.program = program
+
+    @abstractmethod
+    def predict_taken(self, index):
+        """第 index 條指令（beq）是否預測跳躍"""
+
+    def train(self, index, taken):
+        """以實際結果更新方向預測（靜態預測不需要）"""
+
+    def predict(self, index, target):
+        """取到第 index 條指令（beq，跳躍時到 target）之後的下一個 pc"""
+        if self.predict_taken(index):
+            if self.btb is None:
+                return target
+            target = self.btb.lookup(index)
+            if target is not None:
+                return target
+        return index + 1
+
+    def update(self, index, taken, target, mispredicted):
+        self.branches += 1
+        self.taken += taken
+        self.mispredicts += mispredicted
+        self.train(index, taken)
+        if taken and self.btb is not None:
+            self.btb.update(index, target)
+
+    def accuracy(self):
+        return 1 - self.mispredicts / self.branches if self.branches else None
+
+    def describe(self):
+        return self.name + (f", BTB {self.btb.entries} entries" if self.btb is not None else "")
+
+    def result_lines(self):
+        """結果檔中的統計"""
+        accuracy = f"{self.accuracy():.2%}" if self.branches else "n/a"
+        lines = [f"{self.describe()}: {self.branches} branches, {self.taken} taken, {self.mispredicts} mispredicts, accuracy {accuracy}"]
+        if self.btb is not None:
+            lines.append(f"BTB: {self.btb.hits} hits, {self.btb.misses} misses")
+        return lines
+
+
+class StaticNotTaken(BranchPredictor):
+    """一律預測不跳躍（與沒有預測時的取指方式相同）"""
+
+    name = "static not-taken"
+
+    def predict_taken(self, index):
+        return False
+
+
+class StaticBackwardTaken(BranchPredictor):
+    """向後跳的 beq（迴圈）預測跳躍，向前跳的預測不跳躍"""
+
+    name = "static backward-taken"
+
+    def predict_taken(self, index):
+        return self.program.offset[index] < 0
+
+
+class BimodalPredictor(BranchPredictor):
+    """以指令索引的低位元選擇 BHT entry 的 1 位元或 2 位元飽和計數器"""
+
+    def __init__(self, entries=64, bits=2, btb=None):
+        super().__init__(btb)
+        if entries <= 0 or entries & (entries - 1):
+            raise ValueError(f"BHT entries must be a power of two, got {entries}")
+        if bits not in (1, 2):
+            raise ValueError(f"BHT counters must be 1 or 2 bits, got {bits}")
+        self.entries = entries
+        self.bits = bits
+        self.maximum = (1 << bits) - 1
+        self.threshold = 1 << (bits - 1)  # 計數器 >= threshold 時預測跳躍
+        self.table = array("B", [self.threshold - 1]) * entries  # 初始為（弱）不跳躍
+        self.name = f"{bits}-bit BHT ({entries} entries)"
+
+    def predict_taken(self, index):
+        return self.table[index & (self.entries - 1)] >= self.threshold
+
+    def train(self, index, taken):
+        entry = index & (self.entries - 1)
+        counter = self.table[entry]
+        if taken:
+            if counter < self.maximum:
+                self.table[entry] = counter + 1
+        elif counter > 0:
+            self.table[entry] = counter - 1
+
+
+PREDICTORS = ("not-taken", "backward-taken", "1bit", "2bit")
+
+
+def parse_predictor_spec(text):
+    """
+    解析 "2bit,entries=64,btb=16" 形式的設定：第一項為 PREDICTORS 之一，
+    entries 為 BHT 大小（1bit/2bit），btb 為 BTB 大小（省略時不使用 BTB）。
+    """
+    kind, *items = text.split(",")
+    if kind not in PREDICTORS:
+        raise ValueError(f"unknown branch predictor {kind!r} (expected one of {', '.join(PREDICTORS)})")
+    options = {}
+    for item in filter(None, items):
+        key, _, value = item.partition("=")
+        if key not in ("entries", "btb") or not value or (key == "entries" and kind not in ("1bit", "2bit")):
+            raise ValueError(f"bad option {item!r} for predictor {kind}")
+        options[key] = int(value, 0)
+    btb = BranchTargetBuffer(options["btb"]) if "btb" in options else None
+    if kind == "not-taken":
+        return StaticNotTaken(btb)
+    if kind == "backward-taken":
+        return StaticBackwardTaken(btb)
+    return BimodalPredictor(options.get("entries", 64), 1 if kind == "1bit" else 2, btb)
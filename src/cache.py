@@ -0,0 +1,169 @@
+from array import array
+
+ADDRESS_MASK = (1 << 32) - 1
+REPLACEMENT_POLICIES = ("lru", "plru")
+WRITE_POLICIES = ("back", "through")
+
+
+class Cache:
+    """
+    組相聯快取的時序模型（只記錄標籤，資料仍在 CPU.memory 中）。
+    每個 set 的 ways 條 line 連續存放在 array 中：tags 為標籤（-1 表示無效）、dirty 為髒位元，
+    LRU 以 stamps 記錄最近一次存取的時間，PLRU 以 tree 保存每個 set 的二元樹位元。
+    write-back 為寫入配置（write-allocate），髒 line 被替換時寫回下一層；
+    write-through 不在寫入 miss 時配置，每次寫入都經由寫入緩衝區送到下一層（更新下一層的內容與統計），不造成停頓。
+    access 回傳這次存取額外需要的週期數（hit 為 0）。
+    """
+
+    def __init__(self, name, size=1024, line_size=16, associativity=2, replacement="lru", write="back", miss_latency=10, next_level=None):
+        for label, value in (("size", size), ("line size", line_size), ("associativity", associativity)):
+            if value <= 0 or value & (value - 1):
+                raise ValueError(f"{name}: {label} must be a power of two, got {value}")
+        if size < line_size * associativity:
+            raise ValueError(f"{name}: size {size} is smaller than one set ({line_size} x {associativity})")
+        if replacement not in REPLACEMENT_POLICIES:
+            raise ValueError(f"{name}: unknown replacement policy {replacement!r}")
+        if write not in WRITE_POLICIES:
+            raise ValueError(f"{name}: unknown write policy {write!r}")
+        self.name = name
+        self.size = size
+        self.line_size = line_size
+        self.ways = associativity
+        self.sets = size // (line_size * associativity)
+        self.replacement = replacement
+        self.write_back = write == "back"
+        self.miss_latency = miss_latency
+        self.next_level = next_level
+        self.offset_bits = line_size.bit_length() - 1
+        self.set_bits = self.sets.bit_length() - 1
+        self.way_bits = associativity.bit_length() - 1
+
+        lines = self.sets * associativity
+        self.tags = array("q", [-1]) * lines
+        self.dirty = bytearray(lines)
+        self.stamps = array("Q", [0]) * lines  # LRU：最近一次存取的時間
+        self.tree = array("Q", [0]) * self.sets  # PLRU：節點 n（1 起算）的位元為 1 表示替換右半邊
+        self.clock = 0
+
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0  # 寫回下一層的 line 數（write-through 時為寫入次數）
+
+    def access(self, address, write=False):
+        """存取位元組位址 address，回傳額外的延遲週期數"""
+        line = (address & ADDRESS_MASK) >> self.offset_bits
+        index = line & (self.sets - 1)
+        tag = line >> self.set_bits
+        base = index * self.ways
+        tags = self.tags
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        try:
+            slot = tags.index(tag, base, base + self.ways)
+        except ValueError:
+            slot = -1
+        if slot >= 0:
+            self.hits += 1
+            self._touch(index, slot - base)
+            if write:
+                if self.write_back:
+                    self.dirty[slot] = 1
+                else:
+                    self._write_through(address)
+            return 0
+
+        self.misses += 1
+        if write and not self.write_back:
+            self._write_through(address)
+            return 0
+        slot = base + self._victim(index)
+        penalty = self.miss_latency
+        if self.dirty[slot]:
+            self.writebacks += 1
+            victim = ((tags[slot] << self.set_bits) | index) << self.offset_bits
+            penalty += self.next_level.access(victim, True) if self.next_level is not None else self.miss_latency
+        if self.next_level is not None:
+            penalty += self.next_level.access(address, False)
+        tags[slot] = tag
+        self.dirty[slot] = write
+        self._touch(index, slot - base)
+        return penalty
+
+    def _write_through(self, address):
+        """寫入送到下一層；寫入緩衝區吸收下一層的延遲"""
+        self.writebacks += 1
+        if self.next_level is not None:
+            self.next_level.access(address, True)
+
+    def _touch(self, index, way):
+        if self.replacement == "lru":
+            self.clock += 1
+            self.stamps[index * self.ways + way] = self.clock
+            return
+        bits = self.tree[index]
+        node = 1
+        for shift in range(self.way_bits - 1, -1, -1):
+            direction = (way >> shift) & 1
+            if direction:
+                bits &= ~(1 << node)  # 剛用過右半邊，下次替換左半邊
+            else:
+                bits |= 1 << node
+            node = node * 2 + direction
+        self.tree[index] = bits
+
+    def _victim(self, index):
+        """set index 中要被替換的 way（優先使用無效的 line）"""
+        base = index * self.ways
+        try:
+            return self.tags.index(-1, base, base + self.ways) - base
+        except ValueError:
+            pass
+        if self.replacement == "lru":
+            stamps = self.stamps[base:base + self.ways]
+            return stamps.index(min(stamps))
+        bits = self.tree[index]
+        node = 1
+        way = 0
+        for _ in range(self.way_bits):
+            direction = (bits >> node) & 1
+            way = way * 2 + direction
+            node = node * 2 + direction
+        return way
+
+    def accesses(self):
+        return self.reads + self.writes
+
+    def result_line(self):
+        """結果檔中的統計"""
+        accesses = self.accesses()
+        rate = f"{self.hits / accesses:.2%}" if accesses else "n/a"
+        return f"{self.name}: {accesses} accesses, {self.hits} hits, {self.misses} misses, hit rate {rate}, {self.writebacks} writebacks"
+
+
+def hierarchy(*caches):
+    """caches 與其所有下一層快取（不重複，依序）"""
+    result = []
+    for cache in caches:
+        while cache is not None and cache not in result:
+            result.append(cache)
+            cache = cache.next_level
+    return result
+
+
+def parse_cache_spec(name, text, next_level=None):
+    """
+    解析 "size=8192,line=32,ways=4,policy=plru,write=through,latency=20" 形式的設定，
+    未指定的項目使用 Cache 的預設值。
+    """
+    keys = {"size": "size", "line": "line_size", "ways": "associativity", "policy": "replacement", "write": "write", "latency": "miss_latency"}
+    options = {}
+    for item in filter(None, text.split(",")):
+        key, _, value = item.partition("=")
+        if key not in keys or not value:
+            raise ValueError(f"{name}: bad cache option {item!r} (expected one of {', '.join(keys)})")
+        options[keys[key]] = value if key in ("policy", "write") else int(value, 0)
+    return Cache(name, next_level=next_level, **options)
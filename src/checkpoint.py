@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import marshal
+import struct
+import zlib
+from array import array
+from collections import deque
+from itertools import chain
+from pathlib import Path
+
+from memory import PagedMemory
+
+PAGE_WORDS = 256  # 記憶體分頁大小（word）
+# 檔頭：magic、版本、marshal 格式版本；之後是 zlib 壓縮的狀態
+HEADER = struct.Struct("<4sHH")
+MAGIC = b"MPCK"
+VERSION = 3
+
+
+def program_digest(program):
+    """指令內容的雜湊，還原時確認 CPU 載入的是同一個程式"""
+    digest = hashlib.sha1()
+    for column in (program.opcode, program.control, program.dest, program.src1, program.src2, program.base, program.offset):
+        digest.update(column.tobytes())
+    return digest.digest()
+
+
+class Checkpoint:
+    """
+    CPU 在某個週期結束時的完整狀態。
+    記憶體以不可變的分頁（tuple）保存，未寫入的分頁與前一個 checkpoint 共用同一個物件；
+    PagedMemory 則保存其分頁字典（memory_words 為 None），寫入時由 PagedMemory 複製分頁。
+    forwarding 為轉發單元的 (開啟的路徑, 各路徑使用次數, 停頓週期數)，沒有轉發單元時為 None；
+    counters 為效能計數器的 state()，沒有計數器時為 None。
+    """
+
+    __slots__ = (
+        "cycles", "stalls", "pc", "latches", "taken_branch", "registers",
+        "pages", "memory_words", "values", "addresses", "trace", "digest", "forwarding", "counters",
+    )
+
+    def __init__(self, *fields):
+        for name, value in zip(self.__slots__, fields):
+            setattr(self, name, value)
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+def snapshot(cpu, base=None, full=False):
+    """
+    建立 checkpoint。
+    base 為這個 CPU 上一個 checkpoint（或最後還原的 checkpoint）時，只複製之後寫入過的分頁；
+    full 為 True 時週期記錄的狀態可在另一個行程中還原。
+    """
+    if cpu.icache is not None or cpu.dcache is not None or cpu.predictor is not None:
+        raise ValueError("checkpoints do not cover cache or branch predictor state")
+    memory = cpu.memory
+    dirty = cpu.dirty_words
+    if isinstance(memory, PagedMemory):
+        pages = memory.snapshot()
+    elif base is None or dirty is None or base.memory_words != len(memory):
+        pages = tuple(tuple(memory[i:i + PAGE_WORDS]) for i in range(0, len(memory), PAGE_WORDS))
+    else:
+        pages = list(base.pages)
+        for page in {word % len(memory) // PAGE_WORDS for word in dirty}:
+            start = page * PAGE_WORDS
+            pages[page] = tuple(memory[start:start + PAGE_WORDS])
+        pages = tuple(pages)
+    cpu.dirty_words = set()
+    return Checkpoint(
+        cpu.cycles,
+        cpu.stalls,
+        cpu.pc,
+        (cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB),
+        cpu.taken_branch,
+        tuple(cpu.registers),
+        pages,
+        None if isinstance(memory, PagedMemory) else len(memory),
+        tuple(cpu.values),
+        tuple(cpu.addresses),
+        cpu.trace.checkpoint(full),
+        program_digest(cpu.instructions),
+        None if cpu.forwarding is None else (tuple(cpu.forwarding.enabled), tuple(cpu.forwarding.forwards), cpu.forwarding.stalls),
+        None if cpu.counters is None else tuple(cpu.counters.state()),
+    )
+
+
+def restore(cpu, checkpoint, verify=True):
+    """
+    將 CPU（已載入同一個程式）與其週期記錄還原到 checkpoint 的狀態。
+    verify 為 False 時不比對整個程式，由呼叫者確認影響過狀態的指令相同（見 incremental）。
+    """
+    if verify and checkpoint.digest != program_digest(cpu.instructions):
+        raise ValueError("checkpoint was taken with a different program")
+    forwarding = checkpoint.forwarding
+    if (forwarding is None) != (cpu.forwarding is None) or (forwarding is not None and list(forwarding[0]) != cpu.forwarding.enabled):
+        raise ValueError("checkpoint was taken with a different forwarding configuration")
+    if (checkpoint.counters is None) != (cpu.counters is None) or (
+        checkpoint.counters is not None and len(checkpoint.counters) != len(cpu.counters.state())
+    ):
+        raise ValueError("checkpoint was taken with different performance counters")
+    cpu.cycles = checkpoint.cycles
+    cpu.stalls = checkpoint.stalls
+    cpu.pc = checkpoint.pc
+    cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB = checkpoint.latches
+    cpu.taken_branch = checkpoint.taken_branch
+    cpu.registers = list(checkpoint.registers)
+    if checkpoint.memory_words is None:
+        if not isinstance(cpu.memory, PagedMemory):
+            raise ValueError("checkpoint was taken with paged memory")
+        cpu.memory.restore(checkpoint.pages)
+    else:
+        cpu.memory = list(chain.from_iterable(checkpoint.pages))
+    cpu.values = list(checkpoint.values)
+    cpu.addresses = list(checkpoint.addresses)
+    cpu.trace.restore(checkpoint.trace)
+    if forwarding is not None:
+        cpu.forwarding.forwards = list(forwarding[1])
+        cpu.forwarding.stalls = forwarding[2]
+    if checkpoint.counters is not None:
+        cpu.counters.restore(list(checkpoint.counters))
+    cpu.dirty_words = set()
+
+
+def save(checkpoint, path):
+    """寫成 checkpoint 檔"""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, marshal.version))
+        fields = checkpoint.fields()
+        if checkpoint.memory_words is None:
+            pages = {number: page.tobytes() for number, page in checkpoint.pages.items()}
+            fields = tuple(pages if name == "pages" else value for name, value in zip(Checkpoint.__slots__, fields))
+        f.write(zlib.compress(marshal.dumps(fields)))
+
+
+def load(path):
+    """讀取 checkpoint 檔"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, marshal_version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or marshal_version != marshal.version:
+        raise ValueError(f"{path}: not a checkpoint file (or unsupported version)")
+    checkpoint = Checkpoint(*marshal.loads(zlib.decompress(data[HEADER.size:])))
+    if checkpoint.memory_words is None:
+        checkpoint.pages = {number: array("q", page) for number, page in checkpoint.pages.items()}
+    return checkpoint
+
+
+class Checkpointer:
+    """
+    執行 CPU 並每 every 個週期建立一個 checkpoint（只在週期之間切分 CPU.run，不影響每個週期的成本）。
+    keep 限制保留在記憶體中的數量；指定 directory 時同時寫成 cycle<週期數>.ckpt 檔。
+    """
+
+    def __init__(self, cpu, every, keep=None, directory=None):
+        self.cpu = cpu
+        self.every = every
+        self.checkpoints = deque(maxlen=keep)
+        self.directory = Path(directory) if directory is not None else None
+        self.latest = None  # CPU 目前的記憶體分頁以此 checkpoint 為基礎
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def take(self):
+        checkpoint = snapshot(self.cpu, self.latest, full=self.directory is not None)
+        self.latest = checkpoint
+        self.checkpoints.append(checkpoint)
+        if self.directory is not None:
+            save(checkpoint, self.directory / f"cycle{checkpoint.cycles:012d}.ckpt")
+        return checkpoint
+
+    def run(self, max_cycles=None):
+        """與 CPU.run 相同，回傳總週期數"""
+        cpu = self.cpu
+        if self.latest is None:
+            self.take()
+        while cpu.pc < len(cpu.instructions) or cpu.pipeline_busy():
+            target = (cpu.cycles // self.every + 1) * self.every
+            if max_cycles is not None:
+                target = min(target, max_cycles)
+            if target <= cpu.cycles:
+                break
+            cpu.run(target)
+            if cpu.cycles == target and target % self.every == 0:
+                self.take()
+        return cpu.cycles
+
+    def rewind(self, cycle):
+        """
+        還原到不晚於 cycle 的最後一個 checkpoint，回傳該 checkpoint。
+        之後的 checkpoint 會被捨棄，重新執行時再建立。
+        """
+        while self.checkpoints and self.checkpoints[-1].cycles > cycle:
+            self.checkpoints.pop()
+        if not self.checkpoints:
+            raise ValueError(f"no checkpoint at or before cycle {cycle}")
+        checkpoint = self.checkpoints[-1]
+        restore(self.cpu, checkpoint)
+        self.latest = checkpoint
+        return checkpoint
+
+
+if __name__ == "__main__":
+    from assembler import assemble_file
+    from forwarding import parse_forwarding_spec
+    from main import CPU
+    from pipetrace import TextTraceWriter
+
+    parser = argparse.ArgumentParser(description="定期建立 checkpoint，或從 checkpoint 接續模擬")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("output_file", type=Path, help="結果檔")
+    parser.add_argument("--every", type=int, default=100000, help="每隔多少週期建立 checkpoint（預設 100000）")
+    parser.add_argument("--dir", type=Path, default=Path("checkpoints"), help="checkpoint 資料夾（預設 checkpoints）")
+    parser.add_argument("--resume", type=Path, help="從 checkpoint 檔接續（結果檔須為原本執行的結果檔）")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的週期數")
+    parser.add_argument("--forwarding", metavar="PATHS", nargs="?", const="ex-mem,mem-wb", help="轉發模式（同 main.py）")
+    args = parser.parse_args()
+    try:
+        forwarding = parse_forwarding_spec(args.forwarding) if args.forwarding is not None else None
+    except ValueError as error:
+        parser.error(str(error))
+
+    cpu = CPU(trace=TextTraceWriter(args.output_file, resume=args.resume is not None), forwarding=forwarding)
+    assembly = assemble_file(args.input_file)
+    cpu.load_instructions(assembly.program)
+    assembly.initialize(cpu.memory)
+    checkpointer = Checkpointer(cpu, args.every, keep=1, directory=args.dir)
+    if args.resume is not None:
+        try:
+            checkpoint = load(args.resume)
+            restore(cpu, checkpoint)
+        except ValueError as error:
+            parser.exit(1, f"{error}\n")
+        checkpointer.latest = checkpoint
+    checkpointer.run(args.max_cycles)
+    cpu.print_results(args.output_file)
@@ -0,0 +1,201 @@
+import argparse
+import sys
+from pathlib import Path
+
+import C
+from memory import PagedMemory
+from program import OP_BEQ, OP_LW, OP_SW, OPCODES
+
+HASH_MASK = (1 << 64) - 1
+
+
+def instruction_text(program, index):
+    """將解碼後的指令還原成組合語言文字"""
+    op = program.opcode[index]
+    name = OPCODES[op]
+    if op == OP_BEQ:
+        return f"{name} ${program.src1[index]}, ${program.src2[index]}, {program.offset[index]}"
+    if op >= OP_LW:
+        return f"{name} ${program.dest[index]}, {program.offset[index]}(${program.base[index]})"
+    return f"{name} ${program.dest[index]}, ${program.src1[index]}, ${program.src2[index]}"
+
+
+def copy_memory(memory):
+    """記憶體的獨立複本（PagedMemory 以寫入時複製的方式共用分頁）"""
+    return memory.fork() if isinstance(memory, PagedMemory) else list(memory)
+
+
+class ByteAddressed:
+    """讓 C.CPU 以 main.CPU 的方式存取記憶體：位元組位址 // 4 為 word 索引"""
+
+    __slots__ = ("words",)
+
+    def __init__(self, words):
+        self.words = words
+
+    def __getitem__(self, address):
+        return self.words[address // 4]
+
+    def __setitem__(self, address, value):
+        self.words[address // 4] = value
+
+
+class Divergence(Exception):
+    """流水線與功能模型第一次不一致的地方"""
+
+    def __init__(self, cycle, retired, index, text, pipeline, functional):
+        self.cycle = cycle  # 發生不一致的週期
+        self.retired = retired  # 之前已一致完成的指令數
+        self.index = index  # 流水線完成的指令索引（None 表示流水線已結束）
+        self.pipeline = pipeline
+        self.functional = functional
+        location = f"[{index}] {text}" if index is not None else "end of program"
+        super().__init__(
+            f"divergence at cycle {cycle}, retirement {retired + 1}: {location}\n"
+            f"  pipeline:   {pipeline}\n"
+            f"  functional: {functional}"
+        )
+
+
+class CoSimulator:
+    """
+    讓 main.CPU 與功能模型（C.CPU 的單指令翻譯，位址與初始狀態設定成與 main.CPU 相同）同步執行。
+    每條指令在 WB 完成時，功能模型執行同一條指令，並比較兩邊暫存器與記憶體的雜湊；
+    雜湊是每個位置 hash((位置, 值)) 的總和，寫入時只更新被改變的那一項，不必複製或掃描整個狀態。
+    流水線這一邊的狀態由完成的指令依序提交（main.CPU 的 add/sub 在 MEM 就寫回，不能直接用它的暫存器）。
+    第一次不一致時丟出 Divergence。
+    """
+
+    def __init__(self):
+        self.cpu = None
+        self.reference = None
+        self.retired = 0
+        self.registers = None  # 流水線已提交的暫存器
+        self.memory = None  # 流水線已提交的記憶體
+        self.slots = None
+        self.steps = None
+        self.hashes = [0, 0, 0, 0]  # 流水線暫存器、流水線記憶體、功能模型暫存器、功能模型記憶體
+
+    def attach(self, cpu):
+        """cpu 載入指令後、開始執行前呼叫"""
+        program = cpu.instructions
+        reference = C.CPU()
+        reference.load_instructions([C.parse_instruction(instruction_text(program, i)) for i in range(len(program))])
+        reference.registers = list(cpu.registers)
+        reference.memory = ByteAddressed(copy_memory(cpu.memory))
+        self.cpu = cpu
+        self.reference = reference
+        self.retired = 0
+        self.registers = list(cpu.registers)
+        self.memory = copy_memory(cpu.memory)
+        self.hashes = [0, 0, 0, 0]
+        # 每條指令寫入的暫存器；sw 為 None，beq 為 -1
+        self.slots = [None if program.opcode[i] == OP_SW else -1 if program.opcode[i] == OP_BEQ else program.dest[i] for i in range(len(program))]
+        self.steps = [None] * len(program)  # 功能模型的單指令函式
+        cpu.on_retire = self.retire
+
+    def detach(self):
+        self.cpu.on_retire = None
+
+    def retire(self, i):
+        """流水線完成指令 i 的 WB"""
+        reference = self.reference
+        if reference.pc != i:
+            program = self.cpu.instructions
+            expected = f"[{reference.pc}] {instruction_text(program, reference.pc)}" if reference.pc < len(program) else "end of program"
+            raise self._divergence(i, f"retired [{i}]", f"next is {expected}")
+        step = self.steps[i]
+        if step is None:
+            step = self.steps[i] = reference.translate_block(i, limit=1)[0]
+        r = reference.registers
+        slot = self.slots[i]
+        hashes = self.hashes
+
+        if slot is None:  # sw
+            cpu = self.cpu
+            words = reference.memory.words
+            size = len(words)
+            word = cpu.addresses[i] // 4 % size
+            value = cpu.memory[word]
+            old = self.memory[word]
+            self.memory[word] = value
+            hashes[1] = (hashes[1] + hash((word, value)) - hash((word, old))) & HASH_MASK
+            program = cpu.instructions
+            ref_word = (r[program.base[i]] + program.offset[i]) // 4 % size
+            ref_old = words[ref_word]
+            reference.pc = step(r, reference.memory)
+            ref_value = words[ref_word]
+            hashes[3] = (hashes[3] + hash((ref_word, ref_value)) - hash((ref_word, ref_old))) & HASH_MASK
+            if hashes[1] != hashes[3]:
+                raise self._divergence(i, f"mem[{word * 4:#x}] = {value}", f"mem[{ref_word * 4:#x}] = {ref_value}")
+        elif slot >= 0:  # add、sub、lw
+            value = self.cpu.values[i]
+            registers = self.registers
+            old = registers[slot]
+            registers[slot] = value
+            hashes[0] = (hashes[0] + hash((slot, value)) - hash((slot, old))) & HASH_MASK
+            ref_old = r[slot]
+            reference.pc = step(r, reference.memory)
+            ref_value = r[slot]
+            hashes[2] = (hashes[2] + hash((slot, ref_value)) - hash((slot, ref_old))) & HASH_MASK
+            if hashes[0] != hashes[2]:
+                raise self._divergence(i, f"${slot} = {value}", f"${slot} = {ref_value}")
+        else:  # beq
+            reference.pc = step(r, reference.memory)
+        self.retired += 1
+
+    def _divergence(self, index, pipeline, functional):
+        text = instruction_text(self.cpu.instructions, index) if index is not None else ""
+        return Divergence(self.cpu.cycles + 1, self.retired, index, text, pipeline, functional)
+
+    def finish(self):
+        """流水線結束後確認功能模型也已結束，且流水線最終的暫存器與記憶體與功能模型相同"""
+        cpu = self.cpu
+        program = cpu.instructions
+        reference = self.reference
+        if reference.pc < len(program):
+            raise Divergence(cpu.cycles, self.retired, None, "", "finished", f"next is [{reference.pc}] {instruction_text(program, reference.pc)}")
+        for slot, (value, expected) in enumerate(zip(cpu.registers, reference.registers)):
+            if value != expected:
+                raise Divergence(cpu.cycles, self.retired, None, "", f"${slot} = {value}", f"${slot} = {expected}")
+        words = reference.memory.words
+        if isinstance(cpu.memory, PagedMemory):
+            if cpu.memory.result_lines() != words.result_lines():
+                raise Divergence(cpu.cycles, self.retired, None, "", "memory differs", "memory differs")
+        else:
+            for word, (value, expected) in enumerate(zip(cpu.memory, words)):
+                if value != expected:
+                    raise Divergence(cpu.cycles, self.retired, None, "", f"mem[{word * 4:#x}] = {value}", f"mem[{word * 4:#x}] = {expected}")
+
+    def run(self, max_cycles=None):
+        """執行 CPU；回傳第一個 Divergence，全部一致時回傳 None"""
+        try:
+            self.cpu.run(max_cycles)
+            if max_cycles is None or not (self.cpu.pc < len(self.cpu.instructions) or self.cpu.pipeline_busy()):
+                self.finish()
+        except Divergence as divergence:
+            return divergence
+        return None
+
+
+if __name__ == "__main__":
+    from assembler import assemble_file
+    from main import CPU
+
+    parser = argparse.ArgumentParser(description="流水線與功能模型同步執行，回報第一個不一致的地方")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的週期數")
+    parser.add_argument("--paged-memory", action="store_true", help="使用完整 32 位元位址空間的分頁記憶體")
+    args = parser.parse_args()
+
+    cpu = CPU(memory=PagedMemory() if args.paged_memory else None)
+    assembly = assemble_file(args.input_file)
+    cpu.load_instructions(assembly.program)
+    assembly.initialize(cpu.memory)
+    cosim = CoSimulator()
+    cosim.attach(cpu)
+    divergence = cosim.run(args.max_cycles)
+    if divergence is not None:
+        print(divergence)
+        sys.exit(1)
+    print(f"no divergence: {cosim.retired} instructions retired in {cpu.cycles} cycles")
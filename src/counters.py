@@ -0,0 +1,158 @@
+import json
+import time
+
+from program import HAZARD_BRANCH, HAZARD_DATA, HAZARD_LOAD_USE, OPCODES, STAGE_EX, STAGE_ID, STAGE_IF, STAGE_MEM, STAGE_NAMES, STAGE_WB
+
+STALL_CAUSES = {HAZARD_LOAD_USE: "load_use", HAZARD_BRANCH: "branch", HAZARD_DATA: "data"}
+
+
+class PerfCounters:
+    """
+    CPU 的效能計數器，以 CPU(counters=PerfCounters()) 啟用；未啟用時 CPU 每個週期只多一次 None 檢查。
+    指令在 WB 階段計為完成；停頓依冒險原因與停在 ID/EX 的指令索引（PC）分類。
+    """
+
+    def __init__(self):
+        self.program = None
+        self.cycles = 0
+        self.retired = 0  # 完成 WB 的指令數
+        self.flushes = 0  # 跳躍的 beq 清空 IF/ID 的次數
+        self.squashed = 0  # 被清掉的指令數
+        self.stalls = [0] * (max(STALL_CAUSES) + 1)  # 依冒險種類
+        self.by_opcode = [0] * len(OPCODES)  # 依 opcode 的完成指令數
+        self.busy = [0] * len(STAGE_NAMES)  # 各階段有指令的週期數
+        self.pc_stalls = []  # 每條指令造成的停頓週期數
+
+    def bind(self, program):
+        """CPU 載入指令時呼叫"""
+        self.program = program
+        self.pc_stalls = [0] * len(program)
+
+    def cycle(self, wb, mem, ex, id_, if_):
+        """一個週期結束時各階段中的指令索引（None 表示空泡）"""
+        self.cycles += 1
+        busy = self.busy
+        if wb is not None:
+            busy[STAGE_WB] += 1
+            self.retired += 1
+            self.by_opcode[self.program.opcode[wb]] += 1
+        if mem is not None:
+            busy[STAGE_MEM] += 1
+        if ex is not None:
+            busy[STAGE_EX] += 1
+        if id_ is not None:
+            busy[STAGE_ID] += 1
+        if if_ is not None:
+            busy[STAGE_IF] += 1
+
+    def stall(self, index, cause):
+        """index 在 ID/EX 因 cause 停頓一個週期"""
+        self.stalls[cause] += 1
+        self.pc_stalls[index] += 1
+
+    def flush(self, index, squashed):
+        """跳躍的 beq（index）清空 IF/ID；squashed 為被清掉的指令數"""
+        self.flushes += 1
+        self.squashed += squashed
+
+    def state(self):
+        """所有計數的串列（供 steady.run_skipping 外插迴圈迭代）"""
+        return [self.cycles, self.retired, self.flushes, self.squashed, *self.stalls, *self.by_opcode, *self.busy, *self.pc_stalls]
+
+    def advance(self, before, after, count):
+        """目前狀態再加上 count 次 (after - before) 的變化"""
+        self.restore([now + count * (b - a) for now, a, b in zip(self.state(), before, after)])
+
+    def restore(self, values):
+        """回到 state() 回傳的狀態（程式必須相同）"""
+        if len(values) != len(self.state()):
+            raise ValueError(f"counter state has {len(values)} values, expected {len(self.state())}")
+        self.cycles, self.retired, self.flushes, self.squashed = values[:4]
+        n = 4
+        for column in (self.stalls, self.by_opcode, self.busy, self.pc_stalls):
+            column[:] = values[n:n + len(column)]
+            n += len(column)
+
+    def to_dict(self, profiler=None):
+        """可轉成 JSON 的摘要"""
+        data = {
+            "cycles": self.cycles,
+            "instructions": self.retired,
+            "cpi": self.cycles / self.retired if self.retired else None,
+            "stalls": {name: self.stalls[cause] for cause, name in STALL_CAUSES.items()},
+            "flushes": self.flushes,
+            "squashed": self.squashed,
+            "opcodes": {name: self.by_opcode[op] for op, name in enumerate(OPCODES)},
+            "stages": {
+                name: {"busy": self.busy[stage], "bubble": self.cycles - self.busy[stage]}
+                for stage, name in enumerate(STAGE_NAMES)
+            },
+            "pc_stalls": {str(pc): count for pc, count in enumerate(self.pc_stalls) if count},
+        }
+        if profiler is not None:
+            data["host_seconds"] = profiler.to_dict()
+        return data
+
+    def write_json(self, path, profiler=None):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(profiler), f, indent=2)
+            f.write("\n")
+
+    def write_prometheus(self, path, profiler=None):
+        """Prometheus text exposition 格式"""
+        data = self.to_dict(profiler)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP mips_{name} {help_text}")
+            lines.append(f"# TYPE mips_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"mips_{name}{{{label_text}}} {value}" if label_text else f"mips_{name} {value}")
+
+        metric("cycles_total", "counter", "Simulated clock cycles.", [({}, data["cycles"])])
+        metric("instructions_retired_total", "counter", "Instructions that completed WB.", [({}, data["instructions"])])
+        if data["cpi"] is not None:
+            metric("cpi", "gauge", "Cycles per retired instruction.", [({}, data["cpi"])])
+        metric("stall_cycles_total", "counter", "Stall cycles by hazard cause.", [({"cause": k}, v) for k, v in data["stalls"].items()])
+        metric("flushes_total", "counter", "Taken branches that flushed IF/ID.", [({}, data["flushes"])])
+        metric("squashed_instructions_total", "counter", "Instructions discarded by flushes.", [({}, data["squashed"])])
+        metric("retired_by_opcode_total", "counter", "Retired instructions by opcode.", [({"opcode": k}, v) for k, v in data["opcodes"].items()])
+        metric("stage_busy_cycles_total", "counter", "Cycles with an instruction in the stage.", [({"stage": k}, v["busy"]) for k, v in data["stages"].items()])
+        metric("stage_bubble_cycles_total", "counter", "Cycles with a bubble in the stage.", [({"stage": k}, v["bubble"]) for k, v in data["stages"].items()])
+        metric("pc_stall_cycles_total", "counter", "Stall cycles attributed to the stalled instruction.", [({"pc": k}, v) for k, v in data["pc_stalls"].items()])
+        if profiler is not None:
+            metric("host_stage_seconds_total", "counter", "Host CPU time spent in each stage handler.", [({"stage": k}, v) for k, v in data["host_seconds"].items()])
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class StageProfiler:
+    """
+    量測 execute_cycle 中每個階段實際花費的時間。
+    attach(cpu) 後 execute_cycle 在週期開始時呼叫 begin，每個階段結束（或提前結束週期）時呼叫 lap；
+    週期結束時更新流水線寄存器等的時間計入 IF。未 attach 時每個階段只多一次 None 比較。
+    """
+
+    def __init__(self):
+        self.ns = [0] * len(STAGE_NAMES)
+        self.last = 0
+
+    def begin(self):
+        self.last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        """從上一次 begin/lap 到現在的時間計入 stage"""
+        now = time.perf_counter_ns()
+        self.ns[stage] += now - self.last
+        self.last = now
+
+    def attach(self, cpu):
+        """開始量測 cpu 的各階段"""
+        cpu.profiler = self
+
+    def detach(self, cpu):
+        cpu.profiler = None
+
+    def to_dict(self):
+        return {name: self.ns[stage] / 1e9 for stage, name in enumerate(STAGE_NAMES)}
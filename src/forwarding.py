@@ -0,0 +1,146 @@
+from program import (
+    FORWARD_EX_MEM, FORWARD_ID, FORWARD_MEM_WB, FORWARD_PATHS, HAZARD_DATA, HAZARD_LOAD_USE,
+    OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, STAGE_FORWARD,
+)
+
+# parse_forwarding_spec 的路徑名稱
+PATH_NAMES = {"ex-mem": FORWARD_EX_MEM, "mem-wb": FORWARD_MEM_WB, "branch-id": FORWARD_ID}
+
+
+class ForwardingUnit:
+    """
+    main.CPU 的轉發模式（CPU(forwarding=ForwardingUnit())）。
+    暫存器只在 WB 寫回；EX 的運算元依序取自 MEM 中的 add/sub（EX/MEM -> EX）、
+    WB 中的指令（MEM/WB -> EX），都沒有時才讀暫存器檔。值還沒產生（MEM 中的 lw）或對應的路徑關閉時才停頓。
+    branch_id 開啟時 beq 改在 ID 比較，MEM 中 add/sub 的結果經由 EX/MEM -> ID 路徑提供；
+    EX 中的指令與 MEM 中的 lw 在這個週期還沒有結果，beq 留在 ID 等待。
+    """
+
+    def __init__(self, ex_mem=True, mem_wb=True, branch_id=False):
+        self.enabled = [ex_mem, mem_wb, branch_id]  # 依 FORWARD_PATHS 的順序
+        self.forwards = [0] * len(FORWARD_PATHS)  # 各路徑使用的次數
+        self.stalls = 0  # 因等待運算元停頓的週期數（EX 與 ID）
+        self.events = []  # 最近一次成功取得運算元時的轉發事件（週期記錄用）
+        self.operands = []
+
+    @property
+    def branch_id(self):
+        return self.enabled[FORWARD_ID]
+
+    def _read(self, cpu, consumer, register):
+        """EX 中的 consumer 讀取 register：回傳 (冒險種類, 值)"""
+        program = cpu.instructions
+        opcode, dest = program.opcode, program.dest
+        producer = cpu.EX_MEM
+        if producer is not None and opcode[producer] <= OP_LW and dest[producer] == register:
+            if opcode[producer] == OP_LW:
+                return HAZARD_LOAD_USE, None
+            return self._forward(FORWARD_EX_MEM, cpu, consumer, producer, register)
+        producer = cpu.MEM_WB
+        if producer is not None and opcode[producer] <= OP_LW and dest[producer] == register:
+            return self._forward(FORWARD_MEM_WB, cpu, consumer, producer, register)
+        return 0, cpu.registers[register]
+
+    def _forward(self, path, cpu, consumer, producer, register):
+        if not self.enabled[path]:
+            return HAZARD_DATA, None
+        self.events.append((STAGE_FORWARD, consumer, path << 8 | register))
+        return 0, cpu.values[producer]
+
+    def _sources(self, program, i):
+        op = program.opcode[i]
+        if op <= OP_SUB:
+            return program.src1[i], program.src2[i]
+        if op == OP_LW:
+            return (program.base[i],)
+        if op == OP_SW:
+            return program.base[i], program.dest[i]
+        return () if self.branch_id else (program.src1[i], program.src2[i])
+
+    def resolve(self, cpu, i):
+        """
+        取得 ID/EX 中指令 i 的運算元（存到 operands）。
+        Returns:
+            int: 0，或需要停頓時的冒險種類。
+        """
+        self.events = []
+        operands = self.operands = []
+        for register in self._sources(cpu.instructions, i):
+            hazard, value = self._read(cpu, i, register)
+            if hazard:
+                self.stalls += 1
+                return hazard
+            operands.append(value)
+        for _, _, packed in self.events:
+            self.forwards[packed >> 8] += 1
+        return 0
+
+    def execute(self, cpu, i):
+        """以 resolve 取得的運算元執行 EX；回傳 beq 的結果（其他指令或已在 ID 解析的 beq 為 None）"""
+        program = cpu.instructions
+        op = program.opcode[i]
+        operands = self.operands
+        if op == OP_ADD:
+            cpu.values[i] = operands[0] + operands[1]
+        elif op == OP_SUB:
+            cpu.values[i] = operands[0] - operands[1]
+        elif op == OP_BEQ:
+            return operands[0] == operands[1] if operands else None
+        else:
+            cpu.addresses[i] = operands[0] + program.offset[i]
+            if op == OP_SW:
+                cpu.values[i] = operands[1]  # sw 要存的值在 EX 取得，MEM 寫入記憶體
+        return None
+
+    def decode(self, cpu, i, cycle, instruction_status):
+        """
+        branch_id 開啟時在 ID 解析 beq（i）。
+        Returns:
+            int: 0，或 beq 必須留在 ID 等待運算元時的冒險種類。
+        """
+        program = cpu.instructions
+        if not self.branch_id or program.opcode[i] != OP_BEQ:
+            return 0
+        opcode, dest = program.opcode, program.dest
+        values = []
+        events = []
+        for register in (program.src1[i], program.src2[i]):
+            producer = cpu.ID_EX
+            if producer is not None and opcode[producer] <= OP_LW and dest[producer] == register:
+                self.stalls += 1
+                return HAZARD_DATA
+            producer = cpu.EX_MEM
+            if producer is not None and opcode[producer] <= OP_LW and dest[producer] == register:
+                if opcode[producer] == OP_LW:
+                    self.stalls += 1
+                    return HAZARD_LOAD_USE
+                events.append((STAGE_FORWARD, i, FORWARD_ID << 8 | register))
+                values.append(cpu.values[producer])
+            else:
+                # WB 中的指令在這個週期已先寫回暫存器檔
+                values.append(cpu.registers[register])
+        self.forwards[FORWARD_ID] += len(events)
+        if cpu.trace.enabled:
+            instruction_status.extend(events)
+        cpu.resolve_branch(i, values[0] == values[1], cycle, decode=True)
+        return 0
+
+    def result_lines(self):
+        """結果檔中的統計"""
+        paths = ", ".join(
+            f"{name} {count}" if enabled else f"{name} off"
+            for name, count, enabled in zip(FORWARD_PATHS, self.forwards, self.enabled)
+        )
+        return [f"{paths}; operand stall cycles {self.stalls}"]
+
+
+def parse_forwarding_spec(text):
+    """解析 "ex-mem,mem-wb,branch-id" 形式的路徑清單；"none" 表示關閉所有路徑（只在 WB 寫回）"""
+    enabled = [False] * len(FORWARD_PATHS)
+    for name in filter(None, text.split(",")):
+        if name == "none":
+            continue
+        if name not in PATH_NAMES:
+            raise ValueError(f"unknown forwarding path {name!r} (expected {', '.join(PATH_NAMES)} or none)")
+        enabled[PATH_NAMES[name]] = True
+    return ForwardingUnit(*enabled)
@@ -80,14 +80,15 @@ class MIPS_Simulator:
         print(f"Final Registers: {self.registers}")
 
 
-# 示例指令（格式：[opcode, rs, rt, rd, result]）
-# 两个 lw 指令加载数据，最后 add 指令将它们的值相加
-instructions = [
-    ["lw", 1, 0, 0, None],  # lw $t0, 0($t1) => 将内存地址0 + $t1的值加载到$t0
-    ["lw", 1, 4, 2, None],  # lw $t2, 4($t1) => 将内存地址4 + $t1的值加载到$t2
-    ["add", 0, 2, 3, None],  # add $t3, $t0, $t2 => 将$t0和$t2相加，结果存入$t3
-]
+if __name__ == "__main__":
+    # 示例指令（格式：[opcode, rs, rt, rd, result]）
+    # 两个 lw 指令加载数据，最后 add 指令将它们的值相加
+    instructions = [
+        ["lw", 1, 0, 0, None],  # lw $t0, 0($t1) => 将内存地址0 + $t1的值加载到$t0
+        ["lw", 1, 4, 2, None],  # lw $t2, 4($t1) => 将内存地址4 + $t1的值加载到$t2
+        ["add", 0, 2, 3, None],  # add $t3, $t0, $t2 => 将$t0和$t2相加，结果存入$t3
+    ]
 
-simulator = MIPS_Simulator(instructions)
-simulator.run()
-simulator.print_summary()
+    simulator = MIPS_Simulator(instructions)
+    simulator.run()
+    simulator.print_summary()
@@ -0,0 +1,482 @@
+import argparse
+import cmd
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from pathlib import Path
+
+from cosim import copy_memory, instruction_text
+from memory import PagedMemory
+from program import OP_LW
+
+DEFAULT_EVERY = 1000  # 每隔多少週期保存完整狀態（keyframe）
+PAGE_WORDS = 256  # keyframe 的記憶體分頁大小（word），未寫入的分頁與前一個 keyframe 共用
+# 寫入記錄的種類
+KIND_REGISTER, KIND_MEMORY = range(2)
+LATCH_NAMES = ("IF/ID", "ID/EX", "EX/MEM", "MEM/WB")
+NONE = -(1 << 63)  # 空的流水線寄存器或沒有寫入的指令（不會是指令索引）
+
+
+class _RecordingRegisters(list):
+    """CPU.registers 的替身：讀取與 list 相同，寫入時另外記下 (暫存器, 值)"""
+
+    __slots__ = ("writes",)
+
+    def __init__(self, values):
+        super().__init__(values)
+        self.writes = []
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self.writes.append((index, value))
+
+
+class _Index:
+    """一個暫存器或記憶體位置的寫入記錄：週期、差異記錄中的位置、寫入的指令索引"""
+
+    __slots__ = ("cycles", "positions", "writers")
+
+    def __init__(self):
+        self.cycles = array("q")
+        self.positions = array("q")
+        self.writers = array("q")
+
+
+class State:
+    """某個週期結束時的架構與流水線狀態"""
+
+    __slots__ = ("cycle", "pc", "latches", "registers", "memory")
+
+    def __init__(self, cycle, pc, latches, registers, memory):
+        self.cycle = cycle
+        self.pc = pc
+        self.latches = latches  # (IF/ID, ID/EX, EX/MEM, MEM/WB)，None 表示空
+        self.registers = registers
+        self.memory = memory
+
+
+class History:
+    """
+    CPU 執行過程的狀態歷史。只記錄改變：暫存器與記憶體的每次寫入，以及 pc 與流水線寄存器改變時的一列；
+    每 every 個週期另存暫存器與記憶體的 keyframe，某個週期的完整狀態由之前最近的 keyframe 重播寫入得到。
+    每個暫存器與記憶體位置另有寫入索引，查詢「最後一次寫入」或「何時改變」時不需要重播或重新模擬。
+    記憶體用量與狀態改變的次數成正比。
+    """
+
+    def __init__(self, cpu, every=DEFAULT_EVERY):
+        self.program = cpu.instructions
+        self.every = every
+        self.start = cpu.cycles  # 第一個記錄的狀態（週期 start 結束時）
+        self.cycles = cpu.cycles  # 最後一個記錄的週期
+        self.initial_memory = copy_memory(cpu.memory)
+        # 寫入記錄：第 n 次寫入發生在 write_cycles[n]，寫入 kinds[n] 種類的 targets[n]
+        self.write_cycles = array("q")
+        self.kinds = array("b")
+        self.targets = array("q")
+        self.values = array("q")
+        self.large = {}  # 超出 64 位元的值：寫入記錄位置 -> 值（values 中為 0）
+        self.registers = [_Index() for _ in cpu.registers]
+        self.memory = {}  # word -> _Index
+        # pc 與流水線寄存器：從 control_cycles[n] 起為 controls[5n:5n+5]（pc、IF/ID、ID/EX、EX/MEM、MEM/WB）
+        self.control_cycles = array("q")
+        self.controls = array("q")
+        self.last = None
+        self._control(cpu.cycles, (cpu.pc, cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB))
+        self.keyframes = []  # (週期, registers, 記憶體分頁)
+        self.keyframe_cycles = array("q")
+        self.pages = None
+        self.dirty_pages = set()
+        self._keyframe(cpu)
+
+    def _keyframe(self, cpu):
+        memory = cpu.memory
+        if isinstance(memory, PagedMemory):
+            pages = memory.snapshot()
+        elif self.pages is None:
+            pages = self.pages = tuple(tuple(memory[i:i + PAGE_WORDS]) for i in range(0, len(memory), PAGE_WORDS))
+        else:
+            pages = list(self.pages)
+            for page in self.dirty_pages:
+                pages[page] = tuple(memory[page * PAGE_WORDS:(page + 1) * PAGE_WORDS])
+            pages = self.pages = tuple(pages)
+        self.dirty_pages = set()
+        self.keyframes.append((cpu.cycles, tuple(cpu.registers), pages))
+        self.keyframe_cycles.append(cpu.cycles)
+
+    def _control(self, cycle, state):
+        pc, if_id, id_ex, ex_mem, mem_wb = state
+        self.control_cycles.append(cycle)
+        self.controls.extend((
+            pc,
+            NONE if if_id is None else if_id,
+            NONE if id_ex is None else id_ex,
+            NONE if ex_mem is None else ex_mem,
+            NONE if mem_wb is None else mem_wb,
+        ))
+        self.last = state
+
+    def _write(self, index, cycle, kind, target, value, writer):
+        position = len(self.kinds)
+        self.write_cycles.append(cycle)
+        self.kinds.append(kind)
+        self.targets.append(target)
+        try:
+            self.values.append(value)
+        except OverflowError:
+            self.values.append(0)
+            self.large[position] = value
+        index.cycles.append(cycle)
+        index.positions.append(position)
+        index.writers.append(NONE if writer is None else writer)
+
+    def _value(self, position):
+        value = self.large.get(position)
+        return self.values[position] if value is None else value
+
+    def _writes_in(self, cycle, register_writes, memory):
+        """
+        記錄一個週期中的寫入。寫入的指令由週期開始時的流水線寄存器推得：
+        WB 的 lw/add/sub 先寫入，其餘為 MEM 的 add/sub 或 sw。
+        """
+        program = self.program
+        _, _, _, mem, wb = self.last
+        wb_pending = wb is not None and program.opcode[wb] <= OP_LW
+        for register, value in register_writes:
+            if wb_pending and program.dest[wb] == register:
+                writer, wb_pending = wb, False
+            else:
+                writer = mem
+            self._write(self.registers[register], cycle, KIND_REGISTER, register, value, writer)
+        for word in memory:
+            index = self.memory.get(word)
+            if index is None:
+                index = self.memory[word] = _Index()
+            self._write(index, cycle, KIND_MEMORY, word, memory[word], mem)
+            self.dirty_pages.add(word // PAGE_WORDS)
+
+    def record(self, cpu, register_writes, memory_words):
+        """記錄剛執行完的週期：register_writes 為依序的 (暫存器, 值)，memory_words 為 sw 寫入的 word"""
+        cycle = cpu.cycles
+        if register_writes or memory_words:
+            memory = cpu.memory
+            if not isinstance(memory, PagedMemory):
+                # 與 list 的負索引相同
+                memory_words = [word % len(memory) for word in memory_words]
+            self._writes_in(cycle, register_writes, {word: memory[word] for word in memory_words})
+        state = (cpu.pc, cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB)
+        if state != self.last:
+            self._control(cycle, state)
+        self.cycles = cycle
+        if cycle % self.every == 0:
+            self._keyframe(cpu)
+
+    def _check(self, cycle):
+        if not self.start <= cycle <= self.cycles:
+            raise ValueError(f"cycle {cycle} is outside the recorded range {self.start}-{self.cycles}")
+
+    def writes(self, cycle):
+        """週期 cycle 中的寫入：(KIND_REGISTER 或 KIND_MEMORY, 暫存器或 word, 值) 的串列"""
+        self._check(cycle)
+        begin, end = bisect_left(self.write_cycles, cycle), bisect_right(self.write_cycles, cycle)
+        return [(self.kinds[p], self.targets[p], self._value(p)) for p in range(begin, end)]
+
+    def state(self, cycle):
+        """週期 cycle 結束時的完整狀態（由最近的 keyframe 重播最多 every 個週期的寫入）"""
+        self._check(cycle)
+        keyframe_cycle, registers, pages = self.keyframes[bisect_right(self.keyframe_cycles, cycle) - 1]
+        registers = list(registers)
+        if isinstance(self.initial_memory, PagedMemory):
+            memory = copy_memory(self.initial_memory)
+            memory.restore(pages)
+        else:
+            memory = list(chain.from_iterable(pages))
+        begin, end = bisect_right(self.write_cycles, keyframe_cycle), bisect_right(self.write_cycles, cycle)
+        kinds, targets = self.kinds, self.targets
+        for position in range(begin, end):
+            if kinds[position] == KIND_REGISTER:
+                registers[targets[position]] = self._value(position)
+            else:
+                memory[targets[position]] = self._value(position)
+        row = (bisect_right(self.control_cycles, cycle) - 1) * 5
+        pc, *latches = self.controls[row:row + 5]
+        return State(cycle, pc, tuple(None if index == NONE else index for index in latches), registers, memory)
+
+    def _writes(self, index):
+        if index is None:
+            return []
+        return [
+            (cycle, self._value(position), None if writer == NONE else writer)
+            for cycle, position, writer in zip(index.cycles, index.positions, index.writers)
+        ]
+
+    def register_writes(self, register):
+        """暫存器的所有寫入：(週期, 值, 指令索引) 的串列"""
+        return self._writes(self.registers[register])
+
+    def memory_writes(self, word):
+        """記憶體 word 的所有寫入：(週期, 值, 指令索引) 的串列"""
+        return self._writes(self.memory.get(word))
+
+    def _last(self, index, before):
+        if index is None:
+            return None
+        position = bisect_right(index.cycles, self.cycles if before is None else before) - 1
+        if position < 0:
+            return None
+        writer = index.writers[position]
+        return (index.cycles[position], self._value(index.positions[position]), None if writer == NONE else writer)
+
+    def last_register_write(self, register, before=None):
+        """週期 before（預設為最後）以前最後一次寫入暫存器的 (週期, 值, 指令索引)，沒有時為 None"""
+        return self._last(self.registers[register], before)
+
+    def last_memory_write(self, word, before=None):
+        """週期 before（預設為最後）以前最後一次寫入記憶體 word 的 (週期, 值, 指令索引)，沒有時為 None"""
+        return self._last(self.memory.get(word), before)
+
+    def memory_changes(self, word):
+        """記憶體 word 的值真正改變的寫入：(週期, 舊值, 新值, 指令索引) 的串列"""
+        changes = []
+        old = self.initial_memory[word]
+        for cycle, value, writer in self.memory_writes(word):
+            if value != old:
+                changes.append((cycle, old, value, writer))
+                old = value
+        return changes
+
+    def register_changes(self, register):
+        """暫存器的值真正改變的寫入：(週期, 舊值, 新值, 指令索引) 的串列"""
+        changes = []
+        old = self.keyframes[0][1][register]
+        for cycle, value, writer in self.register_writes(register):
+            if value != old:
+                changes.append((cycle, old, value, writer))
+                old = value
+        return changes
+
+
+class HistoryRecorder:
+    """執行 CPU 並將每個週期記錄到 History（與 CPU.run 相同，只在週期之間多做記錄）"""
+
+    def __init__(self, cpu, every=DEFAULT_EVERY):
+        self.cpu = cpu
+        self.history = History(cpu, every)
+
+    def run(self, max_cycles=None):
+        """執行直到結束（或達到 max_cycles），回傳 History"""
+        cpu = self.cpu
+        history = self.history
+        registers = cpu.registers
+        recording = cpu.registers = _RecordingRegisters(registers)
+        dirty = cpu.dirty_words
+        written = cpu.dirty_words = set()
+        length = len(cpu.instructions)
+        try:
+            cycle = cpu.cycles + 1
+            while cpu.pc < length or cpu.pipeline_busy():
+                if max_cycles is not None and cycle > max_cycles:
+                    break
+                cpu.execute_cycle(cycle)
+                history.record(cpu, recording.writes, written)
+                if recording.writes:
+                    recording.writes.clear()
+                if written:
+                    written.clear()
+                cycle += 1
+        finally:
+            registers[:] = recording
+            cpu.registers = registers
+            cpu.dirty_words = dirty
+            if dirty is not None:
+                # checkpoint 追蹤的寫入位置（多記錄的位置只會多複製分頁）
+                dirty.update(history.memory)
+        return history
+
+
+def parse_location(text):
+    """$N 為暫存器、mem[N] 為記憶體 word；回傳 ("register" 或 "memory", 編號)"""
+    match = re.fullmatch(r"\$(\d+)|mem\[(0x[0-9a-fA-F]+|\d+)\]", text.strip())
+    if match is None:
+        raise ValueError(f"bad location {text!r} (expected $N or mem[N])")
+    if match.group(1) is not None:
+        register = int(match.group(1))
+        if register >= 32:
+            raise ValueError(f"no register ${register}")
+        return "register", register
+    return "memory", int(match.group(2), 0)
+
+
+class HistoryShell(cmd.Cmd):
+    """在記錄好的歷史中前後移動並查詢（不重新模擬）"""
+
+    prompt = "(history) "
+
+    def __init__(self, history, stdout=None):
+        super().__init__(stdout=stdout)
+        self.history = history
+        self.cycle = history.start
+
+    def _print(self, text=""):
+        self.stdout.write(text + "\n")
+
+    def _instruction(self, index):
+        if index is None:
+            return "-"
+        return f"[{index}] {instruction_text(self.history.program, index)}"
+
+    def _writer(self, writer):
+        return f" by {self._instruction(writer)}" if writer is not None else ""
+
+    def _go(self, cycle):
+        try:
+            self.history._check(cycle)
+        except ValueError as error:
+            self._print(str(error))
+            return
+        self.cycle = cycle
+        self.do_show("")
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        self._print(f"unknown command {line.split()[0]!r} (try help)")
+
+    def do_show(self, arg):
+        """show：目前週期的 pc、流水線寄存器與這個週期的改變"""
+        state = self.history.state(self.cycle)
+        self._print(f"cycle {self.cycle}  pc={state.pc}")
+        for name, index in zip(LATCH_NAMES, state.latches):
+            self._print(f"  {name:7s} {self._instruction(index)}")
+        for kind, target, value in self.history.writes(self.cycle):
+            if kind == KIND_REGISTER:
+                self._print(f"  ${target} = {value}")
+            else:
+                self._print(f"  mem[{target}] = {value}")
+
+    def do_step(self, arg):
+        """step [N]：往後 N 個週期（預設 1）"""
+        self._go(self.cycle + (int(arg) if arg else 1))
+
+    def do_back(self, arg):
+        """back [N]：往前 N 個週期（預設 1）"""
+        self._go(self.cycle - (int(arg) if arg else 1))
+
+    def do_goto(self, arg):
+        """goto N：跳到週期 N（start 與 end 分別為第一個與最後一個週期）"""
+        targets = {"start": self.history.start, "end": self.history.cycles}
+        self._go(targets[arg] if arg in targets else int(arg))
+
+    def do_regs(self, arg):
+        """regs：目前週期的暫存器"""
+        registers = self.history.state(self.cycle).registers
+        for row in range(0, len(registers), 8):
+            self._print("  " + "  ".join(f"${i:<2d}={registers[i]}" for i in range(row, min(row + 8, len(registers)))))
+
+    def do_mem(self, arg):
+        """mem [START [COUNT]]：目前週期的記憶體 word（預設 0 開始的 32 個）"""
+        parts = arg.split()
+        start = int(parts[0], 0) if parts else 0
+        count = int(parts[1], 0) if len(parts) > 1 else 32
+        memory = self.history.state(self.cycle).memory
+        self._print(" ".join(str(memory[word]) for word in range(start, start + count)))
+
+    def do_last(self, arg):
+        """last $N|mem[N]：目前週期以前最後一次寫入該位置的週期"""
+        kind, number = parse_location(arg)
+        if kind == "register":
+            found = self.history.last_register_write(number, self.cycle)
+        else:
+            found = self.history.last_memory_write(number, self.cycle)
+        if found is None:
+            self._print(f"{arg.strip()} not written by cycle {self.cycle}")
+        else:
+            cycle, value, writer = found
+            self._print(f"cycle {cycle}: {arg.strip()} = {value}{self._writer(writer)}")
+
+    def do_writes(self, arg):
+        """writes $N|mem[N]：該位置的所有寫入"""
+        kind, number = parse_location(arg)
+        writes = self.history.register_writes(number) if kind == "register" else self.history.memory_writes(number)
+        for cycle, value, writer in writes:
+            self._print(f"cycle {cycle}: {arg.strip()} = {value}{self._writer(writer)}")
+        if not writes:
+            self._print(f"{arg.strip()} never written")
+
+    def do_changes(self, arg):
+        """changes $N|mem[N]：該位置的值改變的週期（略過寫入相同值）"""
+        kind, number = parse_location(arg)
+        changes = self.history.register_changes(number) if kind == "register" else self.history.memory_changes(number)
+        for cycle, old, new, writer in changes:
+            self._print(f"cycle {cycle}: {arg.strip()} {old} -> {new}{self._writer(writer)}")
+        if not changes:
+            self._print(f"{arg.strip()} never changed")
+
+    def do_quit(self, arg):
+        """quit：離開"""
+        return True
+
+    do_EOF = do_quit
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except (ValueError, IndexError) as error:
+            self._print(f"error: {error}")
+            return False
+
+
+if __name__ == "__main__":
+    from assembler import AssemblyError, assemble_file
+    from branch import parse_predictor_spec
+    from cache import parse_cache_spec
+    from forwarding import parse_forwarding_spec
+    from main import CPU
+    from pipetrace import NullTrace
+
+    parser = argparse.ArgumentParser(description="記錄整個執行過程，之後前後移動並查詢狀態（不重新模擬）")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("-c", "--command", action="append", default=[], help='執行指令後結束，如 -c "last $4" -c "changes mem[1]"（可重複）')
+    parser.add_argument("--every", type=int, default=DEFAULT_EVERY, help=f"keyframe 間隔週期數（預設 {DEFAULT_EVERY}）")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的週期數")
+    parser.add_argument("--paged-memory", action="store_true", help="使用完整 32 位元位址空間的分頁記憶體")
+    parser.add_argument("--icache", metavar="SPEC", help="I-cache 設定（同 main.py）")
+    parser.add_argument("--dcache", metavar="SPEC", help="D-cache 設定（同 main.py）")
+    parser.add_argument("--l2", metavar="SPEC", help="第二層快取設定（同 main.py）")
+    parser.add_argument("--predictor", metavar="SPEC", help="分支預測（同 main.py）")
+    parser.add_argument("--forwarding", metavar="PATHS", nargs="?", const="ex-mem,mem-wb", help="轉發模式（同 main.py）")
+    parser.add_argument("--register-init", type=int, default=1, help="$1-$31 的初始值（預設 1）")
+    args = parser.parse_args()
+    if args.every <= 0:
+        parser.error("--every must be positive")
+
+    try:
+        l2 = parse_cache_spec("L2", args.l2) if args.l2 is not None else None
+        cpu = CPU(
+            trace=NullTrace(),
+            memory=PagedMemory() if args.paged_memory else None,
+            icache=parse_cache_spec("I-cache", args.icache, l2) if args.icache is not None else None,
+            dcache=parse_cache_spec("D-cache", args.dcache, l2) if args.dcache is not None else None,
+            predictor=parse_predictor_spec(args.predictor) if args.predictor is not None else None,
+            forwarding=parse_forwarding_spec(args.forwarding) if args.forwarding is not None else None,
+            register_init=args.register_init,
+        )
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        assembly = assemble_file(args.input_file)
+        cpu.load_instructions(assembly.program)
+        assembly.initialize(cpu.memory)
+    except AssemblyError as error:
+        parser.exit(1, f"{error}\n")
+    history = HistoryRecorder(cpu, args.every).run(args.max_cycles)
+    shell = HistoryShell(history)
+    print(f"{args.input_file}: recorded cycles {history.start}-{history.cycles}, "
+          f"{len(history.kinds)} writes, {len(history.control_cycles)} pipeline changes, {len(history.keyframes)} keyframes")
+    if args.command:
+        for line in args.command:
+            print(f"{shell.prompt}{line}")
+            shell.onecmd(line)
+    else:
+        shell.cmdloop()
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import marshal
+import os
+import time
+from pathlib import Path
+
+from checkpoint import load, restore, save, snapshot
+
+DEFAULT_EVERY = 10000  # 每隔多少週期建立 checkpoint：重新模擬時最多多算這麼多週期
+INDEX_VERSION = 1
+# 決定流水線行為的指令欄位（其餘欄位由這些欄位衍生）
+PREFIX_COLUMNS = ("opcode", "control", "dest", "src1", "src2", "base", "offset")
+
+
+def state_directory(output_file):
+    """
+    output_file 的增量狀態資料夾：MIPS_INCREMENTAL_CACHE（設為 off 時停用），否則為
+    $XDG_CACHE_HOME/mips-simulator/incremental，其下以結果檔的絕對路徑區分。停用時回傳 None。
+    """
+    directory = os.environ.get("MIPS_INCREMENTAL_CACHE")
+    if directory:
+        if directory.lower() in ("off", "0", "none"):
+            return None
+        directory = Path(directory)
+    else:
+        directory = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "mips-simulator" / "incremental"
+    return directory / hashlib.sha256(str(Path(output_file).resolve()).encode()).hexdigest()[:16]
+
+
+class PrefixHasher:
+    """
+    指令前綴的累進雜湊：digest(n) 為前 n 條指令的雜湊，n 必須遞增，
+    每條指令只會被讀取一次，因此依序查詢多個前綴的總成本與最長的前綴成正比。
+    """
+
+    def __init__(self, program):
+        self.columns = [getattr(program, name) for name in PREFIX_COLUMNS]
+        self.hashers = [hashlib.sha1() for _ in PREFIX_COLUMNS]
+        self.length = 0
+
+    def digest(self, length):
+        if length < self.length:
+            raise ValueError(f"prefix length {length} is shorter than {self.length}")
+        for column, hasher in zip(self.columns, self.hashers):
+            hasher.update(memoryview(column)[self.length:length])
+        self.length = length
+        combined = hashlib.sha1()
+        for hasher in self.hashers:
+            combined.update(hasher.digest())
+        return combined.digest()
+
+
+def context_digest(assembly, register_init):
+    """程式以外決定初始狀態的內容：暫存器初始值、.data 與模擬器原始碼"""
+    from sweep import simulator_version
+
+    digest = hashlib.sha256()
+    digest.update(f"{INDEX_VERSION}:{register_init}:{simulator_version()}:".encode())
+    digest.update(assembly.data_words.tobytes())
+    digest.update(assembly.data_values.tobytes())
+    return digest.hexdigest()
+
+
+def _entry(hasher, cycles, reach, length):
+    """
+    checkpoint 的索引項 (週期數, 前綴長度, 是否涵蓋程式結尾, 前綴雜湊)。
+    reach 是到此為止週期結束時 pc 的最大值：每次 pc < 指令數 的比較都不超過它，因此狀態只取決於
+    前 reach 條指令與比較結果；reach 達到指令數時程式結尾也影響過狀態，新程式必須完全相同。
+    pc 曾經為負時取到的是從結尾倒數的指令（見 _reach），reach 也設為指令數。
+    """
+    covered = min(reach, length)
+    return (cycles, covered, reach >= length, hasher.digest(covered))
+
+
+def _reach(cpu, reach, length):
+    """
+    這個週期之後的 reach。跳到 0 之前的 beq 讓 pc 變成負數，取指時以 Python 的負索引取到程式結尾的指令；
+    同一個週期中取指後 pc 可能又回到 0 以上，因此也檢查剛取到的 IF/ID。
+    """
+    if cpu.pc < 0 or (cpu.IF_ID is not None and cpu.IF_ID < 0):
+        return max(reach, length)
+    return max(reach, cpu.pc)
+
+
+def _usable(entries, program, max_cycles):
+    """
+    entries 中對新程式仍然有效、且不晚於 max_cycles 的最後一個索引項的位置，沒有時為 None。
+    前綴長度隨週期遞增，第一個失效的項目之後都不會有效。
+    """
+    hasher = PrefixHasher(program)
+    length = len(program)
+    found = None
+    for position, (cycles, covered, closed, digest) in enumerate(entries):
+        if max_cycles is not None and cycles > max_cycles:
+            break
+        if (length != covered if closed else length <= covered) or hasher.digest(covered) != digest:
+            break
+        found = position
+    return found
+
+
+def _read_index(path):
+    try:
+        index = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+def _write_index(path, index):
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+    temporary.write_bytes(marshal.dumps(index))
+    os.replace(temporary, path)
+
+
+def _file_stat(path):
+    status = os.stat(path)
+    return (status.st_size, status.st_mtime_ns, status.st_ino)
+
+
+def _checkpoint_file(directory, cycles):
+    return directory / f"cycle{cycles:012d}.ckpt"
+
+
+def simulate_incremental(input_file, output_file, every=DEFAULT_EVERY, max_cycles=None, register_init=1):
+    """
+    與 main.simulate 相同的模擬與結果檔，但每 every 個週期將 checkpoint 存到 state_directory(output_file)，
+    索引鍵為該週期之前影響過狀態的指令前綴（PrefixHasher）。再次執行時找出對修改後的程式仍然有效的
+    最後一個 checkpoint，從那裡接續，並保留結果檔中該週期以前的週期記錄（結果檔必須是上次執行寫出、
+    之後沒有被改動過的檔案）。
+    Returns:
+        tuple: (CPU, 接續的週期數；從頭模擬時為 0)
+    """
+    from assembler import assemble_file
+    from main import CPU
+    from pipetrace import TextTraceWriter
+
+    assembly = assemble_file(input_file)
+    program = assembly.program
+    context = context_digest(assembly, register_init)
+    directory = state_directory(output_file)
+    index_path = directory / "index" if directory is not None else None
+    index = _read_index(index_path) if index_path is not None else None
+
+    entries = []
+    position = None
+    if index is not None and index["context"] == context and Path(output_file).exists() and index["output"] == _file_stat(output_file):
+        entries = index["entries"]
+        position = _usable(entries, program, max_cycles)
+    if position is None:
+        entries = []
+        if directory is not None and directory.exists():
+            for stale in directory.glob("cycle*.ckpt"):
+                stale.unlink()
+    else:
+        for cycles, *_ in entries[position + 1:]:
+            _checkpoint_file(directory, cycles).unlink(missing_ok=True)
+        entries = entries[:position + 1]
+
+    cpu = CPU(trace=TextTraceWriter(output_file, resume=position is not None), register_init=register_init)
+    cpu.load_instructions(program)
+    assembly.initialize(cpu.memory)
+    latest = None
+    reach = cpu.pc
+    if position is not None:
+        cycles, covered, closed, _ = entries[position]
+        latest = load(_checkpoint_file(directory, cycles))
+        restore(cpu, latest, verify=False)
+        # 接續處之後才取到的指令還沒有 EX/MEM 的結果；改變指令數時調整長度
+        length = len(program)
+        cpu.values = (cpu.values + [None] * length)[:length]
+        cpu.addresses = (cpu.addresses + [0] * length)[:length]
+        reach = covered
+    resumed = cpu.cycles
+
+    if index_path is not None:
+        # 執行中斷時結果檔已被截斷，先讓索引失效
+        index_path.unlink(missing_ok=True)
+        directory.mkdir(parents=True, exist_ok=True)
+    hasher = PrefixHasher(program)
+    length = len(program)
+    cycle = cpu.cycles + 1
+    while cpu.pc < length or cpu.pipeline_busy():
+        if max_cycles is not None and cycle > max_cycles:
+            break
+        cpu.execute_cycle(cycle)
+        reach = _reach(cpu, reach, length)
+        if directory is not None and cycle % every == 0:
+            latest = snapshot(cpu, latest, full=True)
+            save(latest, _checkpoint_file(directory, cycle))
+            entries.append(_entry(hasher, cycle, reach, length))
+        cycle += 1
+    cpu.print_results(output_file)
+
+    if index_path is not None:
+        _write_index(index_path, {"version": INDEX_VERSION, "context": context, "output": _file_stat(output_file), "entries": entries})
+    return cpu, resumed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="增量模擬：修改程式後重新執行時，從仍然有效的 checkpoint 接續")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("output_file", type=Path, help="結果檔（同時保存上次的週期記錄）")
+    parser.add_argument("--every", type=int, default=DEFAULT_EVERY, help=f"每隔多少週期建立 checkpoint（預設 {DEFAULT_EVERY}）")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的週期數")
+    parser.add_argument("--register-init", type=int, default=1, help="$1-$31 的初始值（預設 1）")
+    args = parser.parse_args()
+    if args.every <= 0:
+        parser.error("--every must be positive")
+
+    from assembler import AssemblyError
+
+    start = time.perf_counter()
+    try:
+        cpu, resumed = simulate_incremental(args.input_file, args.output_file, args.every, args.max_cycles, args.register_init)
+    except AssemblyError as error:
+        parser.exit(1, f"{error}\n")
+    elapsed = time.perf_counter() - start
+    print(f"{args.output_file}: {cpu.cycles} cycles, resumed at cycle {resumed} ({cpu.cycles - resumed} simulated, {elapsed:.2f}s)")
@@ -0,0 +1,252 @@
+import numpy as np
+
+from main import write_final_results
+from pipetrace import RingBufferTrace
+from program import OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, STAGE_EX, STAGE_ID, STAGE_IF, STAGE_MEM, STAGE_WB
+
+
+class _Group:
+    """
+    一群流水線狀態（pc 與四個流水線暫存器）完全相同的 lane。
+    控制流程以純量處理，暫存器、記憶體與流水線中的值則是每個 lane 一欄的陣列。
+    """
+
+    __slots__ = (
+        "lanes", "registers", "memory", "pc", "IF_ID", "ID_EX", "EX_MEM", "MEM_WB",
+        "ex_mem_value", "ex_mem_address", "mem_wb_value", "stalls", "log", "parent_log",
+    )
+
+    def split(self, mask):
+        """將 mask 為 True 的 lane 分出成新的群組，回傳新群組"""
+        other = _Group()
+        for name in ("pc", "IF_ID", "ID_EX", "EX_MEM", "MEM_WB"):
+            setattr(other, name, getattr(self, name))
+        for name in ("lanes", "registers", "memory", "ex_mem_value", "ex_mem_address", "mem_wb_value", "stalls"):
+            value = getattr(self, name)
+            setattr(other, name, value[..., mask])
+            setattr(self, name, value[..., ~mask])
+        # 分出的群組共用分裂前的記錄
+        other.log = []
+        other.parent_log = (self.log, len(self.log), self.parent_log)
+        return other
+
+    def merge(self, other):
+        """併入另一個狀態相同的群組"""
+        for name in ("lanes", "registers", "memory", "ex_mem_value", "ex_mem_address", "mem_wb_value", "stalls"):
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(other, name)], axis=-1))
+
+    def key(self):
+        return (self.pc, self.IF_ID, self.ID_EX, self.EX_MEM, self.MEM_WB)
+
+
+class LaneCPU:
+    """
+    以 NumPy 同時模擬同一程式在多組初始暫存器／記憶體下的流水線（每組稱為一個 lane）。
+    流水線狀態相同的 lane 組成一個群組一起前進，每條指令以向量運算套用到整個群組；
+    beq 結果不同時依遮罩把群組拆開，各自有自己的 pc 與週期數，狀態再次相同時合併。
+    數值為 64 位元整數。
+    """
+
+    def __init__(self, program, lanes=None, registers=None, memory=None, record=False):
+        if lanes is None:
+            lanes = len(registers) if registers is not None else len(memory) if memory is not None else 1
+        if registers is None:
+            registers = np.ones((lanes, 32), dtype=np.int64)
+            registers[:, 0] = 0  # $0 暫存器為 0
+        if memory is None:
+            memory = np.ones((lanes, 32), dtype=np.int64)
+        self.program = program
+        self.lanes = lanes
+        # 結果：每個 lane 一列
+        self.registers = np.array(registers, dtype=np.int64).reshape(lanes, -1)
+        self.memory = np.array(memory, dtype=np.int64).reshape(lanes, -1)
+        self.cycles = np.zeros(lanes, dtype=np.int64)
+        self.stalls = np.zeros(lanes, dtype=np.int64)
+        self.cycle = 0  # 全域週期數
+
+        # 記錄週期事件時不合併群組，以免記錄分叉後無法還原
+        self.record = record
+        self.lane_logs = [None] * lanes
+
+        group = _Group()
+        group.lanes = np.arange(lanes)
+        # 群組內以 (暫存器, lane) 排列，同一暫存器的所有 lane 是連續的一列
+        group.registers = self.registers.T.copy()
+        group.memory = self.memory.T.copy()
+        group.pc = 0
+        group.IF_ID = group.ID_EX = group.EX_MEM = group.MEM_WB = None
+        group.ex_mem_value = np.zeros(lanes, dtype=np.int64)
+        group.ex_mem_address = np.zeros(lanes, dtype=np.int64)
+        group.mem_wb_value = np.zeros(lanes, dtype=np.int64)
+        group.stalls = np.zeros(lanes, dtype=np.int64)
+        group.log = []
+        group.parent_log = None
+        self.groups = [group]
+
+    def _finish(self, group):
+        """將群組的結果寫回各 lane"""
+        lanes = group.lanes
+        self.registers[lanes] = group.registers.T
+        self.memory[lanes] = group.memory.T
+        self.cycles[lanes] = self.cycle
+        self.stalls[lanes] = group.stalls
+        if self.record:
+            for lane in lanes:
+                self.lane_logs[lane] = (group.log, len(group.log), group.parent_log)
+
+    def _step_group(self, group):
+        """群組執行一個時鐘週期（對應 CPU.execute_cycle），回傳執行後的群組串列"""
+        program = self.program
+        opcode = program.opcode
+        dest = program.dest
+        registers = group.registers
+        record = self.record
+        entries = []
+
+        # Write Back (WB)
+        i = group.MEM_WB
+        if i is not None:
+            if record:
+                entries.append((STAGE_WB, i, program.control[i]))
+            if opcode[i] <= OP_LW:
+                registers[dest[i]] = group.mem_wb_value
+
+        # Memory Access (MEM)
+        i = group.EX_MEM
+        if i is not None:
+            if record:
+                entries.append((STAGE_MEM, i, program.control[i]))
+            op = opcode[i]
+            if op == OP_LW:
+                group.ex_mem_value = group.memory[group.ex_mem_address // 4, np.arange(len(group.lanes))]
+            elif op == OP_SW:
+                group.memory[group.ex_mem_address // 4, np.arange(len(group.lanes))] = registers[dest[i]]
+            elif op <= OP_SUB:
+                registers[dest[i]] = group.ex_mem_value
+
+        # Execute (EX)
+        ex_value = ex_address = None
+        split = None
+        i = group.ID_EX
+        if i is not None:
+            if program.hazard(i, group.EX_MEM, group.MEM_WB):
+                # 停頓：EX/MEM 變成空泡，IF/ID、ID/EX 與 PC 不變
+                if record:
+                    entries.append((STAGE_ID, i, program.control[i]))
+                    if group.IF_ID is not None:
+                        entries.append((STAGE_IF, group.IF_ID, program.control[group.IF_ID]))
+                    group.log.append(tuple(entries))
+                group.stalls += 1
+                group.MEM_WB = group.EX_MEM
+                group.mem_wb_value = group.ex_mem_value
+                group.EX_MEM = None
+                return [group]
+            if record:
+                entries.append((STAGE_EX, i, program.control[i]))
+            op = opcode[i]
+            if op == OP_ADD:
+                ex_value = registers[program.src1[i]] + registers[program.src2[i]]
+            elif op == OP_SUB:
+                ex_value = registers[program.src1[i]] - registers[program.src2[i]]
+            elif op == OP_BEQ:
+                taken = registers[program.src1[i]] == registers[program.src2[i]]
+                if taken.all():
+                    split = group
+                elif taken.any():
+                    split = group.split(taken)
+            else:
+                ex_address = registers[program.base[i]] + program.offset[i]
+
+        result = [group]
+        if split is not None:
+            # 跳躍的 lane：pc 回到分支目標並清空 IF/ID
+            split.pc += program.offset[i] - 1
+            split.IF_ID = None
+            if split is not group:
+                result.append(split)
+
+        n = len(program)
+        for g in result:
+            g_entries = entries
+            if record:
+                g_entries = list(entries)
+                # Instruction Decode (ID)
+                if g.IF_ID is not None:
+                    g_entries.append((STAGE_ID, g.IF_ID, program.control[g.IF_ID]))
+            # Instruction Fetch (IF)
+            next_instr = None
+            if g.pc < n:
+                next_instr = g.pc
+                g.pc += 1
+                if record:
+                    g_entries.append((STAGE_IF, next_instr, program.control[next_instr]))
+            if record:
+                g.log.append(tuple(g_entries))
+
+            # 更新流水線寄存器
+            g.MEM_WB = g.EX_MEM
+            g.mem_wb_value = g.ex_mem_value
+            g.EX_MEM = g.ID_EX
+            if ex_value is not None:
+                g.ex_mem_value = ex_value
+            if ex_address is not None:
+                g.ex_mem_address = ex_address
+            g.ID_EX = g.IF_ID
+            g.IF_ID = next_instr
+        return result
+
+    def step(self):
+        """
+        所有尚未結束的群組各執行一個時鐘週期。
+        Returns:
+            bool: 是否還有 lane 在執行。
+        """
+        n = len(self.program)
+        self.cycle += 1
+        groups = []
+        for group in self.groups:
+            groups.extend(self._step_group(group))
+
+        active = []
+        merged = {}
+        for group in groups:
+            if group.pc >= n and group.IF_ID is None and group.ID_EX is None and group.EX_MEM is None and group.MEM_WB is None:
+                self._finish(group)
+                continue
+            if not self.record:
+                key = group.key()
+                same = merged.get(key)
+                if same is not None:
+                    same.merge(group)
+                    continue
+                merged[key] = group
+            active.append(group)
+        self.groups = active
+        return bool(active)
+
+    def run(self, max_cycles=None):
+        """執行直到所有 lane 結束（或達到 max_cycles），回傳各 lane 的週期數"""
+        while self.groups and (max_cycles is None or self.cycle < max_cycles):
+            self.step()
+        for group in self.groups:
+            self._finish(group)
+        return self.cycles
+
+    def log_entries(self, lane):
+        """某 lane 每個週期的 (stage, 指令索引, 控制信號) 串列"""
+        chain = []
+        node = self.lane_logs[lane]
+        while node is not None:
+            log, length, node = node
+            chain.append(log[:length])
+        return [entries for log in reversed(chain) for entries in log]
+
+    def print_results(self, lane, output_file):
+        """輸出單一 lane 的結果，格式與 CPU.print_results 相同（需以 record=True 執行才有記錄）"""
+        trace = RingBufferTrace()
+        trace.bind(self.program)
+        if self.record:
+            for cycle, entries in enumerate(self.log_entries(lane), 1):
+                trace.cycle(cycle, entries, False)
+        with trace.open_results(output_file) as f:
+            write_final_results(f, int(self.cycles[lane]), self.registers[lane].tolist(), self.memory[lane].tolist())
@@ -0,0 +1,168 @@
+import argparse
+import mmap
+import time
+from pathlib import Path
+
+import numpy as np
+
+from program import CONTROL_BITS, NO_REG, OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, DecodedProgram
+
+# MIPS 編碼：R-type 的 opcode 為 0，以 funct 區分 add/sub
+MIPS_OPCODES = {OP_LW: 0x23, OP_SW: 0x2B, OP_BEQ: 0x04}
+MIPS_FUNCTS = {OP_ADD: 0x20, OP_SUB: 0x22}
+BYTEORDERS = {"little": "<u4", "big": ">u4"}
+
+# 6 位元 opcode（R-type 時為 64 + funct）-> 指令操作碼，其他值為 -1
+_DECODE = np.full(128, -1, dtype=np.int8)
+for _op, _code in MIPS_OPCODES.items():
+    _DECODE[_code] = _op
+for _op, _funct in MIPS_FUNCTS.items():
+    _DECODE[64 + _funct] = _op
+_CONTROL = np.array(CONTROL_BITS, dtype=np.uint16)
+_BITS = np.array([1 << register for register in range(32)] + [0], dtype=np.uint32)
+
+
+class ImageError(ValueError):
+    """機器碼映像檔無法解碼"""
+
+
+def _words(path, byteorder):
+    """以 mmap 讀取映像檔，回傳 uint32 陣列（檔案為空時為長度 0 的陣列）"""
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size % 4:
+            raise ImageError(f"{path}: size {size} is not a multiple of 4 bytes")
+        if size == 0:
+            return np.zeros(0, dtype=np.uint32)
+        view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(view, dtype=BYTEORDERS[byteorder]).astype(np.uint32)
+
+
+def decode(words, path="<image>"):
+    """
+    一次解碼整個 uint32 陣列，回傳 DecodedProgram（欄位與衍生的冒險 bitmask 皆與
+    DecodedProgram.add 逐條加入的結果相同）。
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    opcode_field = (words >> 26).astype(np.uint8)
+    rs = ((words >> 21) & 31).astype(np.int8)
+    rt = ((words >> 16) & 31).astype(np.int8)
+    rd = ((words >> 11) & 31).astype(np.int8)
+    immediate = words.astype(np.uint16).view(np.int16)
+
+    # R-type 以 64 + funct 查表，並要求 shamt 為 0
+    r_type = opcode_field == 0
+    key = np.where(r_type, 64 + (words & 63).astype(np.uint8), opcode_field)
+    op = _DECODE[key]
+    invalid = (op < 0) | (r_type & ((words & 0x7C0) != 0))
+    if invalid.any():
+        index = int(np.flatnonzero(invalid)[0])
+        raise ImageError(f"{path}: word {index} ({int(words[index]):#010x}) is not add, sub, lw, sw or beq")
+    op = op.view(np.uint8)
+
+    alu = op <= OP_SUB
+    memory = (op == OP_LW) | (op == OP_SW)
+    branch = op == OP_BEQ
+    no_reg = np.int8(NO_REG)
+    dest = np.where(alu, rd, np.where(memory, rt, no_reg))
+    src1 = np.where(memory, no_reg, rs)
+    src2 = np.where(memory, no_reg, rt)
+    base = np.where(memory, rs, no_reg)
+    offset = np.where(alu, np.int16(0), immediate)
+
+    # 暫存器 bitmask 以查表取得（NO_REG 對應最後一格的 0）
+    writes = _BITS[dest]
+    sources = np.where(memory, np.uint32(0), _BITS[src1] | _BITS[src2])
+
+    columns = {
+        "opcode": op,
+        "control": _CONTROL[op],
+        "dest": dest,
+        "src1": src1,
+        "src2": src2,
+        "base": base,
+        "offset": offset,
+        "writes": writes,
+        "load_writes": np.where(op == OP_LW, writes, np.uint32(0)),
+        "mem_writes": np.where(memory, writes, np.uint32(0)),
+        "alu_reads": np.where(alu, sources, np.uint32(0)),
+        "branch_reads": np.where(branch, sources, np.uint32(0)),
+    }
+    program = DecodedProgram()
+    for name in DecodedProgram.__slots__:
+        column = getattr(program, name)
+        column.frombytes(memoryview(np.ascontiguousarray(columns[name], dtype=np.dtype(column.typecode))).cast("B"))
+    return program
+
+
+def load_image(path, byteorder="little"):
+    """讀取 32 位元 MIPS 機器碼映像檔（byteorder 為 little 或 big）並解碼"""
+    if byteorder not in BYTEORDERS:
+        raise ValueError(f"unknown byte order {byteorder!r} (expected little or big)")
+    return decode(_words(path, byteorder), str(path))
+
+
+def encode(program, byteorder="little"):
+    """將 DecodedProgram 編碼成機器碼（bytes）"""
+    op = np.frombuffer(program.opcode, dtype=np.uint8)
+    dest = np.frombuffer(program.dest, dtype=np.int8).astype(np.uint32)
+    src1 = np.frombuffer(program.src1, dtype=np.int8).astype(np.uint32)
+    src2 = np.frombuffer(program.src2, dtype=np.int8).astype(np.uint32)
+    base = np.frombuffer(program.base, dtype=np.int8).astype(np.uint32)
+    offset = np.frombuffer(program.offset, dtype=np.int32)
+    if ((offset < -0x8000) | (offset > 0x7FFF)).any():
+        index = int(np.flatnonzero((offset < -0x8000) | (offset > 0x7FFF))[0])
+        raise ImageError(f"instruction {index}: offset {int(offset[index])} does not fit in 16 bits")
+    immediate = offset.astype(np.uint32) & 0xFFFF
+    opcode_field = np.zeros(256, dtype=np.uint32)
+    funct = np.zeros(256, dtype=np.uint32)
+    for code_op, code in MIPS_OPCODES.items():
+        opcode_field[code_op] = code
+    for code_op, code in MIPS_FUNCTS.items():
+        funct[code_op] = code
+    alu = op <= OP_SUB
+    memory = (op == OP_LW) | (op == OP_SW)
+    words = opcode_field[op] << 26
+    words |= np.where(alu, src1 << 21 | src2 << 16 | dest << 11 | funct[op], 0)
+    words |= np.where(memory, base << 21 | dest << 16 | immediate, 0)
+    words |= np.where(op == OP_BEQ, src1 << 21 | src2 << 16 | immediate, 0)
+    return words.astype(BYTEORDERS[byteorder]).tobytes()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MIPS 機器碼映像檔：由組合語言產生，或解碼並列出")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    encode_parser = subparsers.add_parser("encode", help="組譯指令檔並寫成機器碼映像檔")
+    encode_parser.add_argument("input_file", type=Path, help="指令檔")
+    encode_parser.add_argument("-o", "--output", type=Path, required=True, help="映像檔")
+    encode_parser.add_argument("--byteorder", choices=BYTEORDERS, default="little", help="位元組順序（預設 little）")
+    decode_parser = subparsers.add_parser("decode", help="解碼映像檔")
+    decode_parser.add_argument("image", type=Path, help="映像檔")
+    decode_parser.add_argument("--byteorder", choices=BYTEORDERS, default="little", help="位元組順序（預設 little）")
+    decode_parser.add_argument("--listing", action="store_true", help="列出每條指令")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "encode":
+            from assembler import AssemblyError, assemble_file
+
+            try:
+                assembly = assemble_file(args.input_file)
+            except AssemblyError as error:
+                parser.exit(1, f"{error}\n")
+            if len(assembly.data_words):
+                print(f"warning: {len(assembly.data_words)} .data words are not part of the image")
+            args.output.write_bytes(encode(assembly.program, args.byteorder))
+            print(f"{args.output}: {len(assembly.program)} instructions")
+        else:
+            start = time.perf_counter()
+            program = load_image(args.image, args.byteorder)
+            elapsed = time.perf_counter() - start
+            print(f"{args.image}: {len(program)} instructions ({elapsed * 1000:.2f} ms)")
+            if args.listing:
+                from cosim import instruction_text
+
+                for index in range(len(program)):
+                    print(f"  {index:6d}  {instruction_text(program, index)}")
+    except ImageError as error:
+        parser.exit(1, f"{error}\n")
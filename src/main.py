@@ -1,178 +1,374 @@
 from pathlib import Path
 
+from program import CONTROLS, DecodedProgram, HAZARD_LOAD_USE, OP_ADD, OP_BEQ, OP_LW, OP_SUB, OP_SW, STAGE_EX, STAGE_ID, STAGE_IF, STAGE_MEM, STAGE_WB
+from assembler import AssemblyError, assemble_file
+from cache import hierarchy
+from memory import PagedMemory
+from pipetrace import RingBufferTrace, TextTraceWriter
+
 
 class CPU:
-    def __init__(self):
+    def __init__(self, trace=None, memory=None, counters=None, icache=None, dcache=None, predictor=None, forwarding=None, register_init=1):
         # 初始化暫存器和記憶體
-        self.registers = [1] * 32  # 所有暫存器初始值為 1
+        self.registers = [register_init] * 32  # 所有暫存器的初始值（預設為 1）
         self.registers[0] = 0  # $0 暫存器永遠為 0
-        self.memory = [1] * 32  # 記憶體大小為 32 words
+        # 預設記憶體大小為 32 words；需要完整位址空間時傳入 PagedMemory
+        self.memory = memory if memory is not None else [1] * 32
         self.pc = 0  # 程式計數器
-        self.instructions = []  # 儲存解析後的指令
-        self.pipeline_log = []  # 每個時鐘週期的執行記錄
+        self.instructions = DecodedProgram()  # 儲存解碼後的指令
+        self.trace = trace if trace is not None else RingBufferTrace()  # 週期記錄的 sink
+        self.cycles = 0  # 已執行的週期數
+        self.stalls = 0  # 因冒險而暫停的週期數
+        self.taken_branch = None  # 最近一次跳躍的 beq 索引
+        self.dirty_words = None  # 上次 checkpoint 後寫入的記憶體位置，None 表示不追蹤
+        self.counters = counters  # counters.PerfCounters，None 表示不計數
+        self.profiler = None  # counters.StageProfiler，None 表示不量測各階段的時間
+        self.on_retire = None  # 指令完成 WB 時呼叫 on_retire(指令索引)
+
+        # 快取（cache.Cache）；None 表示取指／記憶體存取不經過快取、沒有額外延遲
+        self.icache = icache
+        self.dcache = dcache
+        self.fetch_pending = None  # 等待 I-cache miss 的 pc
+        self.fetch_ready = 0  # 該指令可取得的週期
+        self.memory_pending = None  # 等待 D-cache miss 的指令索引
+        self.memory_ready = 0  # 該指令可完成 MEM 的週期
+        self.fetch_stalls = 0  # 因 I-cache miss 沒有取指的週期數
+        self.memory_stalls = 0  # 因 D-cache miss 停住的週期數
+        # branch.BranchPredictor；None 表示循序取指、跳躍的 beq 一律清空 IF/ID
+        self.predictor = predictor
+        # forwarding.ForwardingUnit；None 表示原本的方式（add/sub 在 MEM 提前寫回暫存器）
+        self.forwarding = forwarding
+
+        # 每條靜態指令在 EX/MEM 階段算出的值與位址
+        self.values = []
+        self.addresses = []
 
-        # 流水線寄存器
+        # 流水線寄存器（保存指令索引，None 表示空）
         self.IF_ID = None
         self.ID_EX = None
         self.EX_MEM = None
         self.MEM_WB = None
 
     def load_instructions(self, instructions):
-        """載入指令"""
+        """載入指令（parse_instruction 的結果或 DecodedProgram）"""
+        if not isinstance(instructions, DecodedProgram):
+            instructions = DecodedProgram.from_instructions(instructions)
         self.instructions = instructions
+        self.trace.bind(instructions)
+        if self.counters is not None:
+            self.counters.bind(instructions)
+        if self.predictor is not None:
+            self.predictor.bind(instructions)
+        self.values = [None] * len(instructions)
+        self.addresses = [0] * len(instructions)
+
+    def pipeline_busy(self):
+        """流水線中是否還有指令"""
+        return not (self.IF_ID is None and self.ID_EX is None and self.EX_MEM is None and self.MEM_WB is None)
 
     def detect_hazard(self):
         """
-        檢測流水線中的資料冒險。
+        檢測流水線中的資料冒險（規則見 DecodedProgram.hazard；轉發模式見 ForwardingUnit.resolve）。
         Returns:
             bool: 如果需要暫停流水線返回 True，否則返回 False。
         """
-        # 檢測 Load-Use Hazard
-        if self.EX_MEM and self.EX_MEM.get("opcode") == "lw":
-            # EX/MEM 的目標暫存器
-            dest = self.EX_MEM.get("destination")
-            print(dest, self.ID_EX)
-            if self.ID_EX and self.ID_EX.get("opcode") in ["add", "sub"]:
-                # IF/ID 的來源暫存器
-                sources = [self.ID_EX.get("source1"), self.ID_EX.get("source2")]
-                if dest in sources:
-                    return True  # Load-Use Hazard 檢測到，需停頓
-
-        # 檢測控制冒險（分支指令依賴）
-        if self.ID_EX and self.ID_EX.get("opcode") in ["beq"]:
-            source1 = self.ID_EX.get("source1")
-            source2 = self.ID_EX.get("source2")
-            if self.EX_MEM:
-                if self.EX_MEM.get("destination") in [source1, source2]:
-                    return True  # 分支條件依賴 EX/MEM 的目標暫存器，需停頓
-            if self.MEM_WB:
-                if self.MEM_WB.get("destination") in [source1, source2] and self.MEM_WB.get("opcode") in ["lw", "sw"]:
-                    return True  # 分支條件依賴 MEM/WB 的目標暫存器，需停頓
-
-        # 檢測多重相依性（多條指令同時相依的情況）
-        # if self.MEM_WB and self.EX_MEM:
-        #     dest_MEM = self.EX_MEM.get("destination")
-        #     dest_WB = self.MEM_WB.get("destination")
-        #     if self.IF_ID:
-        #         sources = [self.IF_ID.get("source1"), self.IF_ID.get("source2")]
-        #         if dest_MEM in sources or dest_WB in sources:
-        #             return True  # 多條目標寄存器與當前指令的來源相依，需停頓
-
-        return False  # 無資料冒險，流水線正常執行
+        if self.forwarding is not None:
+            hazard = self.forwarding.resolve(self, self.ID_EX)
+        else:
+            hazard = self.instructions.hazard(self.ID_EX, self.EX_MEM, self.MEM_WB)
+        if hazard and self.counters is not None:
+            self.counters.stall(self.ID_EX, hazard)
+        if hazard == HAZARD_LOAD_USE and self.trace.notes is not None:
+            self.trace.note(self.cycles + 1, f"load-use stall: lw ${self.instructions.dest[self.EX_MEM]} in EX/MEM, ID/EX={self.ID_EX}")
+        return hazard != 0
 
     def fetch_next_instruction(self):
-        """抓取下一條指令"""
+        """抓取下一條指令（回傳指令索引）"""
         if self.pc < len(self.instructions):
-            instruction = self.instructions[self.pc]
+            if self.icache is not None and self.icache_wait():
+                return None
+            index = self.pc
             self.pc += 1
-            return instruction
+            if self.predictor is not None and self.instructions.opcode[index] == OP_BEQ:
+                self.pc = self.predictor.predict(index, self.branch_target(index))
+            return index
         return None
 
+    def icache_wait(self):
+        """pc 的指令是否還在等 I-cache miss（每條指令第一次取指時存取 I-cache）"""
+        cycle = self.cycles + 1
+        if self.fetch_pending != self.pc:
+            self.fetch_pending = self.pc
+            self.fetch_ready = cycle + self.icache.access(self.pc * 4)
+        if cycle < self.fetch_ready:
+            self.fetch_stalls += 1
+            return True
+        self.fetch_pending = None
+        return False
+
+    def dcache_wait(self, i, cycle):
+        """EX/MEM 中的 lw/sw（i）是否還在等 D-cache miss"""
+        if self.memory_pending != i:
+            self.memory_pending = i
+            penalty = self.dcache.access(self.addresses[i], self.instructions.opcode[i] == OP_SW)
+            self.memory_ready = cycle + penalty
+            if penalty and self.trace.notes is not None:
+                self.trace.note(cycle, f"{self.dcache.name} miss: address {self.addresses[i]:#x}, {penalty} cycles")
+        if cycle < self.memory_ready:
+            return True
+        self.memory_pending = None
+        return False
+
+    def branch_target(self, i):
+        """
+        beq（i）跳躍時的下一條指令：i + 1 + offset；
+        最後一條指令之後沒有抓到指令可撤銷，與沒有分支預測時相同，為 i + offset。
+        """
+        target = i + self.instructions.offset[i]
+        return target if i == len(self.instructions) - 1 else target + 1
+
+    def resolve_branch(self, i, taken, cycle, decode=False):
+        """
+        有分支預測或轉發模式時解析 beq（i）：在 EX 解析時，IF/ID（或正在取的 pc）不是正確路徑上的
+        下一條指令就清空 IF/ID；decode 為 True 時 beq 在 ID 解析，之後還沒有取指，只需要改變 PC。
+        """
+        target = self.branch_target(i)
+        correct = target if taken else i + 1
+        if decode:
+            fetched = self.pc
+        else:
+            fetched = self.IF_ID if self.IF_ID is not None else self.pc
+        mispredicted = fetched != correct
+        if self.predictor is not None:
+            self.predictor.update(i, taken, target, mispredicted)
+        if taken:
+            self.taken_branch = i
+        if mispredicted:
+            if self.trace.notes is not None:
+                self.trace.note(cycle, f"{i} Branch {'taken' if taken else 'not taken'}, fetch from {correct}")
+            if self.counters is not None and not decode:
+                self.counters.flush(i, self.IF_ID is not None)
+            if not decode:
+                self.IF_ID = None
+            self.pc = correct
+
+    def decode_stall(self, cycle, instruction_status, wb, mem, ex, hazard):
+        """beq 在 ID 等待運算元的週期：IF/ID 與 PC 不變，ID/EX 送入空泡"""
+        self.stalls += 1
+        self.cycles = cycle
+        self.trace.cycle(cycle, instruction_status, True)
+        if self.counters is not None:
+            self.counters.stall(self.IF_ID, hazard)
+            self.counters.cycle(wb, mem, ex, self.IF_ID, None)
+        self.MEM_WB = self.EX_MEM
+        self.EX_MEM = self.ID_EX
+        self.ID_EX = None
+
+    def memory_stall(self, cycle, instruction_status, wb):
+        """D-cache miss 的週期：EX/MEM 以前的指令與 PC 都不動，MEM/WB 送入空泡"""
+        if self.trace.enabled:
+            program = self.instructions
+            if self.ID_EX is not None:
+                instruction_status.append((STAGE_EX, self.ID_EX, program.control[self.ID_EX]))
+            if self.IF_ID is not None:
+                instruction_status.append((STAGE_ID, self.IF_ID, program.control[self.IF_ID]))
+        self.memory_stalls += 1
+        self.cycles = cycle
+        self.trace.cycle(cycle, instruction_status, True)
+        if self.counters is not None:
+            self.counters.cycle(wb, self.EX_MEM, self.ID_EX, self.IF_ID, None)
+        self.MEM_WB = None
+
     def execute_cycle(self, cycle):
         """執行單個時鐘周期"""
-        log_entry = [f"Clock Cycle {cycle}:"]
+        program = self.instructions
+        opcode = program.opcode
+        registers = self.registers
+        values = self.values
+        trace = self.trace
+        tracing = trace.enabled
+        wb, mem, ex = self.MEM_WB, self.EX_MEM, self.ID_EX
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin()
 
-        # 暫存每個指令的狀態，用於重新排列輸出順序
+        # 暫存每個指令的狀態 (stage, 指令索引, 控制信號)
         instruction_status = []
-        
+
         # Write Back (WB)
-        if self.MEM_WB:
-            regwrite = self.MEM_WB["control"].get("RegWrite", "X")
-            memtoreg = self.MEM_WB["control"].get("MemToReg", "X")
-            instruction_status.append(f"{self.MEM_WB['opcode']}: WB RegWrite={regwrite} MemToReg={memtoreg}")
-            if self.MEM_WB["opcode"] in ["add", "sub", "lw"]:
-                self.registers[self.MEM_WB["destination"]] = self.MEM_WB.get("value", self.registers[self.MEM_WB["destination"]])
+        i = self.MEM_WB
+        if i is not None:
+            if tracing:
+                instruction_status.append((STAGE_WB, i, program.control[i]))
+            if opcode[i] <= OP_LW:
+                value = values[i]
+                if value is not None:
+                    registers[program.dest[i]] = value
+            if self.on_retire is not None:
+                self.on_retire(i)
+        if profiler is not None:
+            profiler.lap(STAGE_WB)
 
         # Memory Access (MEM)
-        if self.EX_MEM:
-            Branch = self.EX_MEM["control"].get("Branch", "X")
-            MemRead = self.EX_MEM["control"].get("MemRead", "X")
-            MemWrite = self.EX_MEM["control"].get("MemWrite", "X")
-            RegWrite = self.EX_MEM["control"].get("RegWrite", "X")
-            MemToReg = self.EX_MEM["control"].get("MemToReg", "X")
-            instruction_status.append(f"{self.EX_MEM['opcode']}: MEM Branch={Branch} MemRead={MemRead} MemWrite={MemWrite} RegWrite={RegWrite} MemToReg={MemToReg}")
-            if self.EX_MEM["opcode"] == "lw":
-                address = self.EX_MEM["address"]
-                self.EX_MEM["value"] = self.memory[address // 4]
-            elif self.EX_MEM["opcode"] == "sw":
-                address = self.EX_MEM["address"]
-                self.memory[address // 4] = self.registers[self.EX_MEM["destination"]]
-            elif self.EX_MEM["opcode"] in ["add", "sub"]:
-                self.registers[self.EX_MEM["destination"]] = self.EX_MEM.get("value", self.registers[self.EX_MEM["destination"]])
+        i = self.EX_MEM
+        if i is not None:
+            if tracing:
+                instruction_status.append((STAGE_MEM, i, program.control[i]))
+            op = opcode[i]
+            if self.dcache is not None and OP_LW <= op <= OP_SW and self.dcache_wait(i, cycle):
+                self.memory_stall(cycle, instruction_status, wb)
+                if profiler is not None:
+                    profiler.lap(STAGE_MEM)
+                return
+            if op == OP_LW:
+                values[i] = self.memory[self.addresses[i] // 4]
+            elif op == OP_SW:
+                word = self.addresses[i] // 4
+                self.memory[word] = registers[program.dest[i]] if self.forwarding is None else values[i]
+                if self.dirty_words is not None:
+                    self.dirty_words.add(word)
+            elif self.forwarding is None:
+                value = values[i]
+                if op <= OP_SUB and value is not None:
+                    registers[program.dest[i]] = value
+        if profiler is not None:
+            profiler.lap(STAGE_MEM)
 
         # Execute (EX)
-        if self.ID_EX:
+        i = self.ID_EX
+        if i is not None:
             if not self.detect_hazard():
-                RegDst = self.ID_EX["control"].get("RegDst", "X")
-                ALUSrc = self.ID_EX["control"].get("ALUSrc", "X")
-                Branch = self.ID_EX["control"].get("Branch", "X")
-                MemRead = self.ID_EX["control"].get("MemRead", "X")
-                MemWrite = self.ID_EX["control"].get("MemWrite", "X")
-                RegWrite = self.ID_EX["control"].get("RegWrite", "X")
-                MemToReg = self.ID_EX["control"].get("MemToReg", "X")
-                instruction_status.append(f"{self.ID_EX['opcode']}: EX RegDst={RegDst} ALUSrc={ALUSrc} Branch={Branch} MemRead={MemRead} MemWrite={MemWrite} RegWrite={RegWrite} MemToReg={MemToReg}")
-                if self.ID_EX["opcode"] == "add":
-                    source1 = self.registers[self.ID_EX["source1"]]
-                    source2 = self.registers[self.ID_EX["source2"]]
-                    self.ID_EX["value"] = source1 + source2
-                elif self.ID_EX["opcode"] == "sub":
-                    source1 = self.registers[self.ID_EX["source1"]]
-                    source2 = self.registers[self.ID_EX["source2"]]
-                    self.ID_EX["value"] = source1 - source2
-                elif self.ID_EX["opcode"] in ["lw", "sw"]:
-                    base = self.registers[self.ID_EX["base"]]
-                    offset = self.ID_EX["offset"]
-                    self.ID_EX["address"] = base + offset
-                elif self.ID_EX["opcode"] == "beq":
-                    source1 = self.registers[self.ID_EX["source1"]]
-                    source2 = self.registers[self.ID_EX["source2"]]
-                    if source1 == source2:
-                        self.pc -= 1
-                        print(self.pc, "Branch taken to", self.ID_EX["offset"])
-                        self.pc += self.ID_EX["offset"]
+                if tracing:
+                    instruction_status.append((STAGE_EX, i, program.control[i]))
+                op = opcode[i]
+                if self.forwarding is not None:
+                    if tracing:
+                        instruction_status.extend(self.forwarding.events)
+                    taken = self.forwarding.execute(self, i)
+                    if taken is not None:
+                        self.resolve_branch(i, taken, cycle)
+                elif op == OP_ADD:
+                    values[i] = registers[program.src1[i]] + registers[program.src2[i]]
+                elif op == OP_SUB:
+                    values[i] = registers[program.src1[i]] - registers[program.src2[i]]
+                elif op == OP_BEQ:
+                    taken = registers[program.src1[i]] == registers[program.src2[i]]
+                    if self.predictor is not None:
+                        self.resolve_branch(i, taken, cycle)
+                    elif taken:
+                        self.taken_branch = i
+                        # 撤銷上一個週期抓到的下一條指令（I-cache miss 時沒有抓到，PC 也沒有前進）
+                        if self.IF_ID is not None or self.pc >= len(program):
+                            self.pc -= 1
+                        if trace.notes is not None:
+                            trace.note(cycle, f"{self.pc} Branch taken to {program.offset[i]}")
+                        self.pc += program.offset[i]
+                        if self.counters is not None:
+                            self.counters.flush(i, self.IF_ID is not None)
                         self.IF_ID = None  # 清空 IF/ID 暫存器
+                else:
+                    self.addresses[i] = registers[program.base[i]] + program.offset[i]
             else:
-                if self.ID_EX:
-                    instruction_status.append(f"{self.ID_EX['opcode']}: ID")
-                if self.IF_ID:
-                    instruction_status.append(f"{self.IF_ID['opcode']}: IF")
+                if tracing:
+                    instruction_status.append((STAGE_ID, i, program.control[i]))
+                    if self.IF_ID is not None:
+                        instruction_status.append((STAGE_IF, self.IF_ID, program.control[self.IF_ID]))
                 # 如果發生冒險，停止更新 IF/ID 和 PC
-                self.pipeline_log.append("\n".join(log_entry + instruction_status))
+                self.stalls += 1
+                self.cycles = cycle
+                trace.cycle(cycle, instruction_status, True)
+                if self.counters is not None:
+                    self.counters.cycle(wb, mem, None, self.ID_EX, self.IF_ID)
                 self.MEM_WB = self.EX_MEM
-                self.EX_MEM = []
+                self.EX_MEM = None
                 # IF/ID 保持不變，不抓取新指令
+                if profiler is not None:
+                    profiler.lap(STAGE_EX)
                 return
+        if profiler is not None:
+            profiler.lap(STAGE_EX)
+
         # Instruction Decode (ID)
-        if self.IF_ID:
-            instruction_status.append(f"{self.IF_ID['opcode']}: ID")
+        if self.IF_ID is not None and tracing:
+            instruction_status.append((STAGE_ID, self.IF_ID, program.control[self.IF_ID]))
+        if self.forwarding is not None and self.IF_ID is not None:
+            hazard = self.forwarding.decode(self, self.IF_ID, cycle, instruction_status)
+            if hazard:
+                self.decode_stall(cycle, instruction_status, wb, mem, ex, hazard)
+                if profiler is not None:
+                    profiler.lap(STAGE_ID)
+                return
+        if profiler is not None:
+            profiler.lap(STAGE_ID)
 
         # Instruction Fetch (IF)
         next_instr = self.fetch_next_instruction()
-        if next_instr:
-            instruction_status.append(f"{next_instr['opcode']}: IF")
+        if next_instr is not None and tracing:
+            instruction_status.append((STAGE_IF, next_instr, program.control[next_instr]))
 
-        # 排列日誌輸出
-        log_entry.extend(instruction_status)
-        self.pipeline_log.append("\n".join(log_entry))
+        self.cycles = cycle
+        trace.cycle(cycle, instruction_status, False)
+        if self.counters is not None:
+            self.counters.cycle(wb, mem, ex, self.IF_ID, next_instr)
 
         # 更新流水線寄存器
         self.MEM_WB = self.EX_MEM
         self.EX_MEM = self.ID_EX
         self.ID_EX = self.IF_ID
         self.IF_ID = next_instr
+        if profiler is not None:
+            profiler.lap(STAGE_IF)
 
+    def run(self, max_cycles=None):
+        """執行直到所有指令離開流水線（或達到 max_cycles），回傳總週期數"""
+        cycle = self.cycles + 1
+        while self.pc < len(self.instructions) or self.pipeline_busy():
+            if max_cycles is not None and cycle > max_cycles:
+                break
+            self.execute_cycle(cycle)
+            cycle += 1
+        return self.cycles
 
     def print_results(self, output_file):
         """輸出結果到檔案"""
-        with open(output_file, "w") as f:
-            f.write("# Execution Log\n")
-            f.write("\n".join(self.pipeline_log) + "\n\n")
-            f.write("## Final Results:\n")
-            f.write(f"Total Cycles: {len(self.pipeline_log)}\n")
-            f.write("\nFinal Register Values:\n")
-            f.write(" ".join(map(str, self.registers)) + "\n")
-            f.write("\nFinal Memory Values:\n")
-            f.write(" ".join(map(str, self.memory)) + "\n")
+        with self.trace.open_results(output_file) as f:
+            self.write_results(f)
+
+    def write_results(self, f):
+        """寫入週期記錄之後的結果區段"""
+        write_final_results(f, self.cycles, self.registers, self.memory)
+        if self.icache is not None or self.dcache is not None:
+            write_cache_statistics(f, self)
+        if self.forwarding is not None:
+            f.write("\nForwarding:\n")
+            for line in self.forwarding.result_lines():
+                f.write(line + "\n")
+        if self.predictor is not None:
+            f.write("\nBranch Prediction:\n")
+            for line in self.predictor.result_lines():
+                f.write(line + "\n")
+
+
+def write_final_results(f, cycles, registers, memory):
+    """寫入 ## Final Results 區段"""
+    f.write("## Final Results:\n")
+    f.write(f"Total Cycles: {cycles}\n")
+    f.write("\nFinal Register Values:\n")
+    f.write(" ".join(map(str, registers)) + "\n")
+    f.write("\nFinal Memory Values:\n")
+    if isinstance(memory, PagedMemory):
+        for line in memory.result_lines():
+            f.write(line + "\n")
+    else:
+        f.write(" ".join(map(str, memory)) + "\n")
+
+
+def write_cache_statistics(f, cpu):
+    """寫入各層快取的存取統計與 miss 造成的停頓週期"""
+    f.write("\nCache Statistics:\n")
+    for cache in hierarchy(cpu.icache, cpu.dcache):
+        f.write(cache.result_line() + "\n")
+    f.write(f"Stall cycles: fetch {cpu.fetch_stalls}, memory {cpu.memory_stalls}\n")
 
 
 def parse_instruction(line):
@@ -186,15 +382,7 @@ def parse_instruction(line):
         base = int(base.strip(")$").strip("$"))
         return {
             "opcode": opcode,
-            "control": {
-                "RegDst": "X" if opcode == "sw" else "0",
-                "ALUSrc": "1",
-                "Branch": "X",
-                "MemRead": "1" if opcode == "lw" else "0",
-                "MemWrite": "1" if opcode == "sw" else "0",
-                "RegWrite": "1" if opcode == "lw" else "0",
-                "MemToReg": "1" if opcode == "lw" else "X",
-            },
+            "control": dict(CONTROLS[opcode]),
             "destination": int(operands[0].strip("$")),
             "base": base,
             "offset": offset,
@@ -203,15 +391,7 @@ def parse_instruction(line):
         return {
             "opcode": opcode,
             "destination": int(operands[0].strip("$")),
-            "control": {
-                "RegDst": "1",
-                "ALUSrc": "0",
-                "Branch": "X",
-                "MemRead": "0",
-                "MemWrite": "0",
-                "RegWrite": "1",
-                "MemToReg": "0",
-            },
+            "control": dict(CONTROLS[opcode]),
             "source1": int(operands[1].strip("$")),
             "source2": int(operands[2].strip("$")),
         }
@@ -221,37 +401,124 @@ def parse_instruction(line):
             "source1": int(operands[0].strip("$")),
             "source2": int(operands[1].strip("$")),
             "offset": int(operands[2]),
-            "control": {
-                "RegDst": "X",
-                "ALUSrc": "0",
-                "Branch": "1",
-                "MemRead": "0",
-                "MemWrite": "0",
-                "RegWrite": "0",
-                "MemToReg": "X",
-            },
+            "control": dict(CONTROLS[opcode]),
         }
     else:
         raise ValueError(f"Unsupported opcode: {opcode}")
 
 
+def load_program(input_file):
+    """組譯指令檔，回傳 DecodedProgram（.data 的初始值見 assembler.assemble_file）"""
+    return assemble_file(input_file).program
+
+
+def simulate(input_file, output_file, trace=None, skip_loops=False, max_cycles=None, memory=None, counters=None, profiler=None, cosim=None, icache=None, dcache=None, predictor=None, forwarding=None, byteorder=None, register_init=1):
+    """
+    模擬單一程式並將結果寫到 output_file，回傳執行完的 CPU。
+    cosim 為 cosim.CoSimulator 時與功能模型同步比對，不一致時丟出 cosim.Divergence。
+    byteorder（little 或 big）不為 None 時 input_file 為機器碼映像檔（machinecode.load_image）。
+    """
+    # 先組譯，組譯錯誤時不會覆寫既有的結果檔
+    if byteorder is not None:
+        from machinecode import load_image
+
+        program, assembly = load_image(input_file, byteorder), None
+    else:
+        assembly = assemble_file(input_file)
+        program = assembly.program
+    writer = TextTraceWriter(output_file) if trace is None else None
+    cpu = CPU(trace=trace if writer is None else writer, memory=memory, counters=counters, icache=icache, dcache=dcache, predictor=predictor, forwarding=forwarding, register_init=register_init)
+    try:
+        if profiler is not None:
+            profiler.attach(cpu)
+        cpu.load_instructions(program)
+        if assembly is not None:
+            assembly.initialize(cpu.memory)
+        if cosim is not None:
+            cosim.attach(cpu)
+        if skip_loops:
+            from steady import run_skipping
+
+            run_skipping(cpu, max_cycles)
+        else:
+            cpu.run(max_cycles)
+        if cosim is not None and not (cpu.pc < len(cpu.instructions) or cpu.pipeline_busy()):
+            cosim.finish()
+        cpu.print_results(output_file)
+    except BaseException:
+        # 模擬中途失敗（如 cosim.Divergence）時關閉週期記錄檔
+        if writer is not None:
+            writer.close()
+        raise
+    return cpu
+
+
 if __name__ == "__main__":
-    cpu = CPU()
+    import argparse
 
-    # 檔案路徑
-    input_file = Path("C:\\Users\\user\\Downloads\\SampleProject (1)\\SampleProject\\inputs\\test3.txt")
-    output_file = Path("C:\\Users\\user\\Downloads\\SampleProject (1)\\SampleProject\\inputs\\test3_output.txt")
+    from bintrace import BinaryTraceWriter
+    from branch import parse_predictor_spec
+    from cache import parse_cache_spec
+    from forwarding import parse_forwarding_spec
+    from cosim import CoSimulator, Divergence
+    from counters import PerfCounters, StageProfiler
 
-    # 讀取指令
-    with open(input_file, "r") as f:
-        instructions = [parse_instruction(line.strip()) for line in f if line.strip()]
+    parser = argparse.ArgumentParser(description="MIPS 五級流水線模擬器")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("output_file", type=Path, help="結果檔")
+    parser.add_argument("--binary-trace", type=Path, help="將週期記錄寫成二進位檔（結果檔不含文字記錄）")
+    parser.add_argument("--skip-loops", action="store_true", help="迴圈進入穩定狀態時跳過重複的迭代")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的週期數")
+    parser.add_argument("--paged-memory", action="store_true", help="使用完整 32 位元位址空間的分頁記憶體")
+    parser.add_argument("--memory-image", type=Path, help="以 mmap 載入記憶體映像檔（隱含 --paged-memory）")
+    parser.add_argument("--image-address", type=lambda text: int(text, 0), default=0, help="映像檔對應的起始位址（預設 0）")
+    parser.add_argument("--dump-memory", nargs=3, metavar=("FILE", "ADDRESS", "LENGTH"), help="結束後將記憶體範圍寫成映像檔")
+    parser.add_argument("--counters", type=Path, help="將效能計數器寫成 JSON")
+    parser.add_argument("--prometheus", type=Path, help="將效能計數器寫成 Prometheus text 格式")
+    parser.add_argument("--profile-stages", action="store_true", help="量測各階段實際花費的時間（隨計數器輸出）")
+    parser.add_argument("--cosim", action="store_true", help="與功能模型同步比對每條完成的指令，第一個不一致處停止並回報")
+    parser.add_argument("--icache", metavar="SPEC", help="I-cache 設定，如 size=1024,line=16,ways=2,policy=lru,latency=10")
+    parser.add_argument("--dcache", metavar="SPEC", help="D-cache 設定，另有 write=back|through")
+    parser.add_argument("--l2", metavar="SPEC", help="I/D-cache 共用的第二層快取設定")
+    parser.add_argument("--predictor", metavar="SPEC", help="分支預測，如 2bit,entries=64,btb=16（not-taken、backward-taken、1bit、2bit）")
+    parser.add_argument("--forwarding", metavar="PATHS", nargs="?", const="ex-mem,mem-wb", help="轉發模式與開啟的路徑：ex-mem、mem-wb、branch-id 或 none（預設 ex-mem,mem-wb）")
+    parser.add_argument("--register-init", type=int, default=1, help="$1-$31 的初始值（預設 1）")
+    parser.add_argument("--binary", choices=("little", "big"), help="指令檔為 32 位元 MIPS 機器碼映像檔（位元組順序）")
+    args = parser.parse_args()
+    if args.cosim and args.skip_loops:
+        parser.error("--cosim cannot be combined with --skip-loops")
 
-    # 載入指令並執行
-    cpu.load_instructions(instructions)
-    cycle = 1
-    while cpu.pc < len(cpu.instructions) or any([cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB]):
-        cpu.execute_cycle(cycle)
-        cycle += 1
+    counters = PerfCounters() if args.counters or args.prometheus else None
+    profiler = StageProfiler() if args.profile_stages else None
+    memory = None
+    if args.paged_memory or args.memory_image or args.dump_memory:
+        memory = PagedMemory()
+        if args.memory_image:
+            memory.load_image(args.memory_image, args.image_address)
+    try:
+        l2 = parse_cache_spec("L2", args.l2) if args.l2 is not None else None
+        icache = parse_cache_spec("I-cache", args.icache, l2) if args.icache is not None else None
+        dcache = parse_cache_spec("D-cache", args.dcache, l2) if args.dcache is not None else None
+        predictor = parse_predictor_spec(args.predictor) if args.predictor is not None else None
+        forwarding = parse_forwarding_spec(args.forwarding) if args.forwarding is not None else None
+    except ValueError as error:
+        parser.error(str(error))
+    trace = BinaryTraceWriter(args.binary_trace) if args.binary_trace else None
+    load_errors = (AssemblyError,)
+    if args.binary:
+        from machinecode import ImageError
 
-    # 輸出結果
-    cpu.print_results(output_file)
+        load_errors = (ImageError,)
+    try:
+        cpu = simulate(args.input_file, args.output_file, trace, args.skip_loops, args.max_cycles, memory, counters, profiler, CoSimulator() if args.cosim else None, icache, dcache, predictor, forwarding, args.binary, args.register_init)
+    except (*load_errors, Divergence) as error:
+        parser.exit(1, f"{error}\n")
+    if args.counters:
+        counters.write_json(args.counters, profiler)
+    if args.prometheus:
+        counters.write_prometheus(args.prometheus, profiler)
+    if profiler is not None and counters is None:
+        print(" ".join(f"{stage}={seconds:.3f}s" for stage, seconds in profiler.to_dict().items()))
+    if args.dump_memory:
+        path, address, length = args.dump_memory
+        cpu.memory.dump_image(path, int(address, 0), int(length, 0))
@@ -0,0 +1,150 @@
+import mmap
+from array import array
+
+PAGE_SHIFT = 10  # 每頁 1024 words（4 KB 位址空間）
+PAGE_WORDS = 1 << PAGE_SHIFT
+ADDRESS_WORDS = 1 << 30  # 32 位元位元組位址空間的 word 數
+WORD_MASK = ADDRESS_WORDS - 1
+LEGACY_WORDS = 32  # print_results 固定輸出的前 32 words（與原本的 32-word 記憶體相同）
+
+
+class PagedMemory:
+    """
+    32 位元位元組定址的稀疏記憶體，以 word 索引（address // 4，超出範圍時以 2^32 取模）。
+    分頁在第一次寫入時才配置為 array("q")，因此每個 word 是 64 位元有號整數；
+    未寫入的位置讀到 fill，或是以 load_image 對應進來的映像檔內容。
+    """
+
+    def __init__(self, fill=1):
+        self.fill = fill
+        self.pages = {}  # 頁號 -> array("q")
+        self._blank = array("q", [fill]) * PAGE_WORDS
+        self._shared = set()  # 與 checkpoint 共用的頁，寫入前必須先複製
+        self._image = None
+        self._image_words = None  # 映像檔的 memoryview（以 word 為單位）
+        self._image_base = 0  # 映像檔起始的 word
+
+    def __len__(self):
+        return ADDRESS_WORDS
+
+    def __getitem__(self, word):
+        word &= WORD_MASK
+        page = self.pages.get(word >> PAGE_SHIFT)
+        if page is not None:
+            return page[word & (PAGE_WORDS - 1)]
+        if self._image_words is not None and 0 <= word - self._image_base < len(self._image_words):
+            return self._image_words[word - self._image_base]
+        return self.fill
+
+    def __setitem__(self, word, value):
+        word &= WORD_MASK
+        number = word >> PAGE_SHIFT
+        page = self.pages.get(number)
+        if page is None or number in self._shared:
+            page = self._materialize(number, page)
+        page[word & (PAGE_WORDS - 1)] = value
+
+    def _materialize(self, number, page):
+        """配置（或複製共用的）分頁"""
+        if page is not None:
+            page = array("q", page)
+            self._shared.discard(number)
+        else:
+            page = self._initial_page(number)
+        self.pages[number] = page
+        return page
+
+    def _initial_page(self, number):
+        """分頁在寫入前的內容：fill，與映像檔重疊的部分從映像檔複製"""
+        page = array("q", self._blank)
+        if self._image_words is not None:
+            start = number << PAGE_SHIFT
+            low = max(start, self._image_base)
+            high = min(start + PAGE_WORDS, self._image_base + len(self._image_words))
+            if low < high:
+                page[low - start:high - start] = array("q", self._image_words[low - self._image_base:high - self._image_base].tobytes())
+        return page
+
+    def load_image(self, path, address=0):
+        """
+        以 mmap 將映像檔（little-endian 64 位元 words）對應到 address 開始的位置。
+        只有被寫入的頁會複製到記憶體中，讀取直接存取映像檔。
+        """
+        if address % 4:
+            raise ValueError(f"image address {address:#x} is not word aligned")
+        with open(path, "rb") as f:
+            self._image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        usable = len(self._image) // 8 * 8
+        self._image_words = memoryview(self._image)[:usable].cast("q")
+        self._image_base = address // 4
+
+    def dump_image(self, path, address, length):
+        """將 address 起 length 位元組的內容寫成映像檔（格式與 load_image 相同）"""
+        if address % 4 or length % 4:
+            raise ValueError("image range must be word aligned")
+        first = address // 4
+        last = first + length // 4
+        with open(path, "wb") as f:
+            word = first
+            while word < last:
+                number = word >> PAGE_SHIFT
+                end = min((number + 1) << PAGE_SHIFT, last)
+                page = self.pages.get(number)
+                if page is not None:
+                    start = number << PAGE_SHIFT
+                    f.write(page[word - start:end - start].tobytes())
+                else:
+                    f.write(array("q", (self[w] for w in range(word, end))).tobytes())
+                word = end
+
+    def touched_ranges(self):
+        """
+        與初始內容（fill 或映像檔）不同的 word 合併成的 (起始 word, 結束 word) 範圍，
+        只檢查已配置的頁。
+        """
+        ranges = []
+        for number in sorted(self.pages):
+            page = self.pages[number]
+            initial = self._initial_page(number)
+            if page == initial:
+                continue
+            start = number << PAGE_SHIFT
+            for offset, (value, old) in enumerate(zip(page, initial)):
+                if value == old:
+                    continue
+                word = start + offset
+                if ranges and ranges[-1][1] == word:
+                    ranges[-1][1] = word + 1
+                else:
+                    ranges.append([word, word + 1])
+        return [tuple(r) for r in ranges]
+
+    def snapshot(self):
+        """目前所有分頁的參照；之後的寫入會先複製分頁，不會改到快照"""
+        self._shared = set(self.pages)
+        return dict(self.pages)
+
+    def restore(self, pages):
+        """還原 snapshot 的分頁（分頁仍與快照共用）"""
+        self.pages = dict(pages)
+        self._shared = set(pages)
+
+    def fork(self):
+        """與目前內容相同的複本，共用分頁與映像檔；之後任一邊寫入時才複製分頁"""
+        other = PagedMemory(self.fill)
+        other.restore(self.snapshot())
+        other._image, other._image_words, other._image_base = self._image, self._image_words, self._image_base
+        return other
+
+    def result_lines(self):
+        """
+        print_results 的記憶體內容：第一行固定是前 32 words，
+        之後每個被改變的範圍（前 32 words 以外）一行，以 "起始位址-結束位址: 值..." 表示。
+        """
+        lines = [" ".join(str(self[word]) for word in range(LEGACY_WORDS))]
+        for start, end in self.touched_ranges():
+            start = max(start, LEGACY_WORDS)
+            if start < end:
+                values = " ".join(str(self[word]) for word in range(start, end))
+                lines.append(f"{start * 4:#010x}-{end * 4 - 4:#010x}: {values}")
+        return lines
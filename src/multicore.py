@@ -0,0 +1,342 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+from program import OP_LW, OP_SW
+
+WORD_BYTES = 8
+# 每個核心在共享區段中的同步槽：週期 << 32 | 結束旗標 << 31 | 記憶體請求（0 為沒有，否則 (line << 1 | 寫入) + 1）
+_CYCLE_SHIFT = 32
+_DONE = 1 << 31
+_REQUEST_MASK = _DONE - 1
+
+
+class MSIDirectory:
+    """
+    以目錄記錄每條 line 的 MSI 狀態：owner 為持有 M 的核心（-1 表示沒有），sharers 為持有 S 的核心 bitmask。
+    每個核心的行程各有一份複本，每個週期以相同的請求表、相同的順序更新，因此所有複本保持一致。
+    同一週期的請求依輪替的優先順序（從 cycle % cores 開始）處理；會改變狀態的交易占用該 line
+    max(延遲, 1) 個週期，期間到達的請求先等待，因此衝突的 lw/sw 不會在同一個週期存取同一條 line。
+    """
+
+    def __init__(self, cores, line_words=4, transfer=10, invalidate=5):
+        if line_words <= 0 or line_words & (line_words - 1):
+            raise ValueError(f"line size must be a power of two words, got {line_words}")
+        if transfer < 1 or invalidate < 1:
+            raise ValueError("transfer and invalidate latencies must be at least 1 cycle")
+        self.cores = cores
+        self.line_words = line_words
+        self.transfer = transfer  # 讀取其他核心持有 M 的 line：寫回並降為 S
+        self.invalidate = invalidate  # 寫入其他核心持有的 line：使其他複本失效
+        self.owner = {}
+        self.sharers = {}
+        self.busy_until = {}  # line 上一筆交易結束後的第一個週期
+
+    def line(self, word):
+        return word // self.line_words
+
+    def access(self, core, line, write, cycle):
+        """
+        處理一筆請求，回傳 (等待週期, 一致性延遲, 種類)；種類為 hit、miss、transfer 或 invalidate。
+        記憶體實際在 cycle + 等待 + 延遲 存取。
+        """
+        owner = self.owner.get(line, -1)
+        sharers = self.sharers.get(line, 0)
+        bit = 1 << core
+        if owner == core or (not write and sharers & bit):
+            return 0, 0, "hit"
+        wait = max(self.busy_until.get(line, 0) - cycle, 0)
+        if write:
+            others = (sharers & ~bit) or (owner >= 0)
+            latency, kind = (self.invalidate, "invalidate") if others else (0, "miss")
+            self.owner[line] = core
+            self.sharers[line] = bit
+        else:
+            latency, kind = (self.transfer, "transfer") if owner >= 0 else (0, "miss")
+            self.owner[line] = -1
+            self.sharers[line] = sharers | bit | (1 << owner if owner >= 0 else 0)
+        self.busy_until[line] = cycle + wait + max(latency, 1)
+        return wait, latency, kind
+
+    def arbitrate(self, cycle, requests):
+        """
+        requests[core] 為 None 或 (line, write)；回傳每個核心的 (等待週期, 一致性延遲, 種類)（沒有請求時為 None）。
+        """
+        results = [None] * self.cores
+        first = cycle % self.cores
+        for offset in range(self.cores):
+            core = (first + offset) % self.cores
+            request = requests[core]
+            if request is not None:
+                results[core] = self.access(core, request[0], request[1], cycle)
+        return results
+
+
+class CoherencePort:
+    """
+    接在 CPU.dcache 位置的一致性埠：CPU 在 MEM 第一次處理 lw/sw 時呼叫 access，取得這個週期仲裁的結果作為停頓週期數。
+    """
+
+    def __init__(self, core, directory):
+        self.core = core
+        self.directory = directory
+        self.name = f"core {core} MSI"
+        self.next_level = None
+        self.result = None  # 這個週期仲裁的結果
+        self.reads = 0
+        self.writes = 0
+        self.counts = {"hit": 0, "miss": 0, "transfer": 0, "invalidate": 0}
+        self.wait_cycles = 0  # 等待其他核心交易的週期
+        self.coherence_cycles = 0  # transfer/invalidate 的延遲
+        self.line_stalls = {}  # line -> 停頓週期
+
+    def request(self, cpu):
+        """這個週期要送出的請求：EX/MEM 中第一次進入 MEM 的 lw/sw 為 (line, 寫入)，否則 None"""
+        i = cpu.EX_MEM
+        if i is None or cpu.memory_pending == i:
+            return None
+        op = cpu.instructions.opcode[i]
+        if op != OP_LW and op != OP_SW:
+            return None
+        return self.directory.line(cpu.addresses[i] // 4), op == OP_SW
+
+    def access(self, address, write=False):
+        wait, latency, kind = self.result
+        self.result = None
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        self.counts[kind] += 1
+        self.wait_cycles += wait
+        self.coherence_cycles += latency
+        if wait or latency:
+            line = self.directory.line(address // 4)
+            self.line_stalls[line] = self.line_stalls.get(line, 0) + wait + latency
+        return wait + latency
+
+    def accesses(self):
+        return self.reads + self.writes
+
+    def result_line(self):
+        """結果檔中的統計"""
+        counts = ", ".join(f"{count} {kind}" for kind, count in self.counts.items())
+        return f"{self.name}: {self.accesses()} accesses ({counts}), {self.wait_cycles} arbitration wait cycles, {self.coherence_cycles} coherence cycles"
+
+    def stats(self):
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            **self.counts,
+            "wait_cycles": self.wait_cycles,
+            "coherence_cycles": self.coherence_cycles,
+            "line_stalls": self.line_stalls,
+        }
+
+
+def _encode(cycle, done, request):
+    code = 0 if request is None else ((request[0] << 1 | request[1]) + 1)
+    return cycle << _CYCLE_SHIFT | (_DONE if done else 0) | code
+
+
+def _request(slot):
+    code = slot & _REQUEST_MASK
+    return None if code == 0 else ((code - 1) >> 1, (code - 1) & 1)
+
+
+def _views(shm, words):
+    """共享區段的 (整段, 資料記憶體, 同步槽) 三個 int64 view：前 words 個 word 為記憶體，之後為每個核心兩個槽與中止旗標"""
+    whole = shm.buf.cast("q")
+    return whole, whole[:words], whole[words:]
+
+
+def _release(views):
+    """釋放 memoryview（共享區段在所有 view 釋放後才能關閉）"""
+    for view in reversed(views):
+        view.release()
+
+
+def _barrier(slots, base, cores, cycle, abort):
+    """
+    等待所有核心送出第 cycle 週期的同步槽，回傳各槽的值。每個核心只寫自己的槽，
+    週期與請求包在同一個 8-byte word 中一次寫入；槽依週期奇偶交替，下一個週期不會覆蓋還沒被讀取的值。
+    """
+    while True:
+        values = slots[base:base + cores].tolist()
+        if all(value >> _CYCLE_SHIFT >= cycle for value in values):
+            return values
+        if slots[abort]:
+            raise RuntimeError("another core failed")
+        os.sched_yield()
+
+
+def _run_core(core, cores, program, output, shm_name, words, directory_options, max_cycles, connection):
+    """核心行程：與其他核心以全域週期同步執行，最後將統計送回"""
+    from assembler import assemble_file
+    from main import CPU
+    from pipetrace import TextTraceWriter
+
+    shm = SharedMemory(name=shm_name)
+    views = _views(shm, words)
+    memory, slots = views[1:]
+    try:
+        abort = 2 * cores
+        directory = MSIDirectory(cores, **directory_options)
+        port = CoherencePort(core, directory)
+        cpu = CPU(trace=TextTraceWriter(output), memory=memory, dcache=port)
+        cpu.load_instructions(assemble_file(program).program)
+        start = time.perf_counter()
+        cycle = 1
+        while True:
+            done = not (cpu.pc < len(cpu.instructions) or cpu.pipeline_busy()) or (max_cycles is not None and cycle > max_cycles)
+            base = (cycle % 2) * cores
+            slots[base + core] = _encode(cycle, done, None if done else port.request(cpu))
+            values = _barrier(slots, base, cores, cycle, abort)
+            if all(value & _DONE for value in values):
+                break
+            if any(value & _REQUEST_MASK for value in values):
+                port.result = directory.arbitrate(cycle, [_request(value) for value in values])[core]
+            if not done:
+                cpu.execute_cycle(cycle)
+            cycle += 1
+        elapsed = time.perf_counter() - start
+        cpu.print_results(output)
+        connection.send({
+            "core": core,
+            "program": str(program),
+            "cycles": cpu.cycles,
+            "stalls": cpu.stalls,
+            "memory_stalls": cpu.memory_stalls,
+            "global_cycles": cycle - 1,
+            "host_seconds": elapsed,
+            **port.stats(),
+        })
+    except BaseException as error:
+        slots[2 * cores] = 1
+        connection.send({"core": core, "error": f"{type(error).__name__}: {error}"})
+        if not isinstance(error, Exception):
+            raise
+    finally:
+        _release(views)
+        shm.close()
+
+
+def run_multicore(programs, output_dir, words=32, line_words=4, transfer=10, invalidate=5, max_cycles=None):
+    """
+    每個程式在各自的行程中以一個 CPU 執行，資料記憶體（words 個 word，初始值 1，
+    再依序套用各程式的 .data）放在 multiprocessing.shared_memory 中由所有核心共用。
+    每個核心的週期記錄寫到 output_dir/core<N>.txt，回傳各核心的統計 dict 串列。
+    """
+    from assembler import assemble_file
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cores = len(programs)
+    MSIDirectory(cores, line_words, transfer, invalidate)  # 先檢查參數
+    shm = SharedMemory(create=True, size=(words + 2 * cores + 1) * WORD_BYTES)
+    views = _views(shm, words)
+    memory, slots = views[1:]
+    processes = []
+    try:
+        for word in range(words):
+            memory[word] = 1
+        for index in range(2 * cores + 1):
+            slots[index] = 0
+        for program in programs:
+            assemble_file(program).initialize(memory)
+
+        directory_options = {"line_words": line_words, "transfer": transfer, "invalidate": invalidate}
+        receivers = []
+        for core, program in enumerate(programs):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_run_core,
+                args=(core, cores, program, output_dir / f"core{core}.txt", shm.name, words, directory_options, max_cycles, sender),
+            )
+            process.start()
+            sender.close()
+            processes.append(process)
+            receivers.append(receiver)
+
+        results = [None] * cores
+        pending = set(range(cores))
+        while pending:
+            for core in list(pending):
+                if receivers[core].poll(0.05):
+                    results[core] = receivers[core].recv()
+                    pending.discard(core)
+                elif not processes[core].is_alive():
+                    # 行程異常結束且沒有回報：通知其他核心停止等待
+                    slots[2 * cores] = 1
+                    results[core] = {"core": core, "error": f"exited with code {processes[core].exitcode}"}
+                    pending.discard(core)
+        for process in processes:
+            process.join()
+        errors = [f"core {result['core']}: {result['error']}" for result in results if "error" in result]
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return results
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+        _release(views)
+        shm.close()
+        shm.unlink()
+
+
+def write_contention_report(f, results, line_words=4, top=10):
+    """各核心的週期數、一致性停頓與最常衝突的 line"""
+    f.write("core  cycles  stalls  mem-stalls  accesses  hit  miss  transfer  invalidate  wait  coherence  program\n")
+    line_stalls = {}
+    for result in results:
+        f.write(
+            f"{result['core']:4d}  {result['cycles']:6d}  {result['stalls']:6d}  {result['memory_stalls']:10d}  "
+            f"{result['reads'] + result['writes']:8d}  {result['hit']:3d}  {result['miss']:4d}  {result['transfer']:8d}  "
+            f"{result['invalidate']:10d}  {result['wait_cycles']:4d}  {result['coherence_cycles']:9d}  {result['program']}\n"
+        )
+        for line, stalls in result["line_stalls"].items():
+            line_stalls[line] = line_stalls.get(line, 0) + stalls
+    global_cycles = max((result["global_cycles"] for result in results), default=0)
+    f.write(f"\nglobal cycles: {global_cycles}\n")
+    if line_stalls:
+        f.write("most contended lines (stall cycles):\n")
+        for line, stalls in sorted(line_stalls.items(), key=lambda item: (-item[1], item[0]))[:top]:
+            f.write(f"  line {line} (words {line * line_words}-{(line + 1) * line_words - 1}): {stalls}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多核心模擬：每個核心一個行程，共用資料記憶體並以 MSI 模型仲裁")
+    parser.add_argument("programs", nargs="+", type=Path, help="各核心的指令檔（與 --cores 一起使用時只能有一個）")
+    parser.add_argument("-o", "--output-dir", type=Path, default=Path("multicore"), help="輸出資料夾（預設 multicore）")
+    parser.add_argument("--cores", type=int, default=None, help="以相同程式執行的核心數")
+    parser.add_argument("--words", type=int, default=32, help="共用資料記憶體的 word 數（預設 32）")
+    parser.add_argument("--line-words", type=int, default=4, help="一致性單位（line）的 word 數（預設 4）")
+    parser.add_argument("--transfer", type=int, default=10, help="讀取其他核心持有 M 的 line 的週期數（預設 10）")
+    parser.add_argument("--invalidate", type=int, default=5, help="寫入其他核心持有的 line 的週期數（預設 5）")
+    parser.add_argument("--max-cycles", type=int, default=None, help="最多執行的全域週期數")
+    parser.add_argument("--json", type=Path, help="另將各核心統計寫成 JSON")
+    args = parser.parse_args()
+
+    programs = args.programs
+    if args.cores is not None:
+        if len(programs) != 1 or args.cores < 1:
+            parser.error("--cores needs exactly one program and a positive count")
+        programs = programs * args.cores
+    try:
+        results = run_multicore(programs, args.output_dir, args.words, args.line_words, args.transfer, args.invalidate, args.max_cycles)
+    except ValueError as error:
+        parser.error(str(error))
+    except RuntimeError as error:
+        parser.exit(1, f"{error}\n")
+    with open(args.output_dir / "contention.txt", "w") as f:
+        write_contention_report(f, results, args.line_words)
+    with open(args.output_dir / "contention.txt") as f:
+        print(f.read(), end="")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
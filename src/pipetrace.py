@@ -0,0 +1,150 @@
+import shutil
+from collections import deque
+from pathlib import Path
+
+from program import format_stage
+
+
+def render_cycle(program, cycle, entries):
+    """將一個週期的事件轉成記錄文字（與 print_results 的格式相同）"""
+    opcode = program.opcode
+    lines = [f"Clock Cycle {cycle}:"]
+    lines.extend(format_stage(opcode[index], control, stage) for stage, index, control in entries)
+    return "\n".join(lines)
+
+
+class NullTrace:
+    """
+    不保留任何週期記錄的 sink。
+    每個週期的事件為 (cycle, entries, stalled)，entries 是 (stage, 指令索引, 控制信號) 的串列。
+    """
+
+    enabled = False  # False 時 CPU 不會建立事件
+
+    def __init__(self, notes=None):
+        self.notes = notes  # 除錯訊息的輸出串流，None 表示丟棄
+        self.program = None
+        self.cycles = 0
+
+    def bind(self, program):
+        """CPU 載入指令時呼叫"""
+        self.program = program
+
+    def cycle(self, cycle, entries, stalled):
+        """接收一個週期的事件"""
+        self.cycles = cycle
+
+    def note(self, cycle, message):
+        """接收除錯訊息"""
+        if self.notes is not None:
+            self.notes.write(f"[cycle {cycle}] {message}\n")
+
+    def checkpoint(self, full=False):
+        """
+        目前的記錄位置，供 restore 回到此處。
+        full 為 True 時狀態必須能在另一個行程中還原（寫入 checkpoint 檔時使用）。
+        """
+        return (self.cycles,)
+
+    def restore(self, state):
+        """回到 checkpoint 時的記錄位置，之後的記錄會被捨棄"""
+        self.cycles = state[0]
+
+    def log_lines(self):
+        """保留的週期記錄文字"""
+        return []
+
+    def open_results(self, output_file):
+        """
+        開啟結果檔並寫好 # Execution Log 區段，回傳檔案物件供 print_results 接著寫入。
+        """
+        f = open(output_file, "w")
+        self.write_log(f)
+        return f
+
+    def write_log(self, f):
+        """將 # Execution Log 區段寫入 f"""
+        f.write("# Execution Log\n")
+        lines = self.log_lines()
+        for text in lines:
+            f.write(text + "\n")
+        f.write("\n" if lines else "\n\n")
+
+    def close(self):
+        pass
+
+
+class RingBufferTrace(NullTrace):
+    """保留最後 maxlen 個週期的事件；maxlen 為 None 時全部保留"""
+
+    enabled = True
+
+    def __init__(self, maxlen=None, notes=None):
+        super().__init__(notes)
+        self.events = deque(maxlen=maxlen)
+
+    def cycle(self, cycle, entries, stalled):
+        self.cycles = cycle
+        self.events.append((cycle, tuple(entries), stalled))
+
+    def checkpoint(self, full=False):
+        # 有上限時舊事件會被擠出，只能保存整個緩衝區；無上限時只記錄長度
+        events = tuple(self.events) if full or self.events.maxlen is not None else None
+        return (self.cycles, len(self.events), events)
+
+    def restore(self, state):
+        cycles, length, events = state
+        if events is not None:
+            self.events = deque(events, maxlen=self.events.maxlen)
+        elif len(self.events) < length:
+            raise ValueError(f"trace has {len(self.events)} events, checkpoint needs {length}")
+        else:
+            while len(self.events) > length:
+                self.events.pop()
+        self.cycles = cycles
+
+    def log_lines(self):
+        return [render_cycle(self.program, cycle, entries) for cycle, entries, _ in self.events]
+
+
+class TextTraceWriter(NullTrace):
+    """邊執行邊將週期記錄寫入檔案，記憶體用量固定"""
+
+    enabled = True
+
+    def __init__(self, output_file, notes=None, resume=False):
+        super().__init__(notes)
+        self.path = Path(output_file)
+        if resume:
+            # 接續既有的記錄檔，由 restore 截斷到 checkpoint 的位置
+            self.file = open(self.path, "r+")
+        else:
+            self.file = open(self.path, "w")
+            self.file.write("# Execution Log\n")
+
+    def cycle(self, cycle, entries, stalled):
+        self.cycles = cycle
+        self.file.write(render_cycle(self.program, cycle, entries) + "\n")
+
+    def checkpoint(self, full=False):
+        return (self.cycles, self.file.tell())
+
+    def restore(self, state):
+        self.cycles, offset = state
+        self.file.seek(offset)
+        self.file.truncate()
+
+    def open_results(self, output_file):
+        self.file.write("\n" if self.cycles else "\n\n")
+        if Path(output_file) == self.path:
+            f, self.file = self.file, None
+            return f
+        # 輸出到其他檔案時，複製已寫出的記錄
+        self.file.flush()
+        shutil.copyfile(self.path, output_file)
+        return open(output_file, "a")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,169 @@
+from array import array
+from functools import lru_cache
+
+
+# 指令操作碼（整數列舉）
+OP_ADD = 0
+OP_SUB = 1
+OP_LW = 2
+OP_SW = 3
+OP_BEQ = 4
+OPCODES = ("add", "sub", "lw", "sw", "beq")
+OPCODE_IDS = {name: op for op, name in enumerate(OPCODES)}
+
+# 流水線階段
+STAGE_IF = 0
+STAGE_ID = 1
+STAGE_EX = 2
+STAGE_MEM = 3
+STAGE_WB = 4
+STAGE_NAMES = ("IF", "ID", "EX", "MEM", "WB")
+# 週期記錄中的轉發事件（不是流水線階段）：控制信號欄位為 路徑 << 8 | 暫存器
+STAGE_FORWARD = len(STAGE_NAMES)
+FORWARD_EX_MEM = 0  # EX/MEM -> EX
+FORWARD_MEM_WB = 1  # MEM/WB -> EX
+FORWARD_ID = 2  # EX/MEM -> ID（beq）
+FORWARD_PATHS = ("EX/MEM->EX", "MEM/WB->EX", "EX/MEM->ID")
+
+# 控制信號以每個 2 bits 打包：0、1、X
+CONTROL_SIGNALS = ("RegDst", "ALUSrc", "Branch", "MemRead", "MemWrite", "RegWrite", "MemToReg")
+CONTROL_CHARS = "01X"
+_CONTROL_CODES = {"0": 0, "1": 1, "X": 2}
+
+# 各指令的控制信號（parse_instruction 與 assembler 共用）
+_ALU_CONTROL = {"RegDst": "1", "ALUSrc": "0", "Branch": "X", "MemRead": "0", "MemWrite": "0", "RegWrite": "1", "MemToReg": "0"}
+CONTROLS = {
+    "add": _ALU_CONTROL,
+    "sub": _ALU_CONTROL,
+    "lw": {"RegDst": "0", "ALUSrc": "1", "Branch": "X", "MemRead": "1", "MemWrite": "0", "RegWrite": "1", "MemToReg": "1"},
+    "sw": {"RegDst": "X", "ALUSrc": "1", "Branch": "X", "MemRead": "0", "MemWrite": "1", "RegWrite": "0", "MemToReg": "X"},
+    "beq": {"RegDst": "X", "ALUSrc": "0", "Branch": "1", "MemRead": "0", "MemWrite": "0", "RegWrite": "0", "MemToReg": "X"},
+}
+
+# 各階段在記錄中顯示的控制信號
+STAGE_SIGNALS = {
+    STAGE_EX: CONTROL_SIGNALS,
+    STAGE_MEM: ("Branch", "MemRead", "MemWrite", "RegWrite", "MemToReg"),
+    STAGE_WB: ("RegWrite", "MemToReg"),
+}
+
+NO_REG = -1  # 欄位不存在時的暫存器編號
+
+# 冒險種類（hazard() 的回傳值，0 表示不需停頓）
+HAZARD_LOAD_USE = 1
+HAZARD_BRANCH = 2
+HAZARD_DATA = 3  # 轉發模式：需要的值沒有開啟的轉發路徑可以提供
+
+
+def pack_control(control):
+    """將控制信號 dict 打包成整數"""
+    bits = 0
+    for shift, name in enumerate(CONTROL_SIGNALS):
+        bits |= _CONTROL_CODES[control.get(name, "X")] << (2 * shift)
+    return bits
+
+
+# 各 opcode 打包後的控制信號
+CONTROL_BITS = tuple(pack_control(CONTROLS[name]) for name in OPCODES)
+
+
+def control_value(bits, name):
+    """取出打包控制信號中的單一信號（"0"、"1" 或 "X"）"""
+    shift = CONTROL_SIGNALS.index(name)
+    return CONTROL_CHARS[(bits >> (2 * shift)) & 0b11]
+
+
+@lru_cache(maxsize=None)
+def format_stage(opcode, control, stage):
+    """產生某指令在某階段的記錄文字"""
+    if stage == STAGE_FORWARD:
+        return f"{OPCODES[opcode]}: forward ${control & 0xFF} {FORWARD_PATHS[control >> 8]}"
+    text = f"{OPCODES[opcode]}: {STAGE_NAMES[stage]}"
+    signals = STAGE_SIGNALS.get(stage)
+    if signals:
+        text += " " + " ".join(f"{name}={control_value(control, name)}" for name in signals)
+    return text
+
+
+class DecodedProgram:
+    """
+    預先解碼的程式（struct-of-arrays）。
+    每條指令只佔用各欄位陣列中的一格，流水線暫存器只需保存指令索引。
+    """
+
+    __slots__ = (
+        "opcode", "control", "dest", "src1", "src2", "base", "offset",
+        "writes", "load_writes", "mem_writes", "alu_reads", "branch_reads",
+    )
+
+    def __init__(self):
+        self.opcode = array("B")
+        self.control = array("H")
+        self.dest = array("b")
+        self.src1 = array("b")
+        self.src2 = array("b")
+        self.base = array("b")
+        self.offset = array("i")
+        # 冒險檢測用的暫存器 bitmask
+        self.writes = array("I")  # 寫入的暫存器（sw 沿用 destination 欄位）
+        self.load_writes = array("I")  # lw 寫入的暫存器
+        self.mem_writes = array("I")  # lw/sw 的 destination
+        self.alu_reads = array("I")  # add/sub 讀取的暫存器
+        self.branch_reads = array("I")  # beq 比較的暫存器
+
+    def __len__(self):
+        return len(self.opcode)
+
+    def append(self, instruction):
+        """加入一條由 parse_instruction 產生的指令"""
+        self.add(
+            OPCODE_IDS[instruction["opcode"]], pack_control(instruction["control"]),
+            instruction.get("destination", NO_REG), instruction.get("source1", NO_REG), instruction.get("source2", NO_REG),
+            instruction.get("base", NO_REG), instruction.get("offset", 0),
+        )
+
+    def add(self, op, control, dest=NO_REG, src1=NO_REG, src2=NO_REG, base=NO_REG, offset=0):
+        """加入一條已解碼的指令（control 為打包後的控制信號）"""
+        self.opcode.append(op)
+        self.control.append(control)
+        self.dest.append(dest)
+        self.src1.append(src1)
+        self.src2.append(src2)
+        self.base.append(base)
+        self.offset.append(offset)
+
+        writes = 1 << dest if dest != NO_REG else 0
+        sources = 1 << self.src1[-1] | 1 << self.src2[-1] if op in (OP_ADD, OP_SUB, OP_BEQ) else 0
+        self.writes.append(writes)
+        self.load_writes.append(writes if op == OP_LW else 0)
+        self.mem_writes.append(writes if op in (OP_LW, OP_SW) else 0)
+        self.alu_reads.append(sources if op != OP_BEQ else 0)
+        self.branch_reads.append(sources if op == OP_BEQ else 0)
+
+    def hazard(self, ex, mem, wb):
+        """
+        以記分板判斷 ID/EX 的指令是否需要停頓：EX/MEM 與 MEM/WB 中尚未寫回的
+        暫存器 bitmask 與 ID/EX 讀取的暫存器做 AND。參數為指令索引或 None。
+        Returns:
+            int: 0、HAZARD_LOAD_USE 或 HAZARD_BRANCH。
+        """
+        if ex is None:
+            return 0
+        pending = 0  # 分支需要等待的暫存器
+        if mem is not None:
+            # Load-Use Hazard：EX/MEM 的 lw 尚未寫回
+            if self.alu_reads[ex] & self.load_writes[mem]:
+                return HAZARD_LOAD_USE
+            pending = self.writes[mem]
+        if wb is not None:
+            pending |= self.mem_writes[wb]
+        # 控制冒險：分支條件依賴 EX/MEM 的目標暫存器或 MEM/WB 的 lw/sw
+        return HAZARD_BRANCH if self.branch_reads[ex] & pending else 0
+
+    @classmethod
+    def from_instructions(cls, instructions):
+        """由 parse_instruction 的結果建立"""
+        program = cls()
+        for instruction in instructions:
+            program.append(instruction)
+        return program
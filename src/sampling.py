@@ -0,0 +1,245 @@
+import argparse
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+
+import C
+from cosim import copy_memory, instruction_text
+from program import OP_BEQ
+
+DEFAULT_INTERVAL = 50000  # 每隔多少條指令開始一個詳細模擬視窗
+DEFAULT_WARMUP = 500  # 視窗開頭不計入量測的指令數（填滿流水線、暖機快取與分支預測）
+DEFAULT_WINDOW = 1000  # 每個視窗量測的指令數
+PIPELINE_FILL = 4  # 第一條指令在第 5 個週期完成 WB：總週期數 = 指令數 × CPI + 4
+CONFIDENCE = 0.95
+
+
+def functional_model(program, registers, memory):
+    """
+    以 main.CPU 的語意執行 program 的功能模型（C.CPU 的基本區塊翻譯），初始狀態為 registers 與 memory 的複本。
+    最後一條 beq 跳躍時 main.CPU 到 i + offset（見 CPU.branch_target），翻譯時將 offset 減 1。
+    """
+    instructions = [C.parse_instruction(instruction_text(program, i)) for i in range(len(program))]
+    last = len(program) - 1
+    if last >= 0 and program.opcode[last] == OP_BEQ:
+        instructions[last] = C.parse_instruction(f"beq ${program.src1[last]}, ${program.src2[last]}, {program.offset[last] - 1}")
+    reference = C.CPU()
+    reference.word_addressed = True
+    reference.load_instructions(instructions)
+    reference.registers = list(registers)
+    reference.memory = copy_memory(memory)
+    return reference
+
+
+class Sample:
+    """一個詳細模擬視窗：起點（已執行的指令數）、量測的指令數與週期數、視窗中完成的指令數"""
+
+    __slots__ = ("start", "instructions", "cycles", "retired")
+
+    def __init__(self, start, instructions, cycles, retired):
+        self.start = start
+        self.instructions = instructions
+        self.cycles = cycles
+        self.retired = retired
+
+
+def detailed_window(cpu, reference, warmup, window):
+    """
+    cpu（main.CPU，已載入程式）以 reference 目前的暫存器、記憶體與 pc 為起點逐週期模擬，
+    完成 warmup 條指令後開始量測，再完成 window 條指令（或程式結束）為止。
+    Returns:
+        tuple: (量測的指令數, 量測的週期數, 完成的指令總數)
+    """
+    cpu.registers = list(reference.registers)
+    cpu.memory = copy_memory(reference.memory)
+    cpu.pc = reference.pc
+    retired = 0
+
+    def retire(i):
+        nonlocal retired
+        retired += 1
+
+    cpu.on_retire = retire
+    target = warmup + window
+    length = len(cpu.instructions)
+    start_cycle = 0 if warmup == 0 else None
+    cycle = 1
+    while retired < target and (cpu.pc < length or cpu.pipeline_busy()):
+        cpu.execute_cycle(cycle)
+        if start_cycle is None and retired >= warmup:
+            start_cycle = cycle
+        cycle += 1
+    if start_cycle is None:
+        return 0, 0, retired
+    return retired - warmup, cpu.cycles - start_cycle, retired
+
+
+class SampledRun:
+    """
+    取樣模擬：以功能模型快速執行，每 interval 條指令在 main.CPU 上做一次詳細模擬視窗
+    （暖機 warmup 條、量測 window 條），最後以各視窗的 CPI 外插總週期數並給出信賴區間。
+    視窗之間沿用同一組快取、分支預測與轉發元件，它們的狀態只在視窗中更新。
+    """
+
+    def __init__(self, program, make_cpu, interval=DEFAULT_INTERVAL, warmup=DEFAULT_WARMUP, window=DEFAULT_WINDOW):
+        if interval < warmup + window:
+            raise ValueError(f"interval {interval} is shorter than warmup + window ({warmup + window})")
+        self.program = program
+        self.make_cpu = make_cpu  # 回傳已載入 program 的 main.CPU（每個視窗一個）
+        self.interval = interval
+        self.warmup = warmup
+        self.window = window
+        self.samples = []
+        self.instructions = 0  # 執行的指令總數
+        self.detailed = 0  # 逐週期模擬的指令數
+        self.finished = False
+
+    def run(self, registers, memory, max_instructions=None):
+        """從 registers、memory 與 pc 0 開始執行到程式結束（或 max_instructions 條指令），回傳 self"""
+        reference = functional_model(self.program, registers, memory)
+        length = len(self.program)
+        fast_forward = self.interval - self.warmup - self.window
+
+        def advance(count):
+            if max_instructions is not None:
+                count = min(count, max_instructions - self.instructions)
+            self.instructions += reference.execute_fast(count)
+
+        while reference.pc < length and (max_instructions is None or self.instructions < max_instructions):
+            advance(fast_forward)
+            if reference.pc >= length or (max_instructions is not None and self.instructions >= max_instructions):
+                break
+            cpu = self.make_cpu()
+            measured, cycles, retired = detailed_window(cpu, reference, self.warmup, self.window)
+            if measured:
+                self.samples.append(Sample(self.instructions, measured, cycles, retired))
+            self.detailed += retired
+            # 功能模型執行同樣的指令，之後的狀態與詳細模擬一致
+            advance(retired)
+        self.finished = reference.pc >= length
+        return self
+
+    def estimate(self, confidence=CONFIDENCE):
+        """
+        CPI 為各視窗週期數總和 / 指令數總和；信賴區間以各視窗 CPI 的標準誤（常態近似）計算，
+        少於兩個視窗時沒有區間。
+        Returns:
+            dict: instructions、samples、cpi、cpi_interval、cycles、cycles_interval、detailed_fraction
+        """
+        result = {
+            "instructions": self.instructions,
+            "finished": self.finished,
+            "samples": len(self.samples),
+            "detailed_fraction": self.detailed / self.instructions if self.instructions else 0.0,
+            "cpi": None,
+            "cpi_interval": None,
+            "cycles": None,
+            "cycles_interval": None,
+        }
+        if not self.samples:
+            return result
+        cpi = sum(sample.cycles for sample in self.samples) / sum(sample.instructions for sample in self.samples)
+        result["cpi"] = cpi
+        result["cycles"] = round(self.instructions * cpi) + PIPELINE_FILL
+        if len(self.samples) >= 2:
+            z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+            error = z * statistics.stdev(sample.cycles / sample.instructions for sample in self.samples) / math.sqrt(len(self.samples))
+            result["cpi_interval"] = (cpi - error, cpi + error)
+            result["cycles_interval"] = (
+                math.floor(self.instructions * (cpi - error)) + PIPELINE_FILL,
+                math.ceil(self.instructions * (cpi + error)) + PIPELINE_FILL,
+            )
+        return result
+
+
+if __name__ == "__main__":
+    from assembler import AssemblyError, assemble_file
+    from branch import parse_predictor_spec
+    from cache import parse_cache_spec
+    from forwarding import parse_forwarding_spec
+    from main import CPU
+    from memory import PagedMemory
+    from pipetrace import NullTrace
+
+    parser = argparse.ArgumentParser(description="取樣模擬：功能模型快速執行，定期以流水線詳細模擬視窗估計 CPI 與總週期數")
+    parser.add_argument("input_file", type=Path, help="指令檔")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL, help=f"每隔多少條指令取樣一次（預設 {DEFAULT_INTERVAL}）")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help=f"每個視窗暖機的指令數（預設 {DEFAULT_WARMUP}）")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help=f"每個視窗量測的指令數（預設 {DEFAULT_WINDOW}）")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE, help=f"信賴水準（預設 {CONFIDENCE}）")
+    parser.add_argument("--max-instructions", type=int, default=None, help="最多執行的指令數")
+    parser.add_argument("--paged-memory", action="store_true", help="使用完整 32 位元位址空間的分頁記憶體")
+    parser.add_argument("--icache", metavar="SPEC", help="I-cache 設定（同 main.py）")
+    parser.add_argument("--dcache", metavar="SPEC", help="D-cache 設定（同 main.py）")
+    parser.add_argument("--l2", metavar="SPEC", help="第二層快取設定（同 main.py）")
+    parser.add_argument("--predictor", metavar="SPEC", help="分支預測（同 main.py）")
+    parser.add_argument("--forwarding", metavar="PATHS", nargs="?", const="ex-mem,mem-wb", help="轉發模式（同 main.py）")
+    parser.add_argument("--register-init", type=int, default=1, help="$1-$31 的初始值（預設 1）")
+    parser.add_argument("--compare", action="store_true", help="另外完整模擬一次，列出實際週期數與誤差")
+    parser.add_argument("--json", type=Path, help="將估計結果寫成 JSON")
+    args = parser.parse_args()
+    if not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1")
+
+    def build_components():
+        l2 = parse_cache_spec("L2", args.l2) if args.l2 is not None else None
+        return {
+            "icache": parse_cache_spec("I-cache", args.icache, l2) if args.icache is not None else None,
+            "dcache": parse_cache_spec("D-cache", args.dcache, l2) if args.dcache is not None else None,
+            "predictor": parse_predictor_spec(args.predictor) if args.predictor is not None else None,
+            "forwarding": parse_forwarding_spec(args.forwarding) if args.forwarding is not None else None,
+        }
+
+    try:
+        components = build_components()  # 所有視窗共用
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        assembly = assemble_file(args.input_file)
+        initial = CPU(memory=PagedMemory() if args.paged_memory else None, register_init=args.register_init)
+        initial.load_instructions(assembly.program)
+        assembly.initialize(initial.memory)
+    except AssemblyError as error:
+        parser.exit(1, f"{error}\n")
+
+    def make_cpu():
+        cpu = CPU(trace=NullTrace(), **components)
+        cpu.load_instructions(assembly.program)
+        return cpu
+
+    start = time.perf_counter()
+    try:
+        sampled = SampledRun(assembly.program, make_cpu, args.interval, args.warmup, args.window)
+    except ValueError as error:
+        parser.error(str(error))
+    sampled.run(initial.registers, initial.memory, args.max_instructions)
+    elapsed = time.perf_counter() - start
+    result = sampled.estimate(args.confidence)
+    result["seconds"] = elapsed
+
+    print(f"{args.input_file}: {result['instructions']} instructions{'' if result['finished'] else ' (not finished)'}, "
+          f"{result['samples']} samples, {result['detailed_fraction']:.2%} simulated in detail ({elapsed:.2f}s)")
+    if result["cpi"] is None:
+        print("no complete sample (program shorter than one interval?); run main.py instead")
+    elif result["cpi_interval"] is None:
+        print(f"CPI {result['cpi']:.4f}, estimated cycles {result['cycles']}")
+    else:
+        low, high = result["cycles_interval"]
+        half = (result["cpi_interval"][1] - result["cpi_interval"][0]) / 2
+        print(f"CPI {result['cpi']:.4f} ± {half:.4f}, estimated cycles {result['cycles']} "
+              f"({args.confidence:.0%} interval {low}-{high})")
+    if args.compare:
+        cpu = CPU(trace=NullTrace(), memory=initial.memory, register_init=args.register_init, **build_components())
+        cpu.load_instructions(assembly.program)
+        start = time.perf_counter()
+        cpu.run()
+        full = time.perf_counter() - start
+        result["actual_cycles"] = cpu.cycles
+        result["full_seconds"] = full
+        error = (result["cycles"] - cpu.cycles) / cpu.cycles if result["cycles"] is not None else None
+        print(f"actual cycles {cpu.cycles} ({full:.2f}s, {full / elapsed:.1f}x slower)"
+              + (f", error {error:+.2%}" if error is not None else ""))
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2) + "\n")
@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+# forkserver 預先載入的模組：之後 fork 出的 worker 不需要再 import
+PRELOAD = ["main", "assembler", "program", "pipetrace", "memory", "cache", "branch", "forwarding", "steady"]
+JOB_OPTIONS = ("max_cycles", "paged_memory", "trace", "trace_cycles", "output", "skip_loops", "icache", "dcache", "l2", "predictor", "forwarding")
+DEFAULT_MAX_CYCLES = 10_000_000  # 沒有指定 max_cycles 時的週期上限（不會結束的程式也會停下）
+DEFAULT_TRACE_CYCLES = 100_000  # 保留的週期記錄數（只回傳最後這麼多個週期）
+DEFAULT_TIMEOUT = 60.0  # 每個工作的執行時間上限（秒），超過時結束該 worker
+MAX_LINE_BYTES = 1 << 30  # 一行請求／回應的上限（回應含完整週期記錄）
+WARMUP_PROGRAM = "lw $2, 8($0)\nadd $3, $2, $2\nbeq $3, $0, 1\nsw $3, 12($0)\n"
+
+
+@lru_cache(maxsize=256)
+def _assemble_text(source):
+    from assembler import assemble
+
+    return assemble(source, "<job>")
+
+
+@lru_cache(maxsize=256)
+def _assemble_path(path, mtime, size):
+    from assembler import assemble_file
+
+    return assemble_file(path)
+
+
+def load_job_program(job):
+    """job 的 program（組合語言文字）或 path（指令檔）組譯結果；worker 內以 LRU 快取，跨工作重複使用"""
+    if "program" in job:
+        return _assemble_text(job["program"])
+    if "path" in job:
+        status = os.stat(job["path"])
+        return _assemble_path(job["path"], status.st_mtime_ns, status.st_size)
+    raise ValueError("job needs a program or path")
+
+
+def run_job(job):
+    """
+    在 worker 中執行一個工作，回傳結果 dict。
+    options：max_cycles（預設 DEFAULT_MAX_CYCLES，None 時不限制）、paged_memory、
+    trace（預設 True，False 時不保留週期記錄）、trace_cycles（保留最後幾個週期的記錄，預設 DEFAULT_TRACE_CYCLES，None 時全部保留）、
+    output（預設 True，False 時只回傳摘要）、skip_loops，以及與 main.py 相同格式的 icache、dcache、l2、predictor、forwarding。
+    """
+    from branch import parse_predictor_spec
+    from cache import parse_cache_spec
+    from forwarding import parse_forwarding_spec
+    from main import CPU
+    from memory import PagedMemory
+    from pipetrace import NullTrace, RingBufferTrace
+
+    options = job.get("options") or {}
+    unknown = set(options) - set(JOB_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown option(s) {', '.join(sorted(unknown))} (expected {', '.join(JOB_OPTIONS)})")
+    assembly = load_job_program(job)
+    l2 = parse_cache_spec("L2", options["l2"]) if options.get("l2") is not None else None
+    cpu = CPU(
+        trace=RingBufferTrace(options.get("trace_cycles", DEFAULT_TRACE_CYCLES)) if options.get("trace", True) else NullTrace(),
+        memory=PagedMemory() if options.get("paged_memory") else None,
+        icache=parse_cache_spec("I-cache", options["icache"], l2) if options.get("icache") is not None else None,
+        dcache=parse_cache_spec("D-cache", options["dcache"], l2) if options.get("dcache") is not None else None,
+        predictor=parse_predictor_spec(options["predictor"]) if options.get("predictor") is not None else None,
+        forwarding=parse_forwarding_spec(options["forwarding"]) if options.get("forwarding") is not None else None,
+    )
+    cpu.load_instructions(assembly.program)
+    assembly.initialize(cpu.memory)
+    max_cycles = options.get("max_cycles", DEFAULT_MAX_CYCLES)
+    if options.get("skip_loops"):
+        from steady import run_skipping
+
+        run_skipping(cpu, max_cycles)
+    else:
+        cpu.run(max_cycles)
+    result = {
+        "cycles": cpu.cycles,
+        "stalls": cpu.stalls,
+        "finished": not (cpu.pc < len(cpu.instructions) or cpu.pipeline_busy()),
+    }
+    if cpu.trace.enabled:
+        # 超過 trace_cycles 時最早的週期記錄已被捨棄
+        result["trace_truncated"] = bool(cpu.trace.events) and cpu.trace.events[0][0] > 1
+    if options.get("output", True):
+        f = io.StringIO()
+        cpu.trace.write_log(f)
+        cpu.write_results(f)
+        result["output"] = f.getvalue()
+    return result
+
+
+def _serve(connection):
+    """worker 行程：先執行一次暖機，之後逐一處理 connection 送來的工作"""
+    run_job({"program": WARMUP_PROGRAM})
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        try:
+            reply = {"status": "ok", **run_job(job)}
+        except Exception as error:
+            reply = {"status": "error", "error": f"{type(error).__name__}: {error}"}
+        connection.send(reply)
+
+
+class _Worker:
+    """一個 worker 行程與連到它的 pipe"""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    async def call(self, job):
+        """送出工作並等待結果（等待與讀取結果都不阻塞事件迴圈）"""
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.connection.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            self.connection.send(job)
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        # 結果可能很大（完整的週期記錄），在執行緒中讀取
+        return await loop.run_in_executor(None, self.connection.recv)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """
+    預先暖機的 worker 行程池。worker 由 forkserver 產生，PRELOAD 的模組已載入；
+    執行中的工作被取消時直接結束該 worker 並補上新的一個。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(PRELOAD)
+        self.idle = None
+        self.workers = []
+
+    def start(self):
+        self.idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._add()
+
+    def _add(self):
+        worker = _Worker(self.context)
+        self.workers.append(worker)
+        self.idle.put_nowait(worker)
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers.remove(worker)
+        self._add()
+
+    async def run(self, job, timeout=None):
+        """由閒置的 worker 執行 job，回傳結果 dict；執行超過 timeout 秒（不含等待 worker 的時間）時結束該 worker"""
+        worker = await self.idle.get()
+        try:
+            reply = await asyncio.wait_for(worker.call(job), timeout)
+        except asyncio.TimeoutError:
+            self._replace(worker)
+            return {"status": "error", "error": f"timed out after {timeout} s"}
+        except asyncio.CancelledError:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError) as error:
+            self._replace(worker)
+            return {"status": "error", "error": f"worker failed: {type(error).__name__}: {error}"}
+        self.idle.put_nowait(worker)
+        return reply
+
+    def close(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+
+
+class SimulationServer:
+    """
+    Unix domain socket 上的模擬服務。每行一個 JSON 請求：
+    {"id": ..., "program": "組合語言文字"} 或 {"id": ..., "path": "指令檔"}，可加上 "options"（見 run_job）；
+    {"cancel": id} 取消同一連線中尚未完成的工作。同一連線可連續送出多個請求而不需等待，
+    每個工作完成後立即回傳一行 {"id", "status": "ok"|"error"|"cancelled", ...}，順序依完成先後；
+    沒有 id 的請求以 "auto-<uuid>" 為 id；id 必須是字串、數字或 null。
+    options 的 timeout（秒，None 時不限制）覆寫伺服器的執行時間上限。
+    超過 MAX_LINE_BYTES 的請求行回報錯誤後取消該連線所有未完成的工作並關閉連線。
+    """
+
+    def __init__(self, socket_path, workers=None, timeout=DEFAULT_TIMEOUT):
+        self.socket_path = Path(socket_path)
+        self.pool = WorkerPool(workers or os.cpu_count() or 1)
+        self.timeout = timeout
+
+    async def serve(self, ready=None):
+        self.pool.start()
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+        server = await asyncio.start_unix_server(self._connection, path=str(self.socket_path), limit=MAX_LINE_BYTES)
+        # SIGTERM 與 Ctrl-C 相同：停止服務、結束 worker 並移除 socket
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.close()
+            if self.socket_path.is_socket():
+                self.socket_path.unlink()
+
+    async def _connection(self, reader, writer):
+        tasks = {}
+
+        async def send(message):
+            writer.write((json.dumps(message) + "\n").encode())
+            await writer.drain()
+
+        def cancel_all():
+            for task in tasks.values():
+                task.cancel()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # 超過 MAX_LINE_BYTES：之後的資料無法再對齊到請求的開頭，取消尚未完成的工作並關閉連線
+                    await send({"id": None, "status": "error", "error": f"request line exceeds {MAX_LINE_BYTES} bytes"})
+                    cancel_all()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    for key in ("id", "cancel"):
+                        if isinstance(request.get(key), (list, dict)):
+                            raise ValueError(f"{key} must be a string, number or null")
+                except ValueError as error:
+                    await send({"id": None, "status": "error", "error": f"bad request: {error}"})
+                    continue
+                if "cancel" in request:
+                    task = tasks.get(request["cancel"])
+                    if task is not None:
+                        task.cancel()
+                    continue
+                job_id = request["id"] if "id" in request else f"auto-{uuid.uuid4().hex}"
+                if job_id in tasks:
+                    await send({"id": job_id, "status": "error", "error": "duplicate id"})
+                    continue
+                tasks[job_id] = asyncio.create_task(self._job(job_id, request, send, tasks))
+            # 客戶端不再送出請求：等已送出的工作都回傳後才關閉
+            if tasks:
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+        except ConnectionError:
+            cancel_all()
+        except BaseException:
+            cancel_all()
+            raise
+        finally:
+            writer.close()
+
+    async def _job(self, job_id, request, send, tasks):
+        start = time.perf_counter()
+        job = {key: request[key] for key in ("program", "path", "options") if key in request}
+        timeout = self.timeout
+        if isinstance(job.get("options"), dict) and "timeout" in job["options"]:
+            job["options"] = dict(job["options"])
+            timeout = job["options"].pop("timeout")
+        try:
+            if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+                reply = {"status": "error", "error": f"bad timeout {timeout!r} (expected seconds > 0 or null)"}
+            else:
+                reply = await self.pool.run(job, timeout)
+        except asyncio.CancelledError:
+            reply = {"status": "cancelled"}
+        finally:
+            tasks.pop(job_id, None)
+        reply = {"id": job_id, **reply, "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)}
+        try:
+            await send(reply)
+        except ConnectionError:
+            pass
+
+
+async def submit(socket_path, jobs, on_reply):
+    """將 jobs（請求 dict 的串列）一次送出，每收到一個結果呼叫 on_reply(reply)"""
+    reader, writer = await asyncio.open_unix_connection(str(socket_path), limit=MAX_LINE_BYTES)
+    for job in jobs:
+        writer.write((json.dumps(job) + "\n").encode())
+    await writer.drain()
+    writer.write_eof()
+    for _ in jobs:
+        line = await reader.readline()
+        if not line:
+            break
+        on_reply(json.loads(line))
+    writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常駐的模擬服務（Unix domain socket），或送出工作給它")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="啟動服務")
+    serve_parser.add_argument("--socket", type=Path, default=Path("mips-sim.sock"), help="socket 路徑（預設 mips-sim.sock）")
+    serve_parser.add_argument("-j", "--workers", type=int, default=None, help="worker 行程數（預設為 CPU 核心數）")
+    serve_parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help=f"每個工作的執行時間上限（秒，預設 {DEFAULT_TIMEOUT:g}；0 表示不限制）")
+    submit_parser = subparsers.add_parser("submit", help="送出指令檔並寫出結果")
+    submit_parser.add_argument("input_files", nargs="+", type=Path, help="指令檔")
+    submit_parser.add_argument("--socket", type=Path, default=Path("mips-sim.sock"), help="socket 路徑（預設 mips-sim.sock）")
+    submit_parser.add_argument("-o", "--output-dir", type=Path, help="結果檔資料夾（省略時只印摘要）")
+    submit_parser.add_argument("--options", type=json.loads, default=None, help='JSON 格式的選項，如 \'{"forwarding": "ex-mem,mem-wb"}\'')
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = SimulationServer(args.socket, args.workers, args.timeout or None)
+        try:
+            asyncio.run(server.serve(lambda: print(f"listening on {args.socket} with {server.pool.size} workers", flush=True)))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        jobs = []
+        for index, path in enumerate(args.input_files):
+            job = {"id": index, "program": path.read_text()}
+            if args.options:
+                job["options"] = dict(args.options, output=args.output_dir is not None)
+            elif args.output_dir is None:
+                job["options"] = {"output": False}
+            jobs.append(job)
+        if args.output_dir is not None:
+            args.output_dir.mkdir(parents=True, exist_ok=True)
+        failures = 0
+
+        def on_reply(reply):
+            global failures
+            path = args.input_files[reply["id"]]
+            if reply["status"] != "ok":
+                failures += 1
+                print(f"{path}: {reply['status']} {reply.get('error', '')}")
+                return
+            print(f"{path}: {reply['cycles']} cycles, {reply['stalls']} stalls ({reply['elapsed_ms']:.2f} ms)")
+            if args.output_dir is not None:
+                (args.output_dir / f"{path.stem}_output.txt").write_text(reply["output"])
+
+        start = time.perf_counter()
+        asyncio.run(submit(args.socket, jobs, on_reply))
+        elapsed = time.perf_counter() - start
+        print(f"{len(jobs)} jobs in {elapsed * 1000:.1f} ms ({elapsed * 1000 / max(len(jobs), 1):.2f} ms/job)")
+        sys.exit(1 if failures else 0)
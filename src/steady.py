@@ -0,0 +1,177 @@
+from program import OP_BEQ, OP_LW, OP_SW
+
+DETAILED_TAIL = 2  # 分支結果改變前保留逐週期模擬的迭代數
+
+
+class _RecordingTrace:
+    """轉送到原本的 sink，同時保留本次迭代的週期事件供跳躍時重播"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.enabled = sink.enabled
+        self.notes = sink.notes
+        self.events = []
+
+    def bind(self, program):
+        self.sink.bind(program)
+
+    def cycle(self, cycle, entries, stalled):
+        self.sink.cycle(cycle, entries, stalled)
+        if self.enabled:
+            self.events.append((cycle, tuple(entries), stalled))
+
+    def note(self, cycle, message):
+        self.sink.note(cycle, message)
+
+
+class _Snapshot:
+    """迴圈起點（向後 beq 跳躍後）的狀態"""
+
+    def __init__(self, cpu, key, iteration, events):
+        self.key = key
+        self.cycle = cpu.cycles
+        self.stalls = cpu.stalls
+        self.registers = list(cpu.registers)
+        self.memory = list(cpu.memory)
+        self.values = list(cpu.values)
+        self.counters = cpu.counters.state() if cpu.counters is not None else None
+        self.iteration = iteration  # 本次迭代中 beq 的比較差值與 lw/sw 的位址
+        self.events = events  # 本次迭代的週期事件
+
+
+def _delta(old, new):
+    """兩個狀態向量的差；None 的位置必須一致"""
+    delta = []
+    for a, b in zip(old, new):
+        if a is None or b is None:
+            if a is not b:
+                return None
+            delta.append(0)
+        else:
+            delta.append(b - a)
+    return delta
+
+
+def safe_iterations(s0, s1, s2):
+    """
+    三個連續迴圈起點若呈現固定週期（相同週期數、相同位址、狀態差相同），
+    回傳可安全跳過的迭代數；否則回傳 0。回傳 None 表示分支結果永遠不變（無窮迴圈）。
+    """
+    period = s2.cycle - s1.cycle
+    if s1.cycle - s0.cycle != period or s2.stalls - s1.stalls != s1.stalls - s0.stalls:
+        return 0
+    if [kind for kind, _ in s1.iteration] != [kind for kind, _ in s2.iteration]:
+        return 0
+    for name in ("registers", "memory", "values"):
+        d1 = _delta(getattr(s0, name), getattr(s1, name))
+        d2 = _delta(getattr(s1, name), getattr(s2, name))
+        if d1 is None or d1 != d2:
+            return 0
+
+    limit = None
+    for (kind, a1), (_, a2) in zip(s1.iteration, s2.iteration):
+        if kind[0] == "address":
+            if a1 != a2:
+                return 0  # 存取的位址在變動，記憶體狀態不是固定的線性變化
+            continue
+        step = a2 - a1  # beq 兩邊暫存器差值每次迭代的變化
+        if step == 0:
+            continue
+        if a2 == 0:
+            return 0  # 下一次迭代結果就會改變
+        # 差值在第 k 次迭代後歸零時分支結果改變
+        if (-a2) % step == 0 and -a2 // step > 0:
+            k = -a2 // step
+            limit = k - 1 if limit is None else min(limit, k - 1)
+    return limit
+
+
+def _skip(cpu, sink, s1, s2, count):
+    """將 s2 之後的狀態外插 count 次迭代，並重播週期事件"""
+    for name in ("registers", "memory", "values"):
+        target = getattr(cpu, name)
+        for i, (a, b) in enumerate(zip(getattr(s1, name), getattr(s2, name))):
+            if b is not None and a != b:
+                target[i] = b + count * (b - a)
+    period = s2.cycle - s1.cycle
+    if sink.enabled:
+        for k in range(1, count + 1):
+            shift = k * period
+            for cycle, entries, stalled in s2.events:
+                sink.cycle(cycle + shift, entries, stalled)
+    if cpu.counters is not None:
+        cpu.counters.advance(s1.counters, s2.counters, count)
+    cpu.cycles += count * period
+    cpu.stalls += count * (s2.stalls - s1.stalls)
+    sink.cycles = cpu.cycles
+
+
+def run_skipping(cpu, max_cycles=None):
+    """
+    與 CPU.run 相同，但在向後 beq 形成的迴圈進入穩定狀態時直接跳過多次迭代。
+    迴圈起點的指紋為 (beq, pc, IF_ID, ID_EX, EX_MEM, MEM_WB)；連續三次相同且週期數、
+    暫存器／記憶體的變化量都固定時，依各 beq 差值的變化算出分支結果不變的迭代數，
+    外插週期數與狀態後，最後幾次迭代仍逐週期模擬。
+    Returns:
+        int: 跳過的迭代數。
+    """
+    if not isinstance(cpu.memory, list) or cpu.icache is not None or cpu.dcache is not None or cpu.predictor is not None or cpu.forwarding is not None:
+        # 分頁記憶體無法逐 word 比較每次迭代的變化量，快取、分支預測與轉發的狀態每次迭代都不同，改為逐週期模擬
+        cpu.run(max_cycles)
+        return 0
+    program = cpu.instructions
+    opcode, src1, src2 = program.opcode, program.src1, program.src2
+    registers = cpu.registers
+    sink = cpu.trace
+    recorder = _RecordingTrace(sink)
+    cpu.trace = recorder
+    history = []
+    iteration = []
+    skipped = 0
+    try:
+        while cpu.pc < len(program) or cpu.pipeline_busy():
+            cycle = cpu.cycles + 1
+            if max_cycles is not None and cycle > max_cycles:
+                break
+            entering = cpu.ID_EX
+            cpu.taken_branch = None
+            cpu.execute_cycle(cycle)
+
+            # 記錄離開 EX 的 beq 比較結果與 lw/sw 位址
+            if entering is not None and cpu.EX_MEM == entering:
+                op = opcode[entering]
+                if op == OP_BEQ:
+                    iteration.append((("branch", entering), registers[src1[entering]] - registers[src2[entering]]))
+                elif op in (OP_LW, OP_SW):
+                    iteration.append((("address", entering), cpu.addresses[entering]))
+
+            branch = cpu.taken_branch
+            if branch is None or cpu.pc > branch + 1:
+                continue
+            key = (branch, cpu.pc, cpu.IF_ID, cpu.ID_EX, cpu.EX_MEM, cpu.MEM_WB)
+            snapshot = _Snapshot(cpu, key, iteration, recorder.events)
+            iteration = []
+            recorder.events = []
+            if history and history[-1].key != key:
+                history = []
+            history = history[-2:] + [snapshot]
+            if len(history) < 3:
+                continue
+
+            s0, s1, s2 = history
+            count = safe_iterations(s0, s1, s2)
+            if count is None:
+                # 分支結果永遠不變，只能以 max_cycles 為界
+                if max_cycles is None:
+                    continue
+                count = (max_cycles - cpu.cycles) // (s2.cycle - s1.cycle)
+            count -= DETAILED_TAIL
+            if max_cycles is not None:
+                count = min(count, (max_cycles - cpu.cycles) // (s2.cycle - s1.cycle) - DETAILED_TAIL)
+            if count > 0:
+                _skip(cpu, sink, s1, s2, count)
+                skipped += count
+                history = []
+    finally:
+        cpu.trace = sink
+    return skipped
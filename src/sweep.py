@@ -0,0 +1,248 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+DEFAULT_MAX_CYCLES = 1_000_000  # 改變初始值後可能不會結束（例如 beq 兩邊永遠相等），預設限制週期數
+# 可掃描的參數與預設值；規格字串的格式與 main.py 的同名選項相同，None 表示不使用該功能
+PARAMETERS = {
+    "forwarding": None,
+    "predictor": None,
+    "icache": None,
+    "dcache": None,
+    "l2": None,
+    "register_init": 1,
+    "max_cycles": DEFAULT_MAX_CYCLES,
+}
+INTEGER_PARAMETERS = ("register_init", "max_cycles")
+# 內容改變時快取失效的模擬器原始碼
+SIMULATOR_MODULES = ("main", "program", "assembler", "pipetrace", "memory", "cache", "branch", "forwarding", "counters")
+METRICS = ("finished", "cycles", "instructions", "cpi", "stalls", "load_use_stalls", "branch_stalls", "data_stalls", "memory_stalls", "fetch_stalls", "flushes")
+
+
+def simulator_version():
+    """模擬器原始碼的雜湊"""
+    digest = hashlib.sha256()
+    source = Path(__file__).resolve().parent
+    for name in SIMULATOR_MODULES:
+        digest.update((source / f"{name}.py").read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def expand_grid(grid):
+    """{參數: [值, ...]} 的所有組合（依 grid 的順序），未指定的參數使用 PARAMETERS 的預設值"""
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"unknown sweep parameter(s) {', '.join(sorted(unknown))} (expected {', '.join(PARAMETERS)})")
+    names = list(grid)
+    points = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        config = dict(PARAMETERS)
+        config.update(zip(names, values))
+        points.append(config)
+    return points
+
+
+def build_components(config):
+    """由 config 建立 CPU 的快取、分支預測與轉發元件（規格錯誤時丟出 ValueError）"""
+    from branch import parse_predictor_spec
+    from cache import parse_cache_spec
+    from forwarding import parse_forwarding_spec
+
+    l2 = parse_cache_spec("L2", config["l2"]) if config["l2"] is not None else None
+    return {
+        "icache": parse_cache_spec("I-cache", config["icache"], l2) if config["icache"] is not None else None,
+        "dcache": parse_cache_spec("D-cache", config["dcache"], l2) if config["dcache"] is not None else None,
+        "predictor": parse_predictor_spec(config["predictor"]) if config["predictor"] is not None else None,
+        "forwarding": parse_forwarding_spec(config["forwarding"]) if config["forwarding"] is not None else None,
+    }
+
+
+def run_point(job):
+    """在 worker 行程中模擬一個 (程式, 設定) 點，回傳指標 dict"""
+    from assembler import assemble_file
+    from counters import PerfCounters
+    from main import CPU
+
+    program, config = job
+    try:
+        counters = PerfCounters()
+        cpu = CPU(counters=counters, register_init=config["register_init"], **build_components(config))
+        assembly = assemble_file(program)
+        cpu.load_instructions(assembly.program)
+        assembly.initialize(cpu.memory)
+        cpu.run(config["max_cycles"])
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    data = counters.to_dict()
+    return {
+        "finished": not (cpu.pc < len(cpu.instructions) or cpu.pipeline_busy()),
+        "cycles": cpu.cycles,
+        "instructions": data["instructions"],
+        "cpi": round(data["cpi"], 6) if data["cpi"] is not None else None,
+        "stalls": cpu.stalls,
+        "load_use_stalls": data["stalls"]["load_use"],
+        "branch_stalls": data["stalls"]["branch"],
+        "data_stalls": data["stalls"]["data"],
+        "memory_stalls": cpu.memory_stalls,
+        "fetch_stalls": cpu.fetch_stalls,
+        "flushes": data["flushes"],
+    }
+
+
+def cache_path():
+    """結果快取的 SQLite 檔：MIPS_SWEEP_CACHE（設為 off 時停用），否則為 $XDG_CACHE_HOME/mips-simulator/sweep.sqlite"""
+    path = os.environ.get("MIPS_SWEEP_CACHE")
+    if path:
+        return None if path.lower() in ("off", "0", "none") else Path(path)
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "mips-simulator" / "sweep.sqlite"
+
+
+class ResultCache:
+    """以 (程式雜湊, 設定雜湊, 模擬器版本) 為鍵保存每個點的指標"""
+
+    def __init__(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "program TEXT, config TEXT, version TEXT, metrics TEXT, created REAL, "
+            "PRIMARY KEY (program, config, version))"
+        )
+
+    def get(self, key):
+        row = self.connection.execute("SELECT metrics FROM results WHERE program = ? AND config = ? AND version = ?", key).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, metrics):
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (*key, json.dumps(metrics), time.time()))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def run_sweep(programs, grid, workers=None, cache=True):
+    """
+    對每個程式與 grid 展開的每個設定模擬一次，回傳結果列（dict）的串列，順序為 程式 × 設定。
+    cache 為 True 時已經算過的點（程式內容、設定與模擬器版本都相同）直接取自 ResultCache，只模擬新的點。
+    """
+    points = expand_grid(grid)
+    for config in points:
+        build_components(config)  # 先檢查規格，避免送出後才失敗
+    program_hashes = {program: hashlib.sha256(Path(program).read_bytes()).hexdigest()[:16] for program in programs}
+    version = simulator_version()
+    path = cache_path() if cache else None
+    store = ResultCache(path) if path is not None else None
+
+    rows = []
+    pending = {}  # 快取鍵 -> 需要這個結果的列
+    jobs = []
+    for program in programs:
+        for config in points:
+            row = {"program": str(program), **{name: config[name] for name in grid}}
+            key = (program_hashes[program], config_hash(config), version)
+            metrics = store.get(key) if store is not None else None
+            if metrics is not None:
+                row.update(metrics, cached=True)
+            elif key in pending:
+                pending[key].append(row)
+            else:
+                pending[key] = [row]
+                jobs.append((key, (str(program), config)))
+            rows.append(row)
+
+    if jobs:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (key, _), metrics in zip(jobs, executor.map(run_point, [job for _, job in jobs], chunksize=chunksize)):
+                for row in pending[key]:
+                    row.update(metrics, cached=False)
+                if store is not None and "error" not in metrics:
+                    store.put(key, metrics)
+    if store is not None:
+        store.close()
+    return rows
+
+
+def write_table(path, rows, parameters):
+    """將結果寫成 CSV（副檔名為 .parquet 時需要 pandas 與 pyarrow）"""
+    columns = ["program", *parameters, *METRICS, "cached", "error"]
+    if Path(path).suffix == ".parquet":
+        import pandas
+
+        pandas.DataFrame([{column: row.get(column) for column in columns} for row in rows], columns=columns).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval="")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({column: "" if row.get(column) is None else row.get(column) for column in columns if column in row})
+
+
+def parse_parameter(text):
+    """解析 "名稱=值;值;..."；none 表示 None（max_cycles 為 none 時不限制），register_init/max_cycles 為整數"""
+    name, _, values = text.partition("=")
+    if name not in PARAMETERS or not values:
+        raise ValueError(f"bad sweep parameter {text!r} (expected NAME=VALUE;VALUE..., NAME one of {', '.join(PARAMETERS)})")
+    parsed = []
+    for value in values.split(";"):
+        if value.lower() == "none":
+            parsed.append(None)
+        elif name in INTEGER_PARAMETERS:
+            parsed.append(int(value, 0))
+        else:
+            parsed.append(value)
+    return name, parsed
+
+
+if __name__ == "__main__":
+    from batch import collect_programs
+
+    parser = argparse.ArgumentParser(description="對程式集合掃描流水線設定的組合，結果快取在磁碟上")
+    parser.add_argument("patterns", nargs="+", help="指令檔、目錄或 glob 樣式")
+    parser.add_argument("-p", "--param", action="append", default=[], help='掃描的參數，如 "forwarding=none;ex-mem,mem-wb" 或 "register_init=0;1;2"')
+    parser.add_argument("--grid", type=Path, help="JSON 格式的參數表 {名稱: [值, ...]}（與 -p 合併）")
+    parser.add_argument("-o", "--output", type=Path, default=Path("sweep.csv"), help="結果表（.csv 或 .parquet，預設 sweep.csv）")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="行程數（預設為 CPU 核心數）")
+    parser.add_argument("--no-cache", action="store_true", help="不讀寫結果快取")
+    args = parser.parse_args()
+
+    programs = collect_programs(args.patterns)
+    if not programs:
+        parser.error("no program files matched")
+    grid = {}
+    try:
+        if args.grid:
+            grid.update(json.loads(args.grid.read_text()))
+        for text in args.param:
+            name, values = parse_parameter(text)
+            grid[name] = values
+    except ValueError as error:
+        parser.error(str(error))
+    if args.output.suffix == ".parquet":
+        try:
+            import pandas  # noqa: F401
+        except ImportError:
+            parser.error(".parquet output needs pandas and pyarrow; use .csv instead")
+
+    start = time.perf_counter()
+    try:
+        rows = run_sweep(programs, grid, args.workers, cache=not args.no_cache)
+    except ValueError as error:
+        parser.error(str(error))
+    write_table(args.output, rows, list(grid))
+    simulated = sum(1 for row in rows if row.get("cached") is False)
+    failed = sum(1 for row in rows if "error" in row)
+    print(f"{len(rows)} points ({simulated} simulated, {len(rows) - simulated} cached, {failed} failed) in {time.perf_counter() - start:.2f}s -> {args.output}")